@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+バックグラウンド分析
+文字起こしの分析（Zonos）を応答の処理から切り離し、バックグラウンドのスレッドで
+一定件数または一定時間ごとにまとめて実行します。結果はコールバックで受け取ります。
+分析は応答に含まれないため、キューが満杯の場合は破棄します。
+"""
+
+import os
+import time
+import queue
+import logging
+import threading
+
+logger = logging.getLogger("analysis_batcher")
+
+# バッチの最大件数・最大待ち時間（秒）・キューの上限
+ANALYSIS_BATCH_SIZE = int(os.getenv("ANALYSIS_BATCH_SIZE", "32"))
+ANALYSIS_BATCH_WAIT = float(os.getenv("ANALYSIS_BATCH_WAIT", "0.2"))
+ANALYSIS_QUEUE_SIZE = int(os.getenv("ANALYSIS_QUEUE_SIZE", "1000"))
+
+
+class AnalysisBatcher:
+    """テキストの分析をまとめてバックグラウンドで実行するクラス"""
+
+    def __init__(self, analyze_batch, batch_size=ANALYSIS_BATCH_SIZE, max_wait=ANALYSIS_BATCH_WAIT,
+                 max_queue=ANALYSIS_QUEUE_SIZE):
+        """初期化メソッド"""
+        self.analyze_batch = analyze_batch
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self.submitted = 0
+        self.analyzed = 0
+        self.batches = 0
+        self.dropped = 0
+        self.failed = 0
+        self._thread = threading.Thread(target=self._run, name="analysis-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text, callback):
+        """テキストの分析を予約（キューが満杯の場合は破棄してFalse）"""
+        try:
+            self._queue.put_nowait((text, callback))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            logger.warning("分析キューが満杯のため分析を省略しました")
+            return False
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def _next_batch(self):
+        """最初の1件が来るまで待ち、その後は最大待ち時間までバッチを埋める"""
+        try:
+            batch = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        """キューからバッチを取り出して分析し、結果をコールバックに渡す"""
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if not batch:
+                continue
+
+            try:
+                results = self.analyze_batch([text for text, _ in batch])
+            except Exception as e:
+                logger.error("テキストの分析中にエラーが発生しました: %s", e)
+                with self._lock:
+                    self.failed += len(batch)
+                continue
+
+            for (_, callback), result in zip(batch, results):
+                try:
+                    callback(result)
+                except Exception as e:
+                    logger.error("分析結果の保存中にエラーが発生しました: %s", e)
+            with self._lock:
+                self.analyzed += len(batch)
+                self.batches += 1
+
+    def stats(self):
+        """件数などの統計を返す"""
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "submitted": self.submitted,
+                "analyzed": self.analyzed,
+                "batches": self.batches,
+                "avg_batch_size": self.analyzed / self.batches if self.batches else 0.0,
+                "dropped": self.dropped,
+                "failed": self.failed
+            }
+
+    def close(self, timeout=5):
+        """キューに残った分析を終えてからスレッドを停止"""
+        self._stopping.set()
+        self._thread.join(timeout)
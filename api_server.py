@@ -8,10 +8,12 @@ RESTful APIエンドポイントを提供し、外部からのアクセスを可
 
 import os
 import json
+import time
 import logging
 import tempfile
+import threading
 from pathlib import Path
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context, g
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
@@ -19,38 +21,127 @@ from dotenv import load_dotenv
 # 環境変数の読み込み
 load_dotenv()
 
+# ロギングの設定（統合システムのインポートより前に行う）
+from log_setup import setup_logging, new_request_id, set_request_id, get_request_id, logging_stats
+setup_logging("api_server.log")
+
 # 自作モジュールのインポート
-from asulada_zonos_integration import AsuradaZonosIntegration
+from asulada_zonos_integration import AsuradaZonosIntegration, ConfigurationError
+from audio_io import AudioInput
+from batch_runner import BatchRunner, parse_batch_items, BATCH_MAX_ITEMS
+from job_queue import JobQueue, QueueFullError
+from session_store import valid_session_key
+from response_format import read_options, shape_result, encode_response, dumps_json, parse_flag
+from speech_synth import (
+    split_sentences, audio_frame, encode_audio_stream, SpeechSynthesisError, STREAM_FORMATS, FRAME_AUDIO_FORMATS
+)
+from stage_metrics import stage_metrics, timed, begin_request_spans, format_server_timing, DEBUG_TIMING
 
 # Flaskアプリケーションの初期化
 app = Flask(__name__)
 CORS(app)  # Cross-Origin Resource Sharingを有効化
 
-# ロギングの設定
-logging.basicConfig(
-    level=logging.INFO if os.getenv("DEBUG", "False").lower() != "true" else logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("api_server.log")
-    ]
-)
 logger = logging.getLogger("api_server")
 
-# アップロードされた音声ファイルの保存先
-UPLOAD_FOLDER = os.path.join(os.getcwd(), "uploads")
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-
 # 許可する音声ファイルの拡張子
 ALLOWED_EXTENSIONS = {'mp3', 'wav', 'ogg', 'flac'}
 
-# 統合システムのインスタンスを作成
-integration = AsuradaZonosIntegration()
+# 統合システム・バッチ処理・ジョブキュー（ワーカープロセスごとにinit_servicesで作成）
+integration = None
+batch_runner = None
+job_queue = None
+_services_lock = threading.Lock()
+
+# サービスの状態（starting / ready / draining / error）
+service_state = {"status": "starting", "error": None}
+
+# 終了時にジョブの完了を待つ最大秒数
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "25"))
+
+def init_services():
+    """統合システムなどのサービスを作成（フォーク後のワーカープロセス内で呼ぶ）"""
+    global integration, batch_runner, job_queue
+    with _services_lock:
+        if integration is not None:
+            return
+        try:
+            created = AsuradaZonosIntegration()
+        except ConfigurationError as e:
+            service_state.update(status="error", error=str(e))
+            raise
+        batch_runner = BatchRunner(created)
+        job_queue = JobQueue(lambda audio_input: created.run(audio_file=audio_input, use_dify=True))
+        integration = created
+
+def warm_up():
+    """サービスを作成し、上流への接続と音声処理スタックを準備してからreadyにする"""
+    init_services()
+    integration.warm_up()
+    service_state.update(status="ready", error=None)
+    logger.info("ワーカーの準備が完了しました（PID: %s）", os.getpid())
+
+def mark_draining():
+    """終了処理中としてreadinessを落とす（シグナルハンドラから呼ぶためログは出さない）"""
+    service_state["status"] = "draining"
+
+def shutdown_services():
+    """新規ジョブの受け付けを止め、実行中のジョブを待ってから停止"""
+    mark_draining()
+    logger.info("終了処理を開始します（PID: %s）", os.getpid())
+    if job_queue is not None:
+        job_queue.drain(DRAIN_TIMEOUT)
+        job_queue.shutdown()
+    if batch_runner is not None:
+        batch_runner.shutdown()
+    if integration is not None:
+        integration.close()
+
+@app.before_request
+def assign_request_id():
+    """リクエストIDを設定（クライアントが指定したX-Request-IDがあればそれを使用）"""
+    set_request_id(new_request_id(request.headers.get('X-Request-ID')))
+    begin_request_spans()
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def add_request_id_header(response):
+    """レスポンスにリクエストIDを付与し、エンドポイント全体の所要時間を記録"""
+    response.headers['X-Request-ID'] = get_request_id()
+    started = g.get('request_started')
+    if started is not None and request.endpoint != 'metrics':
+        elapsed = time.perf_counter() - started
+        stage = f"http.{request.endpoint or 'unknown'}"
+        stage_metrics.observe(stage, elapsed, error=response.status_code >= 500)
+        # デバッグ時は各段階の所要時間をServer-Timingヘッダーで返す
+        if DEBUG_TIMING:
+            response.headers['Server-Timing'] = format_server_timing([(stage, elapsed)])
+    return response
+
+@app.before_request
+def ensure_services():
+    """APIリクエストの前にサービスが作成されていることを確認"""
+    if request.endpoint in ('healthz', 'readyz', 'metrics') or integration is not None:
+        return None
+    try:
+        init_services()
+    except ConfigurationError:
+        return jsonify({"error": "サーバーの設定が不足しています"}), 503
+    return None
 
 def allowed_file(filename):
     """アップロードされたファイルが許可された拡張子を持つか確認"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def read_session_key(data):
+    """リクエストからセッションキーを取得（戻り値は(セッションキー, エラーレスポンス)）"""
+    session_key = data.get('session_key') if data else None
+    if session_key is None:
+        return None, None
+    if not valid_session_key(session_key):
+        logger.error("不正なセッションキーが指定されました")
+        return None, (jsonify({"error": "不正なセッションキーです"}), 400)
+    return session_key, None
+
 @app.route('/')
 def index():
     """ルートエンドポイント - APIの基本情報を返す"""
@@ -59,12 +150,38 @@ def index():
         "version": "1.0.0",
         "endpoints": [
             {"path": "/", "method": "GET", "description": "APIの基本情報を取得"},
+            {"path": "/healthz", "method": "GET", "description": "ライブネスプローブ"},
+            {"path": "/readyz", "method": "GET", "description": "レディネスプローブ"},
             {"path": "/api/process-text", "method": "POST", "description": "テキスト入力を処理"},
+            {"path": "/api/process-text/stream", "method": "POST", "description": "テキスト入力を処理し、回答をストリーミングで返す（SSE / NDJSON）"},
             {"path": "/api/process-audio", "method": "POST", "description": "音声ファイルを処理"},
-            {"path": "/api/direct-response", "method": "POST", "description": "Zonosを使用して直接レスポンスを生成"}
+            {"path": "/api/direct-response", "method": "POST", "description": "Zonosを使用して直接レスポンスを生成"},
+            {"path": "/api/jobs/process-audio", "method": "POST", "description": "音声ファイルの処理をジョブとして受け付け"},
+            {"path": "/api/jobs/<job_id>", "method": "GET", "description": "ジョブの状態と結果を取得（?wait=秒でロングポーリング）"},
+            {"path": "/api/speak", "method": "POST", "description": "テキストを文ごとに音声に合成し、ストリーミングで返す（WAV / PCM / SSE / NDJSON）"},
+            {"path": "/api/batch", "method": "POST", "description": "複数のテキスト入力を並列に処理し、NDJSONで結果を返す"},
+            {"path": "/api/sessions/<session_key>", "method": "DELETE", "description": "会話セッションを終了"},
+            {"path": "/api/stats", "method": "GET", "description": "キャッシュや上流APIの統計情報を取得"},
+            {"path": "/metrics", "method": "GET", "description": "処理段階ごとの所要時間（Prometheus形式）"}
         ]
     })
 
+@app.route('/healthz')
+def healthz():
+    """ライブネスプローブ - プロセスが応答できるかを返す"""
+    return jsonify({"status": "ok"})
+
+@app.route('/readyz')
+def readyz():
+    """レディネスプローブ - ウォームアップが完了し、リクエストを受け付けられるかを返す"""
+    status_code = 200 if service_state["status"] == "ready" else 503
+    return jsonify(service_state), status_code
+
+@app.route('/metrics')
+def metrics():
+    """処理段階ごとの所要時間とエラー数をPrometheusのテキスト形式で返すエンドポイント"""
+    return Response(stage_metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/process-text', methods=['POST'])
 def process_text():
     """テキスト入力を処理するエンドポイント"""
@@ -74,46 +191,187 @@ def process_text():
         logger.error("リクエストにテキストが含まれていません")
         return jsonify({"error": "テキストが必要です"}), 400
     
+    session_key, error = read_session_key(data)
+    if error:
+        return error
+    
     text_input = data['text']
-    logger.info(f"テキスト処理リクエストを受信: {text_input[:50]}...")
+    logger.info("テキスト処理リクエストを受信: %.50s...", text_input)
     
     # 統合システムを使用してテキストを処理
-    result = integration.run(text_input=text_input, use_dify=True)
+    result = integration.run(text_input=text_input, use_dify=True, session_key=session_key)
     
-    return jsonify(result)
+    return render_result_or_speech(result)
 
-@app.route('/api/process-audio', methods=['POST'])
-def process_audio():
-    """音声ファイルを処理するエンドポイント"""
+def request_options():
+    """リクエストのfieldsとcompactの指定を読み取る（クエリ、JSONボディ、フォームの順）"""
+    body = request.get_json(silent=True) if request.is_json else request.form
+    return read_options(request.args, body)
+
+def render_result(result, status=200, headers=None):
+    """処理結果をリクエストの指定（fields・compact・Accept・Accept-Encoding）に合わせて返す"""
+    fields, compact = request_options()
+    body, response_headers = encode_response(
+        shape_result(result, fields, compact),
+        request.headers.get('Accept', ''),
+        request.headers.get('Accept-Encoding', '')
+    )
+    response_headers.update(headers or {})
+    return Response(body, status=status, headers=response_headers)
+
+def read_speech_options():
+    """読み上げの指定（speak・voice・audio_format）をクエリ、JSONボディ、フォームの順に読み取る"""
+    body = request.get_json(silent=True) if request.is_json else request.form
+    body = body if hasattr(body, 'get') else {}
+    speak = parse_flag(request.args.get('speak'))
+    if speak is None:
+        speak = parse_flag(body.get('speak')) or False
+    voice = request.args.get('voice') or body.get('voice')
+    audio_format = request.args.get('audio_format') or body.get('audio_format') or 'wav'
+    if audio_format not in FRAME_AUDIO_FORMATS:
+        audio_format = 'wav'
+    return speak, voice, audio_format
+
+def render_result_or_speech(result):
+    """speakが指定されていれば結果を読み上げる音声をストリーミングし、なければ通常どおり結果を返す"""
+    speak, voice, audio_format = read_speech_options()
+    if not speak or not result or result.get('status') != 'success':
+        return render_result(result)
+    frames = integration.speak_frames([{"event": "done", "result": result}], voice, audio_format)
+    return stream_frames(frames)
+
+def wants_ndjson():
+    """Acceptヘッダーまたはクエリパラメータでストリーミングの形式にNDJSONが選ばれているか（デフォルトはSSE）"""
+    return (
+        request.args.get('format') == 'ndjson'
+        or request.accept_mimetypes.best == 'application/x-ndjson'
+    )
+
+def stream_frames(frames, ndjson=None):
+    """フレームのジェネレータをSSEまたはNDJSONのストリーミングレスポンスにする（最終結果はfields・compactで整形）"""
+    ndjson = wants_ndjson() if ndjson is None else ndjson
+    mimetype = 'application/x-ndjson' if ndjson else 'text/event-stream'
+    fields, compact = request_options()
+    
+    def generate():
+        for frame in frames:
+            if "result" in frame:
+                frame = dict(frame, result=shape_result(frame["result"], fields, compact))
+            yield format_stream_frame(frame, ndjson=ndjson)
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def format_stream_frame(frame, ndjson=False):
+    """ストリーミング用のフレームをSSEまたはNDJSONの1行に変換"""
+    data = dumps_json(frame).decode('utf-8')
+    if ndjson:
+        return data + "\n"
+    return f"event: {frame.get('event', 'message')}\ndata: {data}\n\n"
+
+@app.route('/api/process-text/stream', methods=['POST'])
+def process_text_stream():
+    """テキスト入力を処理し、Difyの回答をチャンクごとにストリーミングで返すエンドポイント"""
+    data = request.json
+    
+    if not data or 'text' not in data:
+        logger.error("リクエストにテキストが含まれていません")
+        return jsonify({"error": "テキストが必要です"}), 400
+    
+    session_key, error = read_session_key(data)
+    if error:
+        return error
+    
+    text_input = data['text']
+    logger.info("ストリーミングテキスト処理リクエストを受信: %.50s...", text_input)
+    
+    frames = integration.stream_with_zonos(text_input, session_key=session_key)
+    
+    # speakが指定されていれば、回答の文が完成するごとに音声のフレームを挟む
+    speak, voice, audio_format = read_speech_options()
+    if speak:
+        frames = integration.speak_frames(frames, voice, audio_format)
+    
+    return stream_frames(frames)
+
+def read_audio_upload():
+    """アップロードされた音声ファイルを検証して読み込む（戻り値は(AudioInput, エラーレスポンス)）"""
     # ファイルがリクエストに含まれているか確認
     if 'audio' not in request.files:
         logger.error("リクエストに音声ファイルが含まれていません")
-        return jsonify({"error": "音声ファイルが必要です"}), 400
+        return None, (jsonify({"error": "音声ファイルが必要です"}), 400)
     
     file = request.files['audio']
     
     # ファイル名が空でないか確認
     if file.filename == '':
         logger.error("ファイル名が空です")
-        return jsonify({"error": "ファイル名が空です"}), 400
+        return None, (jsonify({"error": "ファイル名が空です"}), 400)
     
     # ファイルが許可された形式か確認
     if not allowed_file(file.filename):
-        logger.error(f"許可されていないファイル形式: {file.filename}")
-        return jsonify({"error": "許可されていないファイル形式です"}), 400
+        logger.error("許可されていないファイル形式: %s", file.filename)
+        return None, (jsonify({"error": "許可されていないファイル形式です"}), 400)
     
-    # 安全なファイル名を生成
+    # アップロードをメモリ上に読み込み（大きい場合のみ一時ファイルに退避）
     filename = secure_filename(file.filename)
-    filepath = os.path.join(UPLOAD_FOLDER, filename)
+    with timed("upload"):
+        audio_input = AudioInput.from_stream(file.stream, filename=filename)
+    logger.info("音声ファイルを受信しました: %s（%dバイト）", filename, audio_input.size)
+    return audio_input, None
+
+@app.route('/api/process-audio', methods=['POST'])
+def process_audio():
+    """音声ファイルを処理するエンドポイント"""
+    session_key, error = read_session_key(request.form)
+    if error:
+        return error
     
-    # ファイルを保存
-    file.save(filepath)
-    logger.info(f"音声ファイルを保存しました: {filepath}")
+    audio_input, error = read_audio_upload()
+    if error:
+        return error
     
     # 統合システムを使用して音声ファイルを処理
-    result = integration.run(audio_file=filepath, use_dify=True)
+    with audio_input:
+        result = integration.run(audio_file=audio_input, use_dify=True, session_key=session_key)
+    
+    return render_result_or_speech(result)
+
+@app.route('/api/jobs/process-audio', methods=['POST'])
+def submit_audio_job():
+    """音声ファイルの処理をジョブとして受け付け、すぐにジョブIDを返すエンドポイント"""
+    audio_input, error = read_audio_upload()
+    if error:
+        return error
+    
+    try:
+        job = job_queue.submit(audio_input)
+    except QueueFullError:
+        audio_input.close()
+        logger.warning("ジョブキューが満杯のためリクエストを拒否しました")
+        return jsonify({"error": "混雑しています。しばらくしてから再試行してください"}), 429, {"Retry-After": "5"}
     
-    return jsonify(result)
+    status_url = f"/api/jobs/{job.id}"
+    return jsonify({"job_id": job.id, "status": job.status, "status_url": status_url}), 202, {"Location": status_url}
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """ジョブの状態と結果を返すエンドポイント（?wait=秒でロングポーリング）"""
+    wait = request.args.get('wait', default=0, type=float)
+    job = job_queue.wait(job_id, wait)
+    
+    if job is None:
+        return jsonify({"error": "ジョブが見つかりません"}), 404
+    
+    data = job.to_dict()
+    if "result" in data:
+        fields, compact = request_options()
+        data["result"] = shape_result(data["result"], fields, compact)
+    body, headers = encode_response(data, request.headers.get('Accept', ''), request.headers.get('Accept-Encoding', ''))
+    return Response(body, headers=headers)
 
 @app.route('/api/direct-response', methods=['POST'])
 def direct_response():
@@ -124,13 +382,166 @@ def direct_response():
         logger.error("リクエストにテキストが含まれていません")
         return jsonify({"error": "テキストが必要です"}), 400
     
+    session_key, error = read_session_key(data)
+    if error:
+        return error
+    
     text_input = data['text']
-    logger.info(f"直接レスポンス生成リクエストを受信: {text_input[:50]}...")
+    logger.info("直接レスポンス生成リクエストを受信: %.50s...", text_input)
     
     # 統合システムを使用して直接レスポンスを生成
-    result = integration.run(text_input=text_input, use_dify=False)
+    result = integration.run(text_input=text_input, use_dify=False, session_key=session_key)
+    
+    return render_result_or_speech(result)
+
+@app.route('/api/speak', methods=['POST'])
+def speak():
+    """テキストを文ごとに音声に合成し、合成できた文から順にストリーミングで返すエンドポイント"""
+    data = request.get_json(silent=True)
+    
+    if not data or not data.get('text'):
+        logger.error("リクエストにテキストが含まれていません")
+        return jsonify({"error": "テキストが必要です"}), 400
     
-    return jsonify(result)
+    # 出力形式（wav: ストリーミング用WAV、pcm: 16bitモノラルPCM、sse/ndjson: 文ごとのフレーム）
+    stream_format = request.args.get('format') or data.get('format') or 'wav'
+    if stream_format not in STREAM_FORMATS:
+        return jsonify({"error": f"出力形式は{', '.join(STREAM_FORMATS)}のいずれかです"}), 400
+    
+    _, voice, audio_format = read_speech_options()
+    sentences = split_sentences(data['text'])
+    logger.info("音声合成リクエストを受信: %d文（%s）", len(sentences), stream_format)
+    
+    if stream_format in ('sse', 'ndjson'):
+        def frames():
+            duration = 0.0
+            try:
+                for chunk in integration.speech.stream(sentences, voice):
+                    duration += chunk["duration"]
+                    yield audio_frame(chunk, audio_format)
+            except SpeechSynthesisError as e:
+                logger.error("音声合成に失敗しました: %s", e)
+                yield {"event": "error", "status": "error", "message": "音声合成に失敗しました"}
+                return
+            yield {"event": "done", "result": {
+                "status": "success", "sentences": len(sentences), "duration": round(duration, 3)
+            }}
+        return stream_frames(frames(), ndjson=stream_format == 'ndjson')
+    
+    # 最初の文を合成してからレスポンスを始める（サンプリングレートをヘッダーに載せ、失敗はステータスで返す）
+    chunks = integration.speech.stream(sentences, voice)
+    try:
+        first = next(chunks)
+    except SpeechSynthesisError as e:
+        logger.error("音声合成に失敗しました: %s", e)
+        return jsonify({"error": "音声合成に失敗しました"}), 502
+    
+    def generate():
+        try:
+            yield from encode_audio_stream(first, chunks, stream_format)
+        except SpeechSynthesisError as e:
+            # 送信済みの音声は取り消せないため、途中で打ち切る
+            logger.error("音声合成に失敗しました: %s", e)
+    
+    mimetype = 'audio/wav' if stream_format == 'wav' else f"audio/L16;rate={first['sample_rate']};channels=1"
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            "X-Audio-Sample-Rate": str(first["sample_rate"]),
+            "X-Sentence-Count": str(len(sentences))
+        }
+    )
+
+def read_batch_items():
+    """リクエストボディからバッチのアイテム一覧を読み込む（JSON配列またはJSONL）"""
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl', 'application/x-jsonlines'):
+        lines = request.get_data(as_text=True).splitlines()
+        return [json.loads(line) for line in lines if line.strip()]
+    
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('items')
+    return data if isinstance(data, list) else None
+
+@app.route('/api/batch', methods=['POST'])
+def batch():
+    """複数のテキスト入力を並列に処理し、完了した順にNDJSONでストリーミングするエンドポイント"""
+    try:
+        items = read_batch_items()
+    except ValueError:
+        logger.error("バッチのJSONLを解析できませんでした")
+        return jsonify({"error": "不正なJSONLです"}), 400
+    
+    if not items:
+        logger.error("リクエストにアイテムが含まれていません")
+        return jsonify({"error": "アイテムの配列が必要です"}), 400
+    
+    if len(items) > BATCH_MAX_ITEMS:
+        logger.error("バッチのアイテム数が上限を超えています: %s", len(items))
+        return jsonify({"error": f"アイテム数の上限は{BATCH_MAX_ITEMS}件です"}), 413
+    
+    concurrency = request.args.get('concurrency', type=int)
+    logger.info("バッチ処理リクエストを受信: %d件（同時実行数: %d）", len(items), concurrency or batch_runner.max_workers)
+    
+    parsed = parse_batch_items(items)
+    valid = [item for item, error in parsed if error is None]
+    fields, compact = request_options()
+    
+    def generate():
+        # 不正なアイテムは先にエラーとして返す
+        for item, error in parsed:
+            if error is not None:
+                yield dumps_json({"id": item["id"], "index": item["index"], "result": {"status": "error", "message": error}}) + b"\n"
+        
+        for item, result in batch_runner.run(valid, concurrency=concurrency):
+            yield dumps_json({"id": item["id"], "index": item["index"], "result": shape_result(result, fields, compact)}) + b"\n"
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route('/api/sessions/<session_key>', methods=['DELETE'])
+def end_session(session_key):
+    """会話セッションを終了するエンドポイント"""
+    if not integration.session_store.end(session_key):
+        return jsonify({"error": "セッションが見つかりません"}), 404
+    
+    logger.info("会話セッションを終了しました")
+    return jsonify({"status": "success", "message": "セッションを終了しました"})
+
+@app.route('/api/stats', methods=['GET'])
+def stats():
+    """キャッシュや上流APIの統計情報を返すエンドポイント"""
+    return jsonify({
+        "response_cache": integration.response_cache.stats(),
+        "transcript_cache": integration.transcript_cache.stats(),
+        "sessions": integration.session_store.stats(),
+        "analysis": integration.analysis_batcher.stats(),
+        "dify": integration.dify_client.metrics.snapshot(),
+        "asr": (
+            {integration.asr_backend.name: integration.asr_backend.stats.snapshot()}
+            if integration.audio_stack_loaded else {}
+        ),
+        "preprocess": integration.audio_preprocessor.stats(),
+        "speech": integration.speech.stats(),
+        "zonos": integration.zonos_engine.stats() if integration.zonos_engine is not None else {"workers": 0},
+        "coalescing": {
+            "response": integration.response_flight.stats(),
+            "transcript": integration.transcript_flight.stats()
+        },
+        "upstream": {
+            "dify": integration.dify_guard.stats(),
+            "asr": integration.asr_guard.stats()
+        },
+        "jobs": job_queue.stats(),
+        "logging": logging_stats(),
+        "stages": stage_metrics.snapshot()
+    })
 
 @app.errorhandler(404)
 def not_found(error):
@@ -140,7 +551,7 @@ def not_found(error):
 @app.errorhandler(500)
 def server_error(error):
     """500エラーハンドラ"""
-    logger.error(f"サーバーエラー: {error}")
+    logger.error("サーバーエラー: %s", error)
     return jsonify({"error": "サーバー内部エラー"}), 500
 
 if __name__ == '__main__':
@@ -150,7 +561,12 @@ if __name__ == '__main__':
     # デバッグモードで実行するかどうか
     debug = os.getenv('DEBUG', 'False').lower() == 'true'
     
-    logger.info(f"APIサーバーを起動します（ポート: {port}, デバッグモード: {debug}）")
+    logger.info("APIサーバーを起動します（ポート: %s, デバッグモード: %s）", port, debug)
+    logger.info("本番環境では gunicorn -c gunicorn.conf.py api_server:app で起動してください")
     
-    # サーバーを起動
-    app.run(host='0.0.0.0', port=port, debug=debug) 
\ No newline at end of file
+    # サービスを準備してから開発用サーバーを起動
+    try:
+        warm_up()
+    except ConfigurationError:
+        raise SystemExit(1)
+    app.run(host='0.0.0.0', port=port, debug=debug, threaded=True)
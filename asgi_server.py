@@ -0,0 +1,438 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Asurada GPT + Zonos 統合システム ASGIサーバー
+api_server.pyと同じエンドポイントをasyncioベースで提供し、
+1プロセスで多数の上流API呼び出しを同時に扱えるようにします。
+
+/ws/voiceでは、WebSocketで送られる音声を逐次認識して会話する音声セッションを提供します。
+
+起動例:
+    uvicorn asgi_server:app --host 0.0.0.0 --port 8000
+"""
+
+import os
+import time
+import contextlib
+import logging
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route, WebSocketRoute
+from starlette.websockets import WebSocketDisconnect
+from werkzeug.utils import secure_filename
+from dotenv import load_dotenv
+
+# 環境変数の読み込み
+load_dotenv()
+
+# ロギングの設定（統合システムのインポートより前に行う）
+from log_setup import setup_logging
+setup_logging("asgi_server.log")
+
+# 自作モジュールのインポート
+from asulada_zonos_integration import AsuradaZonosIntegration
+from audio_io import AudioInput
+from log_setup import new_request_id, set_request_id, request_id_var, run_in_executor
+from stage_metrics import stage_metrics, begin_request_spans, format_server_timing, DEBUG_TIMING
+from response_format import read_options, shape_result, encode_response, dumps_json, parse_flag
+from speech_synth import split_sentences, audio_frame, encode_audio_stream, SpeechSynthesisError, STREAM_FORMATS, FRAME_AUDIO_FORMATS
+from session_store import valid_session_key
+from voice_session import VoiceSession, VOICE_SAMPLE_RATE, VOICE_MIN_SAMPLE_RATE, VOICE_MAX_SAMPLE_RATE
+
+logger = logging.getLogger("asgi_server")
+
+# 許可する音声ファイルの拡張子
+ALLOWED_EXTENSIONS = {'mp3', 'wav', 'ogg', 'flac'}
+
+# 統合システムのインスタンス（起動時に作成）
+integration = None
+
+def allowed_file(filename):
+    """アップロードされたファイルが許可された拡張子を持つか確認"""
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+async def read_json(request):
+    """リクエストボディをJSONとして読み込む（不正な場合はNone）"""
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+def render_result(request, result, body=None):
+    """処理結果をリクエストの指定（fields・compact・Accept・Accept-Encoding）に合わせて返す"""
+    fields, compact = read_options(request.query_params, body)
+    content, headers = encode_response(
+        shape_result(result, fields, compact),
+        request.headers.get('accept', ''),
+        request.headers.get('accept-encoding', '')
+    )
+    return Response(content, headers=headers)
+
+def read_speech_options(request, body=None):
+    """読み上げの指定（speak・voice・audio_format）をクエリ、ボディ（JSONまたはフォーム）の順に読み取る"""
+    body = body if hasattr(body, 'get') else {}
+    params = request.query_params
+    speak = parse_flag(params.get('speak'))
+    if speak is None:
+        speak = parse_flag(body.get('speak')) or False
+    voice = params.get('voice') or body.get('voice')
+    audio_format = params.get('audio_format') or body.get('audio_format') or 'wav'
+    if audio_format not in FRAME_AUDIO_FORMATS:
+        audio_format = 'wav'
+    return speak, voice, audio_format
+
+def wants_ndjson(request):
+    """Acceptヘッダーまたはクエリパラメータでストリーミングの形式にNDJSONが選ばれているか（デフォルトはSSE）"""
+    accept = request.headers.get('accept', '').split(',')[0].strip()
+    return request.query_params.get('format') == 'ndjson' or accept.startswith('application/x-ndjson')
+
+def format_stream_frame(frame, ndjson=False):
+    """ストリーミング用のフレームをSSEまたはNDJSONの1行に変換"""
+    data = dumps_json(frame).decode('utf-8')
+    if ndjson:
+        return data + "\n"
+    return f"event: {frame.get('event', 'message')}\ndata: {data}\n\n"
+
+def stream_frames(request, frames, body=None):
+    """フレームのジェネレータをSSEまたはNDJSONのストリーミングレスポンスにする（最終結果はfields・compactで整形）"""
+    ndjson = wants_ndjson(request)
+    fields, compact = read_options(request.query_params, body)
+
+    # 合成はブロッキング処理のため、同期ジェネレータとしてスレッドプールで実行される
+    def generate():
+        for frame in frames:
+            if "result" in frame:
+                frame = dict(frame, result=shape_result(frame["result"], fields, compact))
+            yield format_stream_frame(frame, ndjson=ndjson)
+
+    return StreamingResponse(
+        generate(),
+        media_type='application/x-ndjson' if ndjson else 'text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def render_result_or_speech(request, result, body=None):
+    """speakが指定されていれば結果を読み上げる音声をストリーミングし、なければ通常どおり結果を返す"""
+    speak, voice, audio_format = read_speech_options(request, body)
+    if not speak or not result or result.get('status') != 'success':
+        return render_result(request, result, body)
+    frames = integration.speak_frames([{"event": "done", "result": result}], voice, audio_format)
+    return stream_frames(request, frames, body)
+
+class RequestIdMiddleware:
+    """リクエストIDを設定してX-Request-IDヘッダーに付与し、エンドポイント全体の所要時間を記録するASGIミドルウェア"""
+
+    def __init__(self, app):
+        """初期化メソッド"""
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        requested = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")
+        request_id = new_request_id(requested)
+        token = set_request_id(request_id)
+        begin_request_spans()
+        started = time.perf_counter()
+        recorded = False
+
+        def record(status_code):
+            """http.<エンドポイント名>の所要時間を記録（/metricsは除く）、記録した場合は(段階, 秒)を返す"""
+            nonlocal recorded
+            recorded = True
+            # ルーティング後のscopeにエンドポイントの関数が入る
+            endpoint = getattr(scope.get("endpoint"), "__name__", None) or "unknown"
+            if endpoint == "metrics":
+                return None
+            elapsed = time.perf_counter() - started
+            stage = f"http.{endpoint}"
+            stage_metrics.observe(stage, elapsed, error=status_code >= 500)
+            return stage, elapsed
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+                span = record(message["status"])
+                # デバッグ時は各段階の所要時間をServer-Timingヘッダーで返す
+                if DEBUG_TIMING and span is not None:
+                    headers.append((b"server-timing", format_server_timing([span]).encode("latin-1")))
+                message["headers"] = headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            if not recorded:
+                # レスポンスを返す前に例外で終わった場合
+                record(500)
+            request_id_var.reset(token)
+
+def read_session_key(data):
+    """リクエストからセッションキーを取得（戻り値は(セッションキー, エラーレスポンス)）"""
+    session_key = data.get('session_key') if data else None
+    if session_key is None:
+        return None, None
+    if not valid_session_key(session_key):
+        logger.error("不正なセッションキーが指定されました")
+        return None, JSONResponse({"error": "不正なセッションキーです"}, status_code=400)
+    return session_key, None
+
+async def index(request):
+    """ルートエンドポイント - APIの基本情報を返す"""
+    return JSONResponse({
+        "name": "Asurada GPT + Zonos 統合システム API (ASGI)",
+        "version": "1.0.0",
+        "endpoints": [
+            {"path": "/", "method": "GET", "description": "APIの基本情報を取得"},
+            {"path": "/api/process-text", "method": "POST", "description": "テキスト入力を処理"},
+            {"path": "/api/process-audio", "method": "POST", "description": "音声ファイルを処理"},
+            {"path": "/api/direct-response", "method": "POST", "description": "Zonosを使用して直接レスポンスを生成"},
+            {"path": "/api/speak", "method": "POST", "description": "テキストを文ごとに音声に合成し、ストリーミングで返す（WAV / PCM / SSE / NDJSON）"},
+            {"path": "/ws/voice", "method": "WebSocket", "description": "PCMを送りながら話すと、発話の終わりで回答（と音声）を返す音声会話セッション"}
+        ]
+    })
+
+async def process_text(request):
+    """テキスト入力を処理するエンドポイント"""
+    data = await read_json(request)
+
+    if not data or 'text' not in data:
+        logger.error("リクエストにテキストが含まれていません")
+        return JSONResponse({"error": "テキストが必要です"}, status_code=400)
+
+    session_key, error = read_session_key(data)
+    if error:
+        return error
+
+    text_input = data['text']
+    logger.info("テキスト処理リクエストを受信: %s...", text_input[:50])
+
+    result = await integration.run_async(text_input=text_input, use_dify=True, session_key=session_key)
+
+    return render_result_or_speech(request, result, data)
+
+async def process_audio(request):
+    """音声ファイルを処理するエンドポイント"""
+    form = await request.form()
+    file = form.get('audio')
+
+    session_key, error = read_session_key(form)
+    if error:
+        return error
+
+    # ファイルがリクエストに含まれているか確認
+    if file is None or isinstance(file, str):
+        logger.error("リクエストに音声ファイルが含まれていません")
+        return JSONResponse({"error": "音声ファイルが必要です"}, status_code=400)
+
+    # ファイル名が空でないか確認
+    if not file.filename:
+        logger.error("ファイル名が空です")
+        return JSONResponse({"error": "ファイル名が空です"}, status_code=400)
+
+    # ファイルが許可された形式か確認
+    if not allowed_file(file.filename):
+        logger.error("許可されていないファイル形式: %s", file.filename)
+        return JSONResponse({"error": "許可されていないファイル形式です"}, status_code=400)
+
+    # アップロードをメモリ上に読み込み（大きい場合のみ一時ファイルに退避）
+    filename = secure_filename(file.filename)
+    audio_input = await run_in_executor(AudioInput.from_stream, file.file, filename)
+    with audio_input:
+        logger.info("音声ファイルを受信しました: %s（%sバイト）", filename, audio_input.size)
+        result = await integration.run_async(audio_file=audio_input, use_dify=True, session_key=session_key)
+
+    return render_result_or_speech(request, result, form)
+
+async def direct_response(request):
+    """Zonosを使用して直接レスポンスを生成するエンドポイント"""
+    data = await read_json(request)
+
+    if not data or 'text' not in data:
+        logger.error("リクエストにテキストが含まれていません")
+        return JSONResponse({"error": "テキストが必要です"}, status_code=400)
+
+    session_key, error = read_session_key(data)
+    if error:
+        return error
+
+    text_input = data['text']
+    logger.info("直接レスポンス生成リクエストを受信: %s...", text_input[:50])
+
+    result = await integration.run_async(text_input=text_input, use_dify=False, session_key=session_key)
+
+    return render_result_or_speech(request, result, data)
+
+def speech_frames(sentences, voice, audio_format, ndjson):
+    """文ごとに合成した音声をSSEまたはNDJSONのフレームにするジェネレータ（スレッドプールで実行される）"""
+    duration = 0.0
+    try:
+        for chunk in integration.speech.stream(sentences, voice):
+            duration += chunk["duration"]
+            yield format_stream_frame(audio_frame(chunk, audio_format), ndjson=ndjson)
+    except SpeechSynthesisError as e:
+        logger.error("音声合成に失敗しました: %s", e)
+        yield format_stream_frame({"event": "error", "status": "error", "message": "音声合成に失敗しました"}, ndjson=ndjson)
+        return
+    yield format_stream_frame({"event": "done", "result": {
+        "status": "success", "sentences": len(sentences), "duration": round(duration, 3)
+    }}, ndjson=ndjson)
+
+def audio_bytes(first, chunks, stream_format):
+    """音声のバイト列のストリーム（途中で合成に失敗した場合は打ち切る）"""
+    try:
+        yield from encode_audio_stream(first, chunks, stream_format)
+    except SpeechSynthesisError as e:
+        logger.error("音声合成に失敗しました: %s", e)
+
+async def speak(request):
+    """テキストを文ごとに音声に合成し、合成できた文から順にストリーミングで返すエンドポイント"""
+    data = await read_json(request)
+
+    if not data or not data.get('text'):
+        logger.error("リクエストにテキストが含まれていません")
+        return JSONResponse({"error": "テキストが必要です"}, status_code=400)
+
+    stream_format = request.query_params.get('format') or data.get('format') or 'wav'
+    if stream_format not in STREAM_FORMATS:
+        return JSONResponse({"error": f"出力形式は{', '.join(STREAM_FORMATS)}のいずれかです"}, status_code=400)
+
+    voice = request.query_params.get('voice') or data.get('voice')
+    audio_format = request.query_params.get('audio_format') or data.get('audio_format') or 'wav'
+    if audio_format not in FRAME_AUDIO_FORMATS:
+        audio_format = 'wav'
+    sentences = split_sentences(data['text'])
+    logger.info("音声合成リクエストを受信: %s文（%s）", len(sentences), stream_format)
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+    # 合成はブロッキング処理のため、同期ジェネレータとしてスレッドプールで実行される
+    if stream_format in ('sse', 'ndjson'):
+        ndjson = stream_format == 'ndjson'
+        return StreamingResponse(
+            speech_frames(sentences, voice, audio_format, ndjson),
+            media_type='application/x-ndjson' if ndjson else 'text/event-stream',
+            headers=headers
+        )
+
+    # 最初の文を合成してからレスポンスを始める（サンプリングレートをヘッダーに載せ、失敗はステータスで返す）
+    chunks = integration.speech.stream(sentences, voice)
+    try:
+        first = await run_in_executor(next, chunks)
+    except SpeechSynthesisError as e:
+        logger.error("音声合成に失敗しました: %s", e)
+        return JSONResponse({"error": "音声合成に失敗しました"}, status_code=502)
+
+    headers.update({"X-Audio-Sample-Rate": str(first["sample_rate"]), "X-Sentence-Count": str(len(sentences))})
+    return StreamingResponse(
+        audio_bytes(first, chunks, stream_format),
+        media_type='audio/wav' if stream_format == 'wav' else f"audio/L16;rate={first['sample_rate']};channels=1",
+        headers=headers
+    )
+
+async def voice(websocket):
+    """音声会話のWebSocketエンドポイント（?sample_rate=・session_key=・speak=・voice=・compact=）"""
+    params = websocket.query_params
+    token = set_request_id(new_request_id(websocket.headers.get('x-request-id')))
+    try:
+        # 接続時の指定を検証（不正な場合は接続を受け付けない）
+        try:
+            sample_rate = int(params.get('sample_rate') or VOICE_SAMPLE_RATE)
+        except ValueError:
+            sample_rate = 0
+        session_key = params.get('session_key')
+        if not VOICE_MIN_SAMPLE_RATE <= sample_rate <= VOICE_MAX_SAMPLE_RATE:
+            logger.error("音声セッションのサンプリングレートが不正です: %s", params.get('sample_rate'))
+            await websocket.close(code=1008)
+            return
+        if session_key is not None and not valid_session_key(session_key):
+            logger.error("不正なセッションキーが指定されました")
+            await websocket.close(code=1008)
+            return
+
+        await websocket.accept()
+        compact = parse_flag(params.get('compact'))
+        session = VoiceSession(
+            integration,
+            websocket.send_text,
+            session_key=session_key,
+            sample_rate=sample_rate,
+            speak=bool(parse_flag(params.get('speak'))),
+            voice=params.get('voice'),
+            compact=True if compact is None else compact
+        )
+        await session.start()
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("bytes") is not None:
+                    await session.feed_audio(message["bytes"])
+                elif message.get("text") is not None:
+                    await session.handle_control(message["text"])
+        except WebSocketDisconnect:
+            pass
+        finally:
+            await session.close()
+    finally:
+        request_id_var.reset(token)
+
+async def metrics(request):
+    """処理段階ごとの所要時間とエラー数をPrometheusのテキスト形式で返すエンドポイント"""
+    return PlainTextResponse(stage_metrics.render_prometheus(), media_type='text/plain; version=0.0.4')
+
+async def not_found(request, exc):
+    """404エラーハンドラ"""
+    return JSONResponse({"error": "リソースが見つかりません"}, status_code=404)
+
+async def server_error(request, exc):
+    """500エラーハンドラ"""
+    logger.error("サーバーエラー: %s", exc)
+    return JSONResponse({"error": "サーバー内部エラー"}, status_code=500)
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """起動時に統合システムを初期化・ウォームアップし、終了時に上流への接続を閉じる"""
+    global integration
+    integration = AsuradaZonosIntegration()
+    # 上流への接続・Zonosワーカー・定型応答の音声をブロッキング処理のためスレッドで準備
+    await run_in_executor(integration.warm_up)
+    try:
+        yield
+    finally:
+        await integration.aclose()
+
+app = Starlette(
+    debug=os.getenv('DEBUG', 'False').lower() == 'true',
+    routes=[
+        Route('/', index),
+        Route('/metrics', metrics),
+        Route('/api/process-text', process_text, methods=['POST']),
+        Route('/api/process-audio', process_audio, methods=['POST']),
+        Route('/api/direct-response', direct_response, methods=['POST']),
+        Route('/api/speak', speak, methods=['POST']),
+        WebSocketRoute('/ws/voice', voice)
+    ],
+    middleware=[
+        Middleware(RequestIdMiddleware),
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'], expose_headers=['X-Request-ID'])
+    ],
+    exception_handlers={404: not_found, 500: server_error},
+    lifespan=lifespan
+)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    # 環境変数からポート番号を取得（デフォルトは8000）
+    port = int(os.environ.get('PORT', 8000))
+
+    logger.info("ASGIサーバーを起動します（ポート: %s）", port)
+
+    # サーバーを起動
+    uvicorn.run(app, host='0.0.0.0', port=port)
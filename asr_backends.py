@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+音声認識バックエンド
+設定（ASR_BACKEND）で切り替え可能な音声認識エンジンの共通インターフェースです。
+- google_cloud: Google Cloud Speech-to-Text（従来の動作）
+- local: ローカルCPUで動作するWhisper（ネットワーク不要）
+- fake: テスト・ベンチマーク用の決定的なフェイク
+バックエンドごとのレイテンシを記録し、デプロイごとに最適なエンジンを選べるようにします。
+"""
+
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import deque
+import speech_recognition as sr
+
+logger = logging.getLogger("asr_backends")
+
+# 使用するバックエンド
+ASR_BACKEND = os.getenv("ASR_BACKEND", "google_cloud")
+ASR_LANGUAGE = os.getenv("ASR_LANGUAGE", "ja-JP")
+
+# ローカルエンジンの設定
+ASR_LOCAL_MODEL = os.getenv("ASR_LOCAL_MODEL", "base")
+ASR_BATCH_SIZE = int(os.getenv("ASR_BATCH_SIZE", "8"))
+
+# フェイクの設定
+ASR_FAKE_TEXT = os.getenv("ASR_FAKE_TEXT", "")
+ASR_FAKE_LATENCY = float(os.getenv("ASR_FAKE_LATENCY", "0"))
+
+
+class BackendStats:
+    """バックエンドの呼び出し回数・エラー数・レイテンシを集計するクラス"""
+
+    def __init__(self, max_samples=1000):
+        """初期化メソッド"""
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.utterances = 0
+        self.errors = 0
+        self._latency = deque(maxlen=max_samples)
+
+    def record(self, latency, utterances=1, error=False):
+        """1回の呼び出し結果を記録"""
+        with self._lock:
+            self.calls += 1
+            self.utterances += utterances
+            if error:
+                self.errors += 1
+            self._latency.append(latency)
+
+    def snapshot(self):
+        """現在の統計を辞書で返す"""
+        with self._lock:
+            ordered = sorted(self._latency)
+            calls, utterances, errors = self.calls, self.utterances, self.errors
+        summary = {"calls": calls, "utterances": utterances, "errors": errors}
+        if ordered:
+            summary.update({
+                "avg": sum(ordered) / len(ordered),
+                "p50": ordered[int(0.50 * (len(ordered) - 1))],
+                "p95": ordered[int(0.95 * (len(ordered) - 1))]
+            })
+        return summary
+
+
+class ASRBackend:
+    """音声認識バックエンドの基底クラス"""
+
+    name = "base"
+    supports_batch = False
+
+    def __init__(self, language=ASR_LANGUAGE):
+        """初期化メソッド"""
+        self.language = language
+        self.stats = BackendStats()
+
+    def recognize(self, audio_data):
+        """AudioDataを認識してテキストを返す（認識できない場合はsr.UnknownValueError）"""
+        start = time.perf_counter()
+        error = False
+        try:
+            return self._recognize(audio_data)
+        except sr.RequestError:
+            error = True
+            raise
+        finally:
+            self.stats.record(time.perf_counter() - start, error=error)
+
+    def recognize_batch(self, audio_list):
+        """複数のAudioDataをまとめて認識し、テキストのリストを返す（認識できないものは空文字）"""
+        start = time.perf_counter()
+        error = False
+        try:
+            return self._recognize_batch(audio_list)
+        except sr.RequestError:
+            error = True
+            raise
+        finally:
+            self.stats.record(time.perf_counter() - start, utterances=len(audio_list), error=error)
+
+    def _recognize(self, audio_data):
+        """バックエンド固有の認識処理"""
+        raise NotImplementedError
+
+    def _recognize_batch(self, audio_list):
+        """バックエンド固有のバッチ認識処理（デフォルトは1件ずつ認識）"""
+        results = []
+        for audio_data in audio_list:
+            try:
+                results.append(self._recognize(audio_data))
+            except sr.UnknownValueError:
+                results.append("")
+        return results
+
+
+class GoogleCloudBackend(ASRBackend):
+    """Google Cloud Speech-to-Textを使用するバックエンド"""
+
+    name = "google_cloud"
+
+    def _recognize(self, audio_data):
+        recognizer = sr.Recognizer()
+        return recognizer.recognize_google_cloud(audio_data, language=self.language)
+
+
+class LocalWhisperBackend(ASRBackend):
+    """ローカルCPUで動作するWhisperを使用するバックエンド（30秒以内の発話はバッチでデコード）"""
+
+    name = "local"
+    supports_batch = True
+
+    # Whisperが一度に処理できる音声の長さ（秒）
+    MAX_BATCH_SECONDS = 30
+
+    def __init__(self, language=ASR_LANGUAGE, model_name=ASR_LOCAL_MODEL):
+        """初期化メソッド"""
+        super().__init__(language)
+        try:
+            import numpy
+            import torch
+            import whisper
+        except ImportError as e:
+            raise ImportError("ローカル音声認識にはopenai-whisperが必要です（pip install openai-whisper）") from e
+        self._np = numpy
+        self._torch = torch
+        self._whisper = whisper
+        self._lock = threading.Lock()
+        self.model = whisper.load_model(model_name, device="cpu")
+        self.whisper_language = language.split("-")[0]
+        logger.info("ローカル音声認識モデルを読み込みました: %s", model_name)
+
+    def _to_array(self, audio_data):
+        """AudioDataを16kHzのfloat32配列に変換"""
+        raw = audio_data.get_raw_data(convert_rate=16000, convert_width=2)
+        return self._np.frombuffer(raw, dtype=self._np.int16).astype(self._np.float32) / 32768.0
+
+    def _recognize(self, audio_data):
+        with self._lock:
+            result = self.model.transcribe(
+                self._to_array(audio_data),
+                language=self.whisper_language,
+                fp16=False
+            )
+        text = result.get("text", "").strip()
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+    def _recognize_batch(self, audio_list):
+        arrays = [self._to_array(audio_data) for audio_data in audio_list]
+        results = [""] * len(arrays)
+
+        # 30秒以内の発話はメルスペクトログラムを積み重ねて一度にデコード
+        short = [i for i, array in enumerate(arrays) if len(array) <= self.MAX_BATCH_SECONDS * 16000]
+        options = self._whisper.DecodingOptions(language=self.whisper_language, fp16=False, without_timestamps=True)
+        for offset in range(0, len(short), ASR_BATCH_SIZE):
+            indexes = short[offset:offset + ASR_BATCH_SIZE]
+            mel = self._torch.stack([
+                self._whisper.log_mel_spectrogram(
+                    self._whisper.pad_or_trim(arrays[i]),
+                    n_mels=self.model.dims.n_mels
+                )
+                for i in indexes
+            ])
+            with self._lock:
+                decoded = self._whisper.decode(self.model, mel, options)
+            for i, result in zip(indexes, decoded):
+                results[i] = result.text.strip()
+
+        # 長い発話は通常の文字起こし
+        batched = set(short)
+        for i, array in enumerate(arrays):
+            if i in batched:
+                continue
+            with self._lock:
+                results[i] = self.model.transcribe(array, language=self.whisper_language, fp16=False).get("text", "").strip()
+        return results
+
+
+class FakeBackend(ASRBackend):
+    """テスト用の決定的なフェイクバックエンド（音声データのハッシュから文字起こしを作る）"""
+
+    name = "fake"
+    supports_batch = True
+
+    def __init__(self, language=ASR_LANGUAGE, text=ASR_FAKE_TEXT, latency=ASR_FAKE_LATENCY):
+        """初期化メソッド"""
+        super().__init__(language)
+        self.text = text
+        self.latency = latency
+
+    def _transcript(self, audio_data):
+        """音声データに対応する決定的な文字起こし"""
+        raw = audio_data.get_raw_data()
+        if not raw or not any(raw):
+            return ""
+        if self.text:
+            return self.text
+        return f"テスト音声{hashlib.sha1(raw).hexdigest()[:8]}"
+
+    def _recognize(self, audio_data):
+        if self.latency:
+            time.sleep(self.latency)
+        text = self._transcript(audio_data)
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+    def _recognize_batch(self, audio_list):
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._transcript(audio_data) for audio_data in audio_list]
+
+
+# 設定名とバックエンドの対応
+BACKENDS = {
+    GoogleCloudBackend.name: GoogleCloudBackend,
+    LocalWhisperBackend.name: LocalWhisperBackend,
+    FakeBackend.name: FakeBackend
+}
+
+
+def create_backend(name=None, **kwargs):
+    """設定名からバックエンドを作成"""
+    name = name or ASR_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"不明な音声認識バックエンドです: {name}（選択肢: {', '.join(BACKENDS)}）")
+    backend = BACKENDS[name](**kwargs)
+    logger.info("音声認識バックエンド: %s", name)
+    return backend
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+音声データの取り込み
+アップロードされた音声をメモリ上（BytesIO）でデコードし、一時ファイルを介さずに
+音声認識用のPCMデータへ変換します。設定サイズを超える場合のみ一意な一時ファイルに退避し、
+処理後に確実に削除します。
+speech_recognitionとpydubは音声を実際にデコードするときに読み込むため、
+AudioInputだけを使うテキスト処理のプロセスでは読み込まれません。
+"""
+
+import io
+import os
+import wave
+import shutil
+import hashlib
+import logging
+import tempfile
+from pathlib import Path
+
+logger = logging.getLogger("audio_io")
+
+# これを超えるサイズのアップロードは一時ファイルに退避（バイト）
+AUDIO_SPILL_THRESHOLD = int(os.getenv("AUDIO_SPILL_THRESHOLD", str(20 * 1024 * 1024)))
+
+# 退避先ディレクトリ（未指定の場合はOSの一時ディレクトリ）
+AUDIO_SPILL_DIR = os.getenv("AUDIO_SPILL_DIR") or None
+
+# ストリームを読み込む単位（バイト）
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class AudioInput:
+    """音声データ（メモリ上のバイト列、既存ファイル、または退避した一時ファイル）"""
+
+    def __init__(self, data=None, path=None, filename=None, temporary=False):
+        """初期化メソッド"""
+        self.data = data
+        self.path = path
+        self.filename = filename or (Path(path).name if path else "audio")
+        self.temporary = temporary
+
+    @classmethod
+    def from_path(cls, path):
+        """既存の音声ファイルから作成（ファイルはコピーしない）"""
+        return cls(path=str(path))
+
+    @classmethod
+    def from_bytes(cls, data, filename=None):
+        """メモリ上のバイト列から作成"""
+        return cls(data=bytes(data), filename=filename)
+
+    @classmethod
+    def from_stream(cls, stream, filename=None, threshold=None):
+        """ストリームを読み込み、閾値以下ならメモリ上に、超える場合は一時ファイルに保持"""
+        threshold = AUDIO_SPILL_THRESHOLD if threshold is None else threshold
+        buffer = io.BytesIO()
+
+        while True:
+            chunk = stream.read(READ_CHUNK_SIZE)
+            if not chunk:
+                return cls(data=buffer.getvalue(), filename=filename)
+            buffer.write(chunk)
+            if buffer.tell() > threshold:
+                break
+
+        # 閾値を超えたので一意な一時ファイルに退避
+        suffix = Path(filename).suffix if filename else ""
+        fd, path = tempfile.mkstemp(prefix="asurada_", suffix=suffix, dir=AUDIO_SPILL_DIR)
+        try:
+            with os.fdopen(fd, "wb") as spill:
+                spill.write(buffer.getbuffer())
+                shutil.copyfileobj(stream, spill, READ_CHUNK_SIZE)
+        except Exception:
+            os.unlink(path)
+            raise
+        logger.info("大きな音声データを一時ファイルに退避しました: %s", path)
+        return cls(path=path, filename=filename, temporary=True)
+
+    @property
+    def format(self):
+        """ファイル名の拡張子から判定した音声形式"""
+        return Path(self.filename).suffix.lower().lstrip(".") or None
+
+    @property
+    def size(self):
+        """音声データのサイズ（バイト）"""
+        if self.data is not None:
+            return len(self.data)
+        return os.path.getsize(self.path)
+
+    def digest(self):
+        """音声データのSHA-256ハッシュ（16進文字列）"""
+        if self.data is not None:
+            return hashlib.sha256(self.data).hexdigest()
+        sha256 = hashlib.sha256()
+        with open(self.path, "rb") as f:
+            for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b""):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def exists(self):
+        """音声データが存在するか確認"""
+        return self.data is not None or (self.path is not None and Path(self.path).exists())
+
+    def open(self):
+        """デコーダーに渡すファイルオブジェクト、またはパスを返す"""
+        if self.data is not None:
+            return io.BytesIO(memoryview(self.data))
+        return self.path
+
+    def close(self):
+        """退避した一時ファイルを削除"""
+        if self.temporary and self.path:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+        self.data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __str__(self):
+        return self.filename
+
+
+def decode_audio(audio_input):
+    """音声データをデコードしてAudioSegmentを返す"""
+    from pydub import AudioSegment
+    return AudioSegment.from_file(audio_input.open(), format=audio_input.format)
+
+
+def to_audio_data(segment):
+    """AudioSegmentを音声認識用のAudioDataに変換（ファイルを経由しない）"""
+    import speech_recognition as sr
+    if segment.channels != 1:
+        segment = segment.set_channels(1)
+    return sr.AudioData(segment.raw_data, segment.frame_rate, segment.sample_width)
+
+
+def warm_up_audio():
+    """短い無音のWAVをデコードして音声処理スタックを初期化（最初のリクエストの遅延を防ぐ）"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(16000)
+        wav.writeframes(b"\0\0" * 1600)
+    segment = decode_audio(AudioInput.from_bytes(buffer.getvalue(), filename="warmup.wav"))
+    to_audio_data(segment)
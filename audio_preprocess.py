@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+音声の前処理
+デコードした音声を音声認識に渡す前に、モノラル化・16kHzへのリサンプリング・
+前後の無音の除去（フレームごとのエネルギーをNumPyの配列演算で計算）・長さの上限での切り詰め・
+音量の正規化を行います。認識サービスに送るデータ量と無音部分の認識時間を減らします。
+各段階の所要時間は段階ごとのメトリクス（preprocess.*）に記録し、削減したバイト数を集計します。
+NumPyは最初の前処理時に読み込みます。
+"""
+
+import os
+import time
+import logging
+import threading
+
+from stage_metrics import record_stage
+
+logger = logging.getLogger("audio_preprocess")
+
+# 前処理を行うか
+AUDIO_PREPROCESS = os.getenv("AUDIO_PREPROCESS", "True").lower() == "true"
+
+# 音声認識に渡すサンプリングレート（これより高い場合のみ変換）
+AUDIO_TARGET_RATE = int(os.getenv("AUDIO_TARGET_RATE", "16000"))
+
+# 無音の判定（最も大きいフレームからのdB差）と、除去後に前後に残す長さ（ミリ秒）
+AUDIO_SILENCE_THRESHOLD_DB = float(os.getenv("AUDIO_SILENCE_THRESHOLD_DB", "-35"))
+AUDIO_TRIM_PADDING_MS = int(os.getenv("AUDIO_TRIM_PADDING_MS", "200"))
+
+# 音声の長さの上限（秒、0で無制限）
+AUDIO_MAX_DURATION = float(os.getenv("AUDIO_MAX_DURATION", "600"))
+
+# 音量の正規化の目標（dBFS）と最大の増幅量（dB、0で正規化しない）
+AUDIO_TARGET_DBFS = float(os.getenv("AUDIO_TARGET_DBFS", "-20"))
+AUDIO_MAX_GAIN_DB = float(os.getenv("AUDIO_MAX_GAIN_DB", "20"))
+
+# エネルギーを計算するフレームの長さ（ミリ秒）
+FRAME_MS = 20
+
+# 正規化後のピークの上限（dBFS、クリップを防ぐ）
+PEAK_LIMIT_DBFS = -1.0
+
+
+def describe(segment):
+    """AudioSegmentの形式とサイズを辞書で返す"""
+    return {
+        "bytes": len(segment.raw_data),
+        "frame_rate": segment.frame_rate,
+        "channels": segment.channels,
+        "sample_width": segment.sample_width,
+        "duration": round(len(segment) / 1000, 3)
+    }
+
+
+class AudioPreprocessor:
+    """音声認識の前処理を行い、削減したバイト数を集計するクラス"""
+
+    def __init__(self, target_rate=AUDIO_TARGET_RATE, silence_threshold_db=AUDIO_SILENCE_THRESHOLD_DB,
+                 padding_ms=AUDIO_TRIM_PADDING_MS, max_duration=AUDIO_MAX_DURATION,
+                 target_dbfs=AUDIO_TARGET_DBFS, max_gain_db=AUDIO_MAX_GAIN_DB, enabled=AUDIO_PREPROCESS):
+        """初期化メソッド"""
+        self.target_rate = target_rate
+        self.silence_threshold_db = silence_threshold_db
+        self.padding_ms = padding_ms
+        self.max_duration = max_duration
+        self.target_dbfs = target_dbfs
+        self.max_gain_db = max_gain_db
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.processed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.trimmed_ms = 0
+        self.capped = 0
+
+    def _step(self, name, timings, func, *args):
+        """前処理の1段階を実行して所要時間を記録"""
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        timings[name] = round(elapsed * 1000, 2)
+        record_stage(f"preprocess.{name}", elapsed)
+        return result
+
+    def _downmix(self, segment):
+        """モノラル・16bitに変換"""
+        if segment.channels != 1:
+            segment = segment.set_channels(1)
+        if segment.sample_width != 2:
+            segment = segment.set_sample_width(2)
+        return segment
+
+    def _resample(self, segment):
+        """目標のサンプリングレートより高い場合のみダウンサンプリング"""
+        if self.target_rate and segment.frame_rate > self.target_rate:
+            segment = segment.set_frame_rate(self.target_rate)
+        return segment
+
+    def _frame_levels(self, np, samples, frame_size):
+        """フレームごとのRMSレベル（dBFS）の配列"""
+        count = len(samples) // frame_size
+        frames = samples[:count * frame_size].reshape(count, frame_size).astype(np.float32)
+        rms = np.sqrt(np.mean(frames * frames, axis=1))
+        return 20 * np.log10(np.maximum(rms, 1.0) / 32768.0)
+
+    def _trim(self, segment):
+        """前後の無音を除去し、(音声, 先頭で除去したミリ秒, 末尾で除去したミリ秒)を返す"""
+        import numpy as np
+
+        samples = np.frombuffer(segment.raw_data, dtype=np.int16)
+        frame_size = max(1, segment.frame_rate * FRAME_MS // 1000)
+        levels = self._frame_levels(np, samples, frame_size)
+        if len(levels) == 0:
+            return segment, 0, 0
+
+        # 最も大きいフレームから閾値以上小さいフレームを無音とみなす
+        voiced = np.flatnonzero(levels >= levels.max() + self.silence_threshold_db)
+        if len(voiced) == 0 or levels.max() <= -90:
+            # 全体が無音の場合は認識側の判定に任せる
+            return segment, 0, 0
+
+        duration_ms = len(segment)
+        start_ms = max(0, int(voiced[0]) * FRAME_MS - self.padding_ms)
+        end_ms = min(duration_ms, (int(voiced[-1]) + 1) * FRAME_MS + self.padding_ms)
+        if start_ms == 0 and end_ms == duration_ms:
+            return segment, 0, 0
+        return segment[start_ms:end_ms], start_ms, duration_ms - end_ms
+
+    def _normalize(self, segment):
+        """平均音量を目標に近づける（増幅量とピークの上限あり）、(音声, 適用したdB)を返す"""
+        import numpy as np
+
+        samples = np.frombuffer(segment.raw_data, dtype=np.int16).astype(np.float32)
+        if len(samples) == 0:
+            return segment, 0.0
+        rms = float(np.sqrt(np.mean(samples * samples)))
+        peak = float(np.max(np.abs(samples)))
+        if rms < 1.0:
+            return segment, 0.0
+
+        gain_db = self.target_dbfs - 20 * np.log10(rms / 32768.0)
+        gain_db = min(gain_db, self.max_gain_db, PEAK_LIMIT_DBFS - 20 * np.log10(peak / 32768.0))
+        if abs(gain_db) < 0.5:
+            return segment, 0.0
+
+        scaled = np.clip(samples * (10 ** (gain_db / 20)), -32768, 32767).astype(np.int16)
+        return segment._spawn(scaled.tobytes()), round(float(gain_db), 2)
+
+    def process(self, segment):
+        """AudioSegmentを前処理し、(前処理後のAudioSegment, 処理内容の報告)を返す"""
+        original = describe(segment)
+        if not self.enabled:
+            return segment, {"enabled": False, "original": original}
+
+        timings = {}
+        segment = self._step("downmix", timings, self._downmix, segment)
+        segment = self._step("resample", timings, self._resample, segment)
+        segment, leading_ms, trailing_ms = self._step("trim", timings, self._trim, segment)
+
+        capped = bool(self.max_duration) and len(segment) > self.max_duration * 1000
+        if capped:
+            logger.warning("音声が上限の%.0f秒を超えたため切り詰めます（%.1f秒）", self.max_duration, len(segment) / 1000)
+            segment = segment[:int(self.max_duration * 1000)]
+
+        gain_db = 0.0
+        if self.max_gain_db:
+            segment, gain_db = self._step("normalize", timings, self._normalize, segment)
+
+        processed = describe(segment)
+        report = {
+            "enabled": True,
+            "original": original,
+            "processed": processed,
+            "bytes_saved": original["bytes"] - processed["bytes"],
+            "trimmed_ms": {"leading": leading_ms, "trailing": trailing_ms},
+            "capped": capped,
+            "gain_db": gain_db,
+            "timings_ms": timings
+        }
+        with self._lock:
+            self.processed += 1
+            self.bytes_in += original["bytes"]
+            self.bytes_out += processed["bytes"]
+            self.trimmed_ms += leading_ms + trailing_ms
+            self.capped += int(capped)
+        logger.info(
+            "音声を前処理しました（%dバイト → %dバイト、無音除去 %dms、%.1fdB）",
+            original["bytes"], processed["bytes"], leading_ms + trailing_ms, gain_db
+        )
+        return segment, report
+
+    def stats(self):
+        """前処理の件数と削減したバイト数を返す"""
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "processed": self.processed,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "bytes_saved": self.bytes_in - self.bytes_out,
+                "saved_ratio": (self.bytes_in - self.bytes_out) / self.bytes_in if self.bytes_in else 0.0,
+                "trimmed_seconds": self.trimmed_ms / 1000,
+                "capped": self.capped
+            }
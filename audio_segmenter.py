@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+長時間音声の分割認識
+長い録音を無音区間または固定長（オーバーラップ付き）のウィンドウで分割し、
+上限付きのスレッドプール（バッチ対応のバックエンドではバッチ）で音声認識して、順序どおりに文字起こしを連結します。
+呼び出し元の期限（Deadline）を過ぎた場合は、残りのセグメントを待たずにDeadlineExceededを送出します。
+"""
+
+import os
+import time
+import random
+import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import speech_recognition as sr
+from pydub.silence import detect_nonsilent
+
+from audio_io import to_audio_data
+from upstream_guard import DeadlineExceeded
+
+logger = logging.getLogger("audio_segmenter")
+
+# 分割認識の設定
+SEGMENT_THRESHOLD_SEC = float(os.getenv("ASR_SEGMENT_THRESHOLD", "60"))
+SEGMENT_MODE = os.getenv("ASR_SEGMENT_MODE", "silence")
+SEGMENT_WINDOW_SEC = float(os.getenv("ASR_SEGMENT_WINDOW", "30"))
+SEGMENT_OVERLAP_SEC = float(os.getenv("ASR_SEGMENT_OVERLAP", "1"))
+SEGMENT_MAX_WORKERS = int(os.getenv("ASR_MAX_WORKERS", "4"))
+SEGMENT_RETRIES = int(os.getenv("ASR_RETRIES", "2"))
+
+# 無音検出の設定
+MIN_SILENCE_MS = 500
+SILENCE_MARGIN_DB = 16
+KEEP_SILENCE_MS = 200
+
+# オーバーラップの重複とみなす最小の文字数（短い一致は隣接する文字列の偶然の一致として残す）
+MERGE_MIN_OVERLAP = 4
+
+
+def fixed_windows(start_ms, end_ms, window_ms, overlap_ms):
+    """区間を固定長のウィンドウ（オーバーラップ付き）に分割した範囲のリストを返す"""
+    step = max(window_ms - overlap_ms, 1)
+    ranges = []
+    position = start_ms
+    while position < end_ms:
+        ranges.append((position, min(position + window_ms, end_ms)))
+        if position + window_ms >= end_ms:
+            break
+        position += step
+    return ranges
+
+
+def silence_windows(sound, window_ms, overlap_ms):
+    """無音区間で区切り、ウィンドウ長を超えないようにまとめた範囲のリストを返す"""
+    speech = detect_nonsilent(
+        sound,
+        min_silence_len=MIN_SILENCE_MS,
+        silence_thresh=sound.dBFS - SILENCE_MARGIN_DB
+    )
+    if not speech:
+        return []
+
+    ranges = []
+    current_start, current_end = None, None
+    for start, end in speech:
+        start = max(start - KEEP_SILENCE_MS, 0)
+        end = min(end + KEEP_SILENCE_MS, len(sound))
+
+        # 1つの発話区間がウィンドウより長い場合は固定長で分割
+        if end - start > window_ms:
+            if current_start is not None:
+                ranges.append((current_start, current_end))
+                current_start = None
+            ranges.extend(fixed_windows(start, end, window_ms, overlap_ms))
+            continue
+
+        if current_start is None:
+            current_start, current_end = start, end
+        elif end - current_start <= window_ms:
+            current_end = end
+        else:
+            ranges.append((current_start, current_end))
+            current_start, current_end = start, end
+
+    if current_start is not None:
+        ranges.append((current_start, current_end))
+    return ranges
+
+
+def _is_word_char(char):
+    """空白で単語を区切る言語（英数字）の文字か"""
+    return char.isascii() and char.isalnum()
+
+
+def join_text(left, right):
+    """2つの文字起こしを連結（英単語どうしの間には空白を入れる）"""
+    if left and right and _is_word_char(left[-1]) and _is_word_char(right[0]):
+        return f"{left} {right}"
+    return left + right
+
+
+def merge_overlap(left, right, max_overlap=50, min_overlap=MERGE_MIN_OVERLAP):
+    """オーバーラップ部分で重複した文字列を取り除いて連結（min_overlap文字未満の一致は重複とみなさない）"""
+    if not left:
+        return right
+    if not right:
+        return left
+    limit = min(len(left), len(right), max_overlap)
+    for size in range(limit, max(min_overlap, 1) - 1, -1):
+        if not left.endswith(right[:size]):
+            continue
+        # 英単語の途中から・途中までの一致は偶然の一致として扱う
+        start = len(left) - size
+        if start > 0 and _is_word_char(left[start - 1]) and _is_word_char(right[0]):
+            continue
+        if size < len(right) and _is_word_char(right[size - 1]) and _is_word_char(right[size]):
+            continue
+        return left + right[size:]
+    return join_text(left, right)
+
+
+class SegmentedRecognizer:
+    """音声を分割して並列に認識するクラス"""
+
+    def __init__(self, mode=SEGMENT_MODE, window_sec=SEGMENT_WINDOW_SEC, overlap_sec=SEGMENT_OVERLAP_SEC,
+                 max_workers=SEGMENT_MAX_WORKERS, retries=SEGMENT_RETRIES):
+        """初期化メソッド"""
+        self.mode = mode
+        self.window_ms = int(window_sec * 1000)
+        self.overlap_ms = int(overlap_sec * 1000)
+        self.max_workers = max_workers
+        self.retries = retries
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="asr-segment")
+
+    def split(self, sound):
+        """音声を分割した範囲（ミリ秒）のリストを返す"""
+        if self.mode == "fixed":
+            return fixed_windows(0, len(sound), self.window_ms, self.overlap_ms)
+        return silence_windows(sound, self.window_ms, self.overlap_ms)
+
+    def _with_retry(self, label, deadline, func, *args):
+        """リクエストエラーはバックオフしながら再試行して関数を実行（期限切れ・キャンセル後は再試行しない）"""
+        for attempt in range(self.retries + 1):
+            if deadline is not None:
+                deadline.check()
+            try:
+                return func(*args)
+            except sr.RequestError as e:
+                if attempt >= self.retries:
+                    raise
+                delay = (2 ** attempt) * 0.5 * (1 + random.random())
+                if deadline is not None:
+                    delay = deadline.timeout(delay)
+                logger.warning("%sの認識に失敗しました（%d回目）: %s。%.1f秒後に再試行します", label, attempt + 1, e, delay)
+                time.sleep(delay)
+
+    def _recognize_segment(self, index, segment, backend, deadline=None):
+        """1つのセグメントを認識（認識できる音声がない場合は空文字）"""
+        try:
+            return self._with_retry(f"セグメント{index}", deadline, backend.recognize, to_audio_data(segment))
+        except sr.UnknownValueError:
+            logger.debug("セグメント%sは認識できる音声を含みません", index)
+            return ""
+
+    def transcribe(self, sound, backend, deadline=None):
+        """音声を分割して認識し、順序どおりに連結した文字起こしを返す（deadlineを過ぎた場合はDeadlineExceeded）"""
+        ranges = self.split(sound)
+        if not ranges:
+            raise sr.UnknownValueError()
+
+        if backend.supports_batch:
+            # バッチ対応のバックエンドにはすべてのセグメントをまとめて渡す
+            logger.info("音声を%s個のセグメントに分割してバッチで認識します", len(ranges))
+            audio_list = [to_audio_data(sound[start:end]) for start, end in ranges]
+            parts = self._with_retry("バッチ", deadline, backend.recognize_batch, audio_list)
+        else:
+            logger.info("音声を%s個のセグメントに分割して認識します（並列数: %s）", len(ranges), self.max_workers)
+            futures = [
+                self._executor.submit(self._recognize_segment, index, sound[start:end], backend, deadline)
+                for index, (start, end) in enumerate(ranges)
+            ]
+            try:
+                parts = [future.result(timeout=deadline.remaining() if deadline else None) for future in futures]
+            except FutureTimeoutError:
+                # 始まっていないセグメントは取り消し、実行中のセグメントは再試行させない
+                for future in futures:
+                    future.cancel()
+                deadline.cancel()
+                raise DeadlineExceeded("音声の分割認識が期限を過ぎました")
+
+        # オーバーラップしている隣接セグメントのみ重複部分を取り除いて連結
+        text = ""
+        previous_end = 0
+        for (start, end), part in zip(ranges, parts):
+            part = (part or "").strip()
+            text = merge_overlap(text, part) if start < previous_end else join_text(text, part)
+            previous_end = end
+
+        if not text:
+            raise sr.UnknownValueError()
+        return text
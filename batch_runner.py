@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+バッチ処理
+多数のテキスト入力を上限付きのワーカープールで並列に処理し、
+完了した順に結果を返します。Dify APIへの同時リクエスト数はプロセス全体で制限します。
+"""
+
+import os
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+logger = logging.getLogger("batch_runner")
+
+# バッチ処理の設定
+BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", "16"))
+BATCH_DIFY_CONCURRENCY = int(os.getenv("BATCH_DIFY_CONCURRENCY", "8"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "10000"))
+
+
+class BatchRunner:
+    """テキスト入力のバッチを並列に処理するクラス"""
+
+    def __init__(self, integration, max_workers=BATCH_MAX_WORKERS, dify_concurrency=BATCH_DIFY_CONCURRENCY):
+        """初期化メソッド"""
+        self.integration = integration
+        self.max_workers = max_workers
+        self.dify_concurrency = dify_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="batch")
+        self._dify_slots = threading.BoundedSemaphore(dify_concurrency)
+
+    def _process_item(self, item):
+        """1件を処理（Dify APIを使う場合は同時実行数の枠を取得してから実行）"""
+        if item["use_dify"]:
+            with self._dify_slots:
+                return self.integration.run(text_input=item["text"], use_dify=True)
+        return self.integration.run(text_input=item["text"], use_dify=False)
+
+    def run(self, items, concurrency=None):
+        """アイテムを並列に処理し、完了した順に(アイテム, 結果)を返すジェネレータ"""
+        concurrency = max(1, min(concurrency or self.max_workers, self.max_workers))
+        pending = {}
+        iterator = iter(items)
+        exhausted = False
+
+        try:
+            while pending or not exhausted:
+                # 同時実行数の上限まで投入
+                while not exhausted and len(pending) < concurrency:
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    # リクエストIDなどのコンテキストを引き継いでワーカーで実行
+                    context = contextvars.copy_context()
+                    pending[self._executor.submit(context.run, self._process_item, item)] = item
+
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.error("バッチアイテム %s の処理中にエラーが発生しました: %s", item['id'], e)
+                        result = {"status": "error", "message": "処理中にエラーが発生しました"}
+                    yield item, result
+        finally:
+            # クライアントが切断した場合などは未開始のアイテムを取り消す
+            for future in pending:
+                future.cancel()
+
+    def shutdown(self):
+        """ワーカープールを停止"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def parse_batch_items(data):
+    """リクエストのアイテム一覧を検証し、(正規化したアイテム, エラー)のリストを返す"""
+    parsed = []
+    for index, raw in enumerate(data):
+        item_id = raw.get("id", index) if isinstance(raw, dict) else index
+        if isinstance(raw, str):
+            raw = {"text": raw}
+        if not isinstance(raw, dict) or not isinstance(raw.get("text"), str) or not raw["text"]:
+            parsed.append(({"id": item_id, "index": index}, "テキストが必要です"))
+            continue
+        parsed.append(({
+            "id": item_id,
+            "index": index,
+            "text": raw["text"],
+            "use_dify": bool(raw.get("use_dify", True))
+        }, None))
+    return parsed
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+インテント照合のマイクロベンチマーク
+ルール数を変えながら、Aho-Corasickオートマトンの作成時間と照合のスループットを計測し、
+インテントごとに部分文字列を検索する単純な方法と比較します。
+
+使用例:
+    python benchmark_intents.py
+    python benchmark_intents.py --rules 10 100 1000 10000 --texts 2000
+"""
+
+import time
+import random
+import argparse
+
+from intent_matcher import Intent, IntentAutomaton, fold_text
+
+# 合成ルールと入力に使う文字
+CHARSET = "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん"
+
+
+def random_word(rng, min_length=3, max_length=6):
+    """ランダムな単語を作成"""
+    return "".join(rng.choice(CHARSET) for _ in range(rng.randint(min_length, max_length)))
+
+
+def make_intents(count, rng):
+    """合成したインテントを作成（1件あたりキーワード2個）"""
+    return [
+        Intent(f"intent{i}", [random_word(rng), random_word(rng)], f"応答{i}", priority=rng.randint(0, 9), order=i)
+        for i in range(count)
+    ]
+
+
+def make_texts(count, intents, rng):
+    """入力テキストを作成（半分はいずれかのキーワードを含む）"""
+    texts = []
+    for i in range(count):
+        text = random_word(rng, 20, 60)
+        if i % 2 == 0:
+            pattern = rng.choice(rng.choice(intents).patterns)
+            position = rng.randint(0, len(text))
+            text = text[:position] + pattern + text[position:]
+        texts.append(text)
+    return texts
+
+
+def naive_match(intents, text):
+    """インテントごとに部分文字列を検索する単純な照合"""
+    folded = fold_text(text)
+    best = None
+    for intent in intents:
+        if any(fold_text(p) in folded for p in intent.patterns):
+            if best is None or intent.rank() < best.rank():
+                best = intent
+    return best
+
+
+def measure(function, texts, min_time):
+    """min_time秒以上かけて繰り返し実行し、1秒あたりの照合件数を返す"""
+    count = 0
+    start = time.perf_counter()
+    while True:
+        for text in texts:
+            function(text)
+        count += len(texts)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return count / elapsed
+
+
+def main():
+    """メイン関数"""
+    parser = argparse.ArgumentParser(description="インテント照合のマイクロベンチマーク")
+    parser.add_argument("--rules", type=int, nargs="+", default=[10, 100, 1000, 5000], help="計測するルール数")
+    parser.add_argument("--texts", type=int, default=1000, help="入力テキスト数")
+    parser.add_argument("--min-time", type=float, default=0.5, help="各計測の最短時間（秒）")
+    parser.add_argument("--naive-max-rules", type=int, default=1000, help="単純な照合を計測する最大ルール数")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'ルール数':>8}{'状態数':>10}{'作成(ms)':>10}{'オートマトン(件/秒)':>20}{'単純照合(件/秒)':>18}")
+    for count in args.rules:
+        intents = make_intents(count, rng)
+        texts = make_texts(args.texts, intents, rng)
+
+        start = time.perf_counter()
+        automaton = IntentAutomaton(intents)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        # 結果が単純な照合と一致することを確認
+        for text in texts[:50]:
+            assert automaton.match(text) is naive_match(intents, text), text
+
+        automaton_rate = measure(automaton.match, texts, args.min_time)
+        if count <= args.naive_max_rules:
+            naive_rate = f"{measure(lambda t: naive_match(intents, t), texts, args.min_time):>18.0f}"
+        else:
+            naive_rate = f"{'-':>18}"
+        print(f"{count:>8}{automaton.states:>10}{build_ms:>10.1f}{automaton_rate:>20.0f}{naive_rate}")
+
+
+if __name__ == "__main__":
+    main()
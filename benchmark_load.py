@@ -0,0 +1,477 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+APIサーバーの負荷試験
+/api/process-text・/api/direct-response・/api/process-audio に、指定した同時実行数
+（クローズドループ）または到着レート（オープンループ）でリクエストを送り、
+スループットとレイテンシのパーセンタイル、エラーの内訳を出力します。
+
+--local を指定すると、Dify APIスタンドイン（fake_dify_server.py）とフェイクの音声認識
+（ASR_BACKEND=fake）を使ってAPIサーバーを起動するため、オフラインで再現可能な結果が得られます。
+結果をJSONで保存し、--compare で別のコミットの結果と比較できます。
+
+使用例:
+    python benchmark_load.py --local --scenario text direct audio --concurrency 8 --duration 20
+    python benchmark_load.py --local --scenario text --rate 30 --duration 30 --output after.json --compare before.json
+    python benchmark_load.py --url http://127.0.0.1:8000 --scenario direct --requests 500
+"""
+
+import io
+import os
+import sys
+import json
+import math
+import time
+import wave
+import shlex
+import socket
+import argparse
+import threading
+import subprocess
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from fake_dify_server import FakeDifyServer, add_config_arguments, config_from_args
+
+# 比較に使う指標（値が大きいほど悪いものはTrue）
+COMPARE_METRICS = [("throughput", False), ("p50", True), ("p95", True), ("p99", True), ("error_rate", True)]
+
+# 送信するテキスト
+SAMPLE_TEXTS = [
+    "こんにちは、今日の天気を教えてください",
+    "ありがとう、助かりました",
+    "明日の予定を確認したいです",
+    "おすすめのレストランはありますか",
+    "さようなら、また明日"
+]
+
+
+def make_wav(seconds=1.0, sample_rate=16000, frequency=440.0):
+    """正弦波のWAVデータ（16bitモノラル）を作成"""
+    samples = bytearray()
+    for i in range(int(seconds * sample_rate)):
+        value = int(8000 * math.sin(2 * math.pi * frequency * i / sample_rate))
+        samples += value.to_bytes(2, "little", signed=True)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(bytes(samples))
+    return buffer.getvalue()
+
+
+def vary_wav(wav, variant):
+    """WAVの先頭のサンプルに番号を埋め込む（聞き取れない程度の差で文字起こしのキャッシュを避ける）"""
+    data = bytearray(wav)
+    data[44:48] = variant.to_bytes(4, "little")
+    return bytes(data)
+
+
+class Scenario:
+    """1種類のリクエストの作り方"""
+
+    def __init__(self, name, path, distinct=0, audio_seconds=1.0, offset=0):
+        """初期化メソッド"""
+        self.name = name
+        self.path = path
+        self.distinct = distinct
+        self.offset = offset
+        self.audio = make_wav(audio_seconds) if name == "audio" else None
+
+    def variant(self, index):
+        """リクエスト番号に対応する内容の番号（distinctが0の場合は毎回異なる内容）"""
+        return self.offset + (index % self.distinct if self.distinct else index)
+
+    def request(self, session, base_url, index, timeout):
+        """リクエストを1件送信してレスポンスを返す"""
+        variant = self.variant(index)
+        url = base_url + self.path
+        if self.name == "audio":
+            files = {"audio": (f"bench{variant}.wav", vary_wav(self.audio, variant), "audio/wav")}
+            return session.post(url, files=files, timeout=timeout)
+
+        text = f"{SAMPLE_TEXTS[variant % len(SAMPLE_TEXTS)]}（{variant}）"
+        return session.post(url, json={"text": text}, timeout=timeout)
+
+
+SCENARIOS = {
+    "text": "/api/process-text",
+    "direct": "/api/direct-response",
+    "audio": "/api/process-audio"
+}
+
+
+def percentile(ordered, fraction):
+    """ソート済みのリストのパーセンタイル"""
+    if not ordered:
+        return None
+    return ordered[int(fraction * (len(ordered) - 1))]
+
+
+class LoadResult:
+    """1シナリオ分の計測結果を集計するクラス"""
+
+    def __init__(self):
+        """初期化メソッド"""
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.statuses = {}
+        self.errors = {}
+        self.started = None
+        self.finished = None
+
+    def record(self, latency, status, error=None):
+        """1件分の結果を記録"""
+        with self._lock:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if error:
+                self.errors[error] = self.errors.get(error, 0) + 1
+            else:
+                self.latencies.append(latency)
+
+    def summary(self):
+        """スループット・レイテンシ・エラーの集計を返す"""
+        ordered = sorted(self.latencies)
+        total = sum(self.statuses.values())
+        errors = sum(self.errors.values())
+        elapsed = max(self.finished - self.started, 1e-9)
+        return {
+            "requests": total,
+            "ok": len(ordered),
+            "errors": errors,
+            "error_rate": errors / total if total else 0.0,
+            "elapsed": elapsed,
+            "throughput": len(ordered) / elapsed,
+            "avg": sum(ordered) / len(ordered) if ordered else None,
+            "p50": percentile(ordered, 0.50),
+            "p90": percentile(ordered, 0.90),
+            "p95": percentile(ordered, 0.95),
+            "p99": percentile(ordered, 0.99),
+            "max": ordered[-1] if ordered else None,
+            "statuses": {str(k): v for k, v in sorted(self.statuses.items(), key=lambda item: str(item[0]))},
+            "error_types": self.errors
+        }
+
+
+def send_one(scenario, local, base_url, index, timeout, result, scheduled=None):
+    """1件送信して結果を記録（scheduledを指定した場合はその時刻からのレイテンシ）"""
+    session = getattr(local, "session", None)
+    if session is None:
+        session = local.session = requests.Session()
+
+    start = scheduled if scheduled is not None else time.perf_counter()
+    try:
+        response = scenario.request(session, base_url, index, timeout)
+        latency = time.perf_counter() - start
+    except requests.Timeout:
+        result.record(None, "timeout", "timeout")
+        return
+    except requests.RequestException as e:
+        result.record(None, "connection_error", type(e).__name__)
+        return
+
+    error = None
+    if response.status_code != 200:
+        error = f"http_{response.status_code}"
+    else:
+        try:
+            body = response.json()
+        except ValueError:
+            error = "invalid_json"
+        else:
+            # 処理の失敗は200で返るため、本文のstatusも確認する
+            if isinstance(body, dict) and body.get("status") == "error":
+                error = "status_error"
+    result.record(latency, response.status_code, error)
+
+
+def run_closed_loop(scenario, base_url, concurrency, duration, total, timeout):
+    """concurrency本のスレッドが前のレスポンスを待ってから次を送る"""
+    result = LoadResult()
+    local = threading.local()
+    counter = iter(range(total or sys.maxsize))
+    counter_lock = threading.Lock()
+    deadline = None
+
+    def worker():
+        while time.perf_counter() < deadline:
+            with counter_lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            send_one(scenario, local, base_url, index, timeout, result)
+
+    result.started = time.perf_counter()
+    deadline = result.started + (duration if duration else float("inf"))
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result.finished = time.perf_counter()
+    return result
+
+
+def run_open_loop(scenario, base_url, rate, concurrency, duration, total, timeout):
+    """一定の到着レートで送る（待ち時間を含めて予定時刻からのレイテンシを計測）"""
+    result = LoadResult()
+    local = threading.local()
+    count = total or int(rate * duration)
+    interval = 1.0 / rate
+
+    result.started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for index in range(count):
+            scheduled = result.started + index * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(send_one, scenario, local, base_url, index, timeout, result, scheduled)
+    result.finished = time.perf_counter()
+    return result
+
+
+def free_port():
+    """空いているTCPポートを返す"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(base_url, timeout, process=None):
+    """/readyz が200を返すまで待つ"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"APIサーバーが終了しました（終了コード {process.returncode}）")
+        try:
+            if requests.get(base_url + "/readyz", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{timeout}秒以内にAPIサーバーの準備ができませんでした")
+
+
+def start_local_server(args, dify_url):
+    """Dify APIスタンドインとフェイクの音声認識でAPIサーバーを起動"""
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "PORT": str(port),
+        "DIFY_API_KEY": "benchmark",
+        "DIFY_API_ENDPOINT": dify_url,
+        "ASR_BACKEND": "fake",
+        "ASR_FAKE_LATENCY": str(args.asr_latency),
+        "ZONOS_WORKERS": str(args.zonos_workers),
+        "ZONOS_MOCK_LATENCY": str(args.zonos_latency),
+        "ZONOS_MOCK_CPU": "True",
+        "LOG_FILE": "",
+        "LOG_LEVEL": "WARNING",
+        "DEBUG": "False"
+    })
+    command = shlex.split(args.server_cmd.format(python=shlex.quote(sys.executable), port=port))
+    process = subprocess.Popen(
+        command,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=None if args.verbose else subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_ready(base_url, args.startup_timeout, process)
+    except RuntimeError:
+        process.terminate()
+        raise
+    return process, base_url
+
+
+def git_revision():
+    """現在のコミットのハッシュ（取得できない場合はNone）"""
+    try:
+        completed = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True
+        )
+    except OSError:
+        return None
+    return completed.stdout.strip() or None
+
+
+def fetch_server_stages(base_url):
+    """サーバー側の処理段階ごとの統計を取得（取得できない場合はNone）"""
+    try:
+        response = requests.get(base_url + "/api/stats", timeout=5)
+        return response.json().get("stages")
+    except (requests.RequestException, ValueError):
+        return None
+
+
+def format_ms(value):
+    """秒をミリ秒の文字列に変換"""
+    return f"{value * 1000:.1f}" if value is not None else "-"
+
+
+def print_results(results):
+    """結果を表で出力"""
+    print(f"{'シナリオ':<10}{'件数':>8}{'エラー':>8}{'件/秒':>10}{'p50(ms)':>10}{'p90(ms)':>10}"
+          f"{'p95(ms)':>10}{'p99(ms)':>10}{'最大(ms)':>10}")
+    for name, r in results.items():
+        print(f"{name:<10}{r['requests']:>8}{r['errors']:>8}{r['throughput']:>10.1f}{format_ms(r['p50']):>10}"
+              f"{format_ms(r['p90']):>10}{format_ms(r['p95']):>10}{format_ms(r['p99']):>10}{format_ms(r['max']):>10}")
+        if r["error_types"]:
+            details = ", ".join(f"{k}={v}" for k, v in sorted(r["error_types"].items()))
+            print(f"{'':<10}エラーの内訳: {details}")
+
+
+def compare_results(results, baseline, max_regression):
+    """基準の結果と比較して差分を出力し、許容範囲を超えて悪化した指標の一覧を返す"""
+    regressions = []
+    print(f"\n基準との比較（基準: {baseline.get('revision') or '-'}）")
+    print(f"{'シナリオ':<10}{'指標':<12}{'基準':>12}{'今回':>12}{'変化':>10}")
+    for name, current in results.items():
+        before = baseline.get("results", {}).get(name)
+        if before is None:
+            continue
+        for metric, lower_is_better in COMPARE_METRICS:
+            old, new = before.get(metric), current.get(metric)
+            if old is None or new is None:
+                continue
+            if metric == "error_rate":
+                change = (new - old) * 100
+                label = f"{change:+.1f}pt"
+                worse = change if lower_is_better else -change
+            else:
+                change = (new - old) / old * 100 if old else 0.0
+                label = f"{change:+.1f}%"
+                worse = change if lower_is_better else -change
+            scale = 1 if metric in ("throughput", "error_rate") else 1000
+            print(f"{name:<10}{metric:<12}{old * scale:>12.2f}{new * scale:>12.2f}{label:>10}")
+            if max_regression is not None and worse > max_regression:
+                regressions.append(f"{name} {metric}: {label}")
+    return regressions
+
+
+def main():
+    """メイン関数"""
+    parser = argparse.ArgumentParser(description="APIサーバーの負荷試験")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="APIサーバーのURL（--localの場合は無視）")
+    parser.add_argument("--scenario", nargs="+", choices=sorted(SCENARIOS), default=["text", "direct"],
+                        help="実行するシナリオ")
+    parser.add_argument("--concurrency", type=int, default=8, help="同時実行数（オープンループでは最大同時実行数）")
+    parser.add_argument("--rate", type=float, help="到着レート（件/秒、指定した場合はオープンループ）")
+    parser.add_argument("--duration", type=float, default=10.0, help="各シナリオの実行時間（秒）")
+    parser.add_argument("--requests", type=int, help="各シナリオのリクエスト数（指定した場合は件数で終了）")
+    parser.add_argument("--warmup", type=int, default=5, help="計測前に送るリクエスト数")
+    parser.add_argument("--distinct", type=int, default=0,
+                        help="内容の種類数（0で毎回異なる内容、小さくするとキャッシュが効く）")
+    parser.add_argument("--audio-seconds", type=float, default=1.0, help="audioシナリオの音声の長さ（秒）")
+    parser.add_argument("--timeout", type=float, default=60.0, help="リクエストのタイムアウト（秒）")
+    parser.add_argument("--output", help="結果を保存するJSONファイル")
+    parser.add_argument("--compare", help="比較する基準の結果（JSONファイル）")
+    parser.add_argument("--max-regression", type=float,
+                        help="基準から悪化を許容する割合（%%、エラー率はポイント）。超えた場合は終了コード1")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力")
+    parser.add_argument("--verbose", action="store_true", help="起動したAPIサーバーのログを表示")
+
+    local_group = parser.add_argument_group("ローカル実行（--local）")
+    local_group.add_argument("--local", action="store_true",
+                             help="Dify APIスタンドインとフェイクの音声認識でAPIサーバーを起動して計測")
+    local_group.add_argument("--server-cmd", default="{python} api_server.py",
+                             help="APIサーバーの起動コマンド（{python}と{port}を置換、例: "
+                                  "\"gunicorn -c gunicorn.conf.py -b 127.0.0.1:{port} api_server:app\"）")
+    local_group.add_argument("--startup-timeout", type=float, default=60.0, help="APIサーバーの起動を待つ時間（秒）")
+    local_group.add_argument("--asr-latency", type=float, default=0.0, help="フェイクの音声認識の処理時間（秒）")
+    local_group.add_argument("--zonos-workers", type=int, default=0,
+                             help="Zonosのワーカープロセス数（0でプロセスプールを使わない）")
+    local_group.add_argument("--zonos-latency", type=float, default=0.0,
+                             help="Zonosモックの推論時間（秒、GILを保持して待つ）")
+    add_config_arguments(local_group)
+    args = parser.parse_args()
+
+    dify = None
+    process = None
+    base_url = args.url.rstrip("/")
+    if args.local:
+        dify = FakeDifyServer(("127.0.0.1", 0), config_from_args(args)).start()
+        try:
+            process, base_url = start_local_server(args, dify.url)
+        except RuntimeError as e:
+            dify.stop()
+            print(f"NG: {e}")
+            sys.exit(1)
+
+    results = {}
+    try:
+        for name in args.scenario:
+            scenario = Scenario(name, SCENARIOS[name], args.distinct, args.audio_seconds)
+            # 接続の確立や遅延読み込みの影響を除くため、計測前に数件送る（番号は計測と重ならないようにする）
+            if args.warmup:
+                warmup = Scenario(name, SCENARIOS[name], 0, args.audio_seconds, offset=1_000_000_000)
+                run_closed_loop(warmup, base_url, min(args.concurrency, args.warmup), None, args.warmup, args.timeout)
+
+            if args.rate:
+                result = run_open_loop(scenario, base_url, args.rate, args.concurrency, args.duration,
+                                       args.requests, args.timeout)
+            else:
+                result = run_closed_loop(scenario, base_url, args.concurrency,
+                                         None if args.requests else args.duration, args.requests, args.timeout)
+            results[name] = result.summary()
+        server_stages = fetch_server_stages(base_url)
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if dify is not None:
+            upstream = dify.stats()
+            dify.stop()
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "mode": "open" if args.rate else "closed",
+            "concurrency": args.concurrency,
+            "rate": args.rate,
+            "duration": args.duration,
+            "requests": args.requests,
+            "distinct": args.distinct,
+            "local": args.local
+        },
+        "results": results,
+        "server_stages": server_stages
+    }
+    if dify is not None:
+        report["upstream"] = upstream
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_results(results)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare_results(results, json.load(f), args.max_regression)
+        for regression in regressions:
+            print(f"NG: 基準より悪化しました: {regression}")
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+起動時間のベンチマーク
+新しいPythonプロセスでモジュールのインポートとCLIの実行にかかる時間と
+最大常駐メモリ（RSS）を計測し、テキストのみの処理で音声関連のモジュールが
+読み込まれていないことを確認します。閾値を超えた場合は終了コード1を返します。
+
+使用例:
+    python benchmark_startup.py
+    python benchmark_startup.py --repeat 10 --max-time 1.5 --max-rss 150
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+# テキストのみの処理で読み込まれてはいけない重いモジュール
+HEAVY_MODULES = ["speech_recognition", "pydub", "numpy", "torch", "torchaudio", "whisper", "httpx"]
+
+# 子プロセスで実行するコード（計測結果をJSONで標準出力の最終行に出す）
+CHILD_TEMPLATE = """
+import io, sys, json, time, resource, contextlib
+start = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+{body}
+elapsed = time.perf_counter() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform == "darwin":
+    rss //= 1024
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print(json.dumps({{"time": elapsed, "rss_kb": rss, "heavy_modules": heavy}}))
+"""
+
+# 計測するシナリオ（名前, 子プロセスで実行するコード）
+SCENARIOS = [
+    ("import asulada_zonos_integration", "import asulada_zonos_integration"),
+    ("import api_server", "import api_server"),
+    (
+        "cli main() --text --no-dify",
+        "import asulada_zonos_integration as m\n"
+        "sys.argv = ['asulada_zonos_integration.py', '--text', 'こんにちは', '--no-dify']\n"
+        "m.main()"
+    )
+]
+
+
+def run_scenario(body):
+    """新しいPythonプロセスでシナリオを1回実行して計測結果を返す"""
+    code = CHILD_TEMPLATE.format(
+        body="\n".join("    " + line for line in body.splitlines()),
+        heavy=HEAVY_MODULES
+    )
+    env = dict(os.environ)
+    # 設定がなくても初期化できるようにダミーの値を入れる（ネットワークには接続しない）
+    env.setdefault("DIFY_API_KEY", "benchmark")
+    env.setdefault("DIFY_API_ENDPOINT", "http://127.0.0.1:9")
+    completed = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        capture_output=True,
+        text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip() or f"終了コード {completed.returncode}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    """メイン関数"""
+    parser = argparse.ArgumentParser(description="起動時間とメモリ使用量のベンチマーク")
+    parser.add_argument("--repeat", type=int, default=5, help="各シナリオの実行回数")
+    parser.add_argument("--max-time", type=float, help="起動時間の中央値の上限（秒）")
+    parser.add_argument("--max-rss", type=float, help="最大RSSの中央値の上限（MB）")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力")
+    args = parser.parse_args()
+
+    results = []
+    failures = []
+    for name, body in SCENARIOS:
+        try:
+            samples = [run_scenario(body) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            failures.append(f"{name}: 実行に失敗しました: {e}")
+            continue
+
+        result = {
+            "scenario": name,
+            "time_median": statistics.median(s["time"] for s in samples),
+            "time_min": min(s["time"] for s in samples),
+            "rss_mb_median": statistics.median(s["rss_kb"] for s in samples) / 1024,
+            "heavy_modules": samples[0]["heavy_modules"]
+        }
+        results.append(result)
+
+        if result["heavy_modules"]:
+            failures.append(f"{name}: 重いモジュールが読み込まれています: {', '.join(result['heavy_modules'])}")
+        if args.max_time is not None and result["time_median"] > args.max_time:
+            failures.append(f"{name}: 起動時間 {result['time_median']:.3f}秒 が上限 {args.max_time}秒 を超えました")
+        if args.max_rss is not None and result["rss_mb_median"] > args.max_rss:
+            failures.append(f"{name}: RSS {result['rss_mb_median']:.1f}MB が上限 {args.max_rss}MB を超えました")
+
+    if args.json:
+        print(json.dumps({"results": results, "failures": failures}, ensure_ascii=False, indent=2))
+    else:
+        print(f"{'シナリオ':<36}{'中央値(秒)':>12}{'最小(秒)':>12}{'RSS(MB)':>10}")
+        for r in results:
+            print(f"{r['scenario']:<36}{r['time_median']:>12.3f}{r['time_min']:>12.3f}{r['rss_mb_median']:>10.1f}")
+        for failure in failures:
+            print(f"NG: {failure}")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,444 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Dify APIクライアント
+接続プール付きのセッションを使い回してDify APIにアクセスし、
+ストリーミング（SSE）レスポンスを到着した順に解析します。
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger("dify_client")
+
+# 接続プールのサイズ（ワーカーあたりのスレッド数に合わせる）
+DEFAULT_POOL_SIZE = int(os.getenv("DIFY_POOL_SIZE", "10"))
+
+# 接続・読み取りのタイムアウト（秒）
+DEFAULT_CONNECT_TIMEOUT = float(os.getenv("DIFY_CONNECT_TIMEOUT", "5"))
+DEFAULT_READ_TIMEOUT = float(os.getenv("DIFY_READ_TIMEOUT", "60"))
+
+# 回答のチャンクを含むイベント
+MESSAGE_EVENTS = ("message", "agent_message")
+
+
+class DifyAPIError(Exception):
+    """Dify APIがエラーを返した場合の例外"""
+
+    def __init__(self, message, status_code=None, code=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+
+
+# 再試行してよいHTTPステータス（リクエストが処理されていないもの / 処理された可能性があるもの）
+REJECTED_STATUSES = (429, 503)
+FAILED_STATUSES = (500, 502, 504)
+
+
+def is_retryable_error(error, idempotent=True):
+    """Dify API呼び出しの例外が再試行してよい一時的な障害か
+
+    接続できなかった場合と429/503はリクエストが処理されていないため常に再試行できる。
+    それ以外の5xxや通信の途中での失敗は、会話の状態を変えない（idempotent）場合のみ再試行する。
+    """
+    if isinstance(error, DifyAPIError):
+        if error.status_code in REJECTED_STATUSES:
+            return True
+        return idempotent and (error.status_code in FAILED_STATUSES or error.status_code is None)
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if isinstance(error, requests.RequestException):
+        return idempotent
+    httpx = sys.modules.get("httpx")
+    if httpx is not None and isinstance(error, httpx.TransportError):
+        return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout)) or idempotent
+    return False
+
+
+class DifyMetrics:
+    """Dify API呼び出しのメトリクス（最初のトークンまでの時間など）を集計するクラス"""
+
+    def __init__(self, max_samples=1000):
+        """初期化メソッド"""
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self._ttft = deque(maxlen=max_samples)
+        self._total = deque(maxlen=max_samples)
+
+    def record(self, time_to_first_token=None, total_time=None, error=False):
+        """1回の呼び出し結果を記録"""
+        with self._lock:
+            self.requests += 1
+            if error:
+                self.errors += 1
+            if time_to_first_token is not None:
+                self._ttft.append(time_to_first_token)
+            if total_time is not None:
+                self._total.append(total_time)
+
+    @staticmethod
+    def _summary(samples):
+        """サンプル列から平均とパーセンタイルを計算"""
+        if not samples:
+            return {"count": 0, "avg": None, "p50": None, "p95": None}
+        ordered = sorted(samples)
+        return {
+            "count": len(ordered),
+            "avg": sum(ordered) / len(ordered),
+            "p50": ordered[int(0.50 * (len(ordered) - 1))],
+            "p95": ordered[int(0.95 * (len(ordered) - 1))]
+        }
+
+    def snapshot(self):
+        """現在のメトリクスを辞書で返す"""
+        with self._lock:
+            ttft = list(self._ttft)
+            total = list(self._total)
+            requests_count = self.requests
+            errors = self.errors
+        return {
+            "requests": requests_count,
+            "errors": errors,
+            "time_to_first_token": self._summary(ttft),
+            "total_time": self._summary(total)
+        }
+
+
+class SSEParser:
+    """SSEの行を1行ずつ受け取り、完成したイベント（JSONをデコードした辞書）を返すパーサー"""
+
+    def __init__(self):
+        """初期化メソッド"""
+        self.data_lines = []
+
+    def feed_line(self, line):
+        """1行を取り込み、イベントが完成した場合はその辞書を返す"""
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        line = line.rstrip("\r")
+
+        # 空行はイベントの区切り
+        if not line:
+            return self.flush()
+
+        # コメント行（keep-alive用）は無視
+        if line.startswith(":"):
+            return None
+
+        field, _, value = line.partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+        if field == "data":
+            self.data_lines.append(value)
+        return None
+
+    def flush(self):
+        """溜まっているdataフィールドをJSONとしてデコード"""
+        if not self.data_lines:
+            return None
+        data = "\n".join(self.data_lines)
+        self.data_lines = []
+        try:
+            return json.loads(data)
+        except ValueError:
+            logger.warning("SSEイベントをデコードできませんでした: %s", data[:100])
+            return None
+
+
+def iter_sse_events(lines):
+    """SSEの行イテレータからイベントを逐次生成"""
+    parser = SSEParser()
+    for line in lines:
+        event = parser.feed_line(line)
+        if event is not None:
+            yield event
+
+    # 最後の区切りがないまま終了した場合
+    event = parser.flush()
+    if event is not None:
+        yield event
+
+
+async def aiter_sse_events(lines):
+    """SSEの非同期行イテレータからイベントを逐次生成"""
+    parser = SSEParser()
+    async for line in lines:
+        event = parser.feed_line(line)
+        if event is not None:
+            yield event
+
+    event = parser.flush()
+    if event is not None:
+        yield event
+
+
+class DifyStreamAccumulator:
+    """SSEイベントを順に受け取り、ブロッキングモードと同じ形式のレスポンスに集約するクラス"""
+
+    def __init__(self, conversation_id=""):
+        """初期化メソッド"""
+        self.start = time.perf_counter()
+        self.first_token_at = None
+        self.answer_parts = []
+        self.chunks = 0
+        self.response = {
+            "event": "message",
+            "message_id": "",
+            "conversation_id": conversation_id,
+            "answer": "",
+            "metadata": {},
+            "created_at": None
+        }
+
+    @property
+    def answer(self):
+        """これまでに受信した回答テキスト"""
+        return "".join(self.answer_parts)
+
+    def feed(self, event):
+        """イベントを1つ取り込み、回答に追加されたテキスト（なければNone）を返す"""
+        event_type = event.get("event")
+        delta = None
+        if event_type in MESSAGE_EVENTS:
+            if self.first_token_at is None:
+                self.first_token_at = time.perf_counter()
+            delta = event.get("answer", "")
+            self.answer_parts.append(delta)
+            self.chunks += 1
+        elif event_type == "message_replace":
+            self.answer_parts = [event.get("answer", "")]
+        elif event_type == "message_end":
+            self.response["metadata"] = event.get("metadata", {})
+        else:
+            return None
+
+        for key in ("message_id", "conversation_id", "created_at"):
+            if event.get(key):
+                self.response[key] = event[key]
+        return delta
+
+    def result(self):
+        """集約したレスポンスを返す"""
+        result = dict(self.response)
+        result["answer"] = self.answer
+        result["streaming"] = {
+            "chunks": self.chunks,
+            "time_to_first_token": (self.first_token_at - self.start) if self.first_token_at else None,
+            "total_time": time.perf_counter() - self.start
+        }
+        return result
+
+
+class DifyClient:
+    """接続プールを持つDify APIクライアント"""
+
+    def __init__(self, api_key, endpoint, pool_size=None, timeout=None):
+        """初期化メソッド"""
+        self.endpoint = endpoint.rstrip("/")
+        self.timeout = timeout or (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)
+        self.pool_size = pool_size or DEFAULT_POOL_SIZE
+        self.metrics = DifyMetrics()
+
+        # keep-aliveで接続を使い回すセッション
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+            "Accept": "text/event-stream"
+        })
+        logger.debug("DifyClientを初期化しました（プールサイズ: %s）", self.pool_size)
+
+    def stream_chat(self, query, conversation_id="", user="user", inputs=None, deadline=None):
+        """チャットメッセージをストリーミングモードで送信し、SSEイベントを到着順に返す
+
+        deadline（upstream_guard.Deadline）を指定すると、読み取りのタイムアウトを残り時間までに縮め、
+        イベントごとに期限切れとキャンセルを確認する
+        """
+        payload = {
+            "inputs": inputs or {},
+            "query": query,
+            "response_mode": "streaming",
+            "conversation_id": conversation_id,
+            "user": user
+        }
+
+        start = time.perf_counter()
+        first_token_at = None
+        error = True
+        try:
+            with self.session.post(
+                f"{self.endpoint}/chat-messages",
+                json=payload,
+                stream=True,
+                timeout=self.request_timeout(deadline)
+            ) as response:
+                if response.status_code != 200:
+                    raise DifyAPIError(
+                        f"Dify APIエラー: {response.status_code} {response.text[:500]}",
+                        status_code=response.status_code
+                    )
+
+                for event in iter_sse_events(response.iter_lines(chunk_size=1024)):
+                    if deadline is not None:
+                        deadline.check()
+                    event_type = event.get("event")
+                    if event_type in MESSAGE_EVENTS and first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    elif event_type == "error":
+                        raise DifyAPIError(
+                            f"Dify APIエラー: {event.get('message', '')}",
+                            status_code=event.get("status"),
+                            code=event.get("code")
+                        )
+                    yield event
+            error = False
+        finally:
+            end = time.perf_counter()
+            self.metrics.record(
+                time_to_first_token=(first_token_at - start) if first_token_at else None,
+                total_time=end - start,
+                error=error
+            )
+
+    def warm_up(self):
+        """軽量なリクエストで接続（TCP+TLS）を確立しておく"""
+        try:
+            response = self.session.get(f"{self.endpoint}/parameters", params={"user": "user"}, timeout=self.timeout)
+            response.close()
+            logger.info("Dify APIへの接続を確立しました（ステータス: %s）", response.status_code)
+            return True
+        except requests.RequestException as e:
+            logger.warning("Dify APIへの事前接続に失敗しました: %s", e)
+            return False
+
+    def request_timeout(self, deadline=None):
+        """(接続, 読み取り)のタイムアウト（deadline指定時は残り時間を超えない）"""
+        if deadline is None:
+            return self.timeout
+        connect_timeout, read_timeout = self.timeout
+        return (deadline.timeout(connect_timeout), deadline.timeout(read_timeout))
+
+    def chat(self, query, conversation_id="", user="user", inputs=None, deadline=None):
+        """ストリーミングレスポンスを集約し、ブロッキングモードと同じ形式の辞書で返す"""
+        accumulator = DifyStreamAccumulator(conversation_id=conversation_id)
+        for event in self.stream_chat(query, conversation_id=conversation_id, user=user, inputs=inputs, deadline=deadline):
+            accumulator.feed(event)
+        return accumulator.result()
+
+    def close(self):
+        """セッションを閉じる"""
+        self.session.close()
+
+
+class AsyncDifyClient:
+    """asyncio用の接続プールを持つDify APIクライアント"""
+
+    def __init__(self, api_key, endpoint, pool_size=None, timeout=None):
+        """初期化メソッド"""
+        # httpxはASGIサーバーモードでのみ必要なため、使用時に読み込む
+        try:
+            import httpx
+        except ImportError as e:
+            raise ImportError("AsyncDifyClientにはhttpxが必要です（pip install httpx）") from e
+
+        self._httpx = httpx
+        self.endpoint = endpoint.rstrip("/")
+        self.pool_size = pool_size or DEFAULT_POOL_SIZE
+        self.metrics = DifyMetrics()
+        self.timeout = timeout or (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)
+        connect_timeout, read_timeout = self.timeout
+
+        self.client = httpx.AsyncClient(
+            headers={
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json",
+                "Accept": "text/event-stream"
+            },
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=self.pool_size,
+                max_keepalive_connections=self.pool_size
+            )
+        )
+        logger.debug("AsyncDifyClientを初期化しました（最大接続数: %s）", self.pool_size)
+
+    def request_timeout(self, deadline=None):
+        """リクエストのタイムアウト（deadline指定時は残り時間を超えない）"""
+        connect_timeout, read_timeout = self.timeout
+        if deadline is not None:
+            connect_timeout, read_timeout = deadline.timeout(connect_timeout), deadline.timeout(read_timeout)
+        return self._httpx.Timeout(read_timeout, connect=connect_timeout)
+
+    async def stream_chat(self, query, conversation_id="", user="user", inputs=None, deadline=None):
+        """チャットメッセージをストリーミングモードで送信し、SSEイベントを到着順に返す"""
+        payload = {
+            "inputs": inputs or {},
+            "query": query,
+            "response_mode": "streaming",
+            "conversation_id": conversation_id,
+            "user": user
+        }
+
+        start = time.perf_counter()
+        first_token_at = None
+        error = True
+        try:
+            async with self.client.stream(
+                "POST",
+                f"{self.endpoint}/chat-messages",
+                json=payload,
+                timeout=self.request_timeout(deadline)
+            ) as response:
+                if response.status_code != 200:
+                    body = await response.aread()
+                    raise DifyAPIError(
+                        f"Dify APIエラー: {response.status_code} {body[:500].decode('utf-8', 'replace')}",
+                        status_code=response.status_code
+                    )
+
+                async for event in aiter_sse_events(response.aiter_lines()):
+                    if deadline is not None:
+                        deadline.check()
+                    event_type = event.get("event")
+                    if event_type in MESSAGE_EVENTS and first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    elif event_type == "error":
+                        raise DifyAPIError(
+                            f"Dify APIエラー: {event.get('message', '')}",
+                            status_code=event.get("status"),
+                            code=event.get("code")
+                        )
+                    yield event
+            error = False
+        finally:
+            end = time.perf_counter()
+            self.metrics.record(
+                time_to_first_token=(first_token_at - start) if first_token_at else None,
+                total_time=end - start,
+                error=error
+            )
+
+    async def chat(self, query, conversation_id="", user="user", inputs=None, deadline=None):
+        """ストリーミングレスポンスを集約し、ブロッキングモードと同じ形式の辞書で返す"""
+        accumulator = DifyStreamAccumulator(conversation_id=conversation_id)
+        async for event in self.stream_chat(query, conversation_id=conversation_id, user=user, inputs=inputs, deadline=deadline):
+            accumulator.feed(event)
+        return accumulator.result()
+
+    async def close(self):
+        """クライアントを閉じる"""
+        await self.client.aclose()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+ローカル用のDify APIスタンドイン
+/chat-messages にストリーミング（SSE）またはブロッキングモードで応答し、
+最初のトークンまでの時間・トークン間隔・エラー率（HTTP 500/429、ストリーム中のerrorイベント）を
+設定できます。負荷試験をオフラインで再現できるように、乱数はシードで固定します。
+
+使用例:
+    python fake_dify_server.py --port 8765 --first-token-latency 0.3 --token-latency 0.02
+    DIFY_API_ENDPOINT=http://127.0.0.1:8765 DIFY_API_KEY=dummy python api_server.py
+"""
+
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeDifyConfig:
+    """スタンドインの応答の設定"""
+
+    def __init__(self, tokens=8, first_token_latency=0.2, token_latency=0.02, jitter=0.0,
+                 error_rate=0.0, rate_limit_rate=0.0, stream_error_rate=0.0, answer="テスト応答です", seed=0):
+        """初期化メソッド"""
+        self.tokens = max(1, tokens)
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.stream_error_rate = stream_error_rate
+        self.answer = answer
+        self.seed = seed
+
+
+class FakeDifyHandler(BaseHTTPRequestHandler):
+    """Dify APIのエンドポイントを模倣するハンドラー"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # アクセスログは出力しない（負荷試験の邪魔になるため）
+        pass
+
+    def send_json(self, status, data, headers=None):
+        """JSONレスポンスを送信"""
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def write_chunk(self, text):
+        """チャンク転送エンコーディングで1チャンクを送信"""
+        data = text.encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.startswith("/parameters"):
+            self.send_json(200, {"opening_statement": "", "suggested_questions": []})
+        elif self.path.startswith("/stats"):
+            self.send_json(200, self.server.stats())
+        else:
+            self.send_json(404, {"code": "not_found", "message": "Not Found"})
+
+    def do_POST(self):
+        if not self.path.startswith("/chat-messages"):
+            self.send_json(404, {"code": "not_found", "message": "Not Found"})
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self.send_json(400, {"code": "invalid_param", "message": "Invalid JSON"})
+            return
+
+        outcome, delays = self.server.plan()
+        if outcome == "error":
+            self.send_json(500, {"code": "internal_server_error", "message": "fake upstream error", "status": 500})
+            return
+        if outcome == "rate_limit":
+            self.send_json(429, {"code": "too_many_requests", "message": "fake rate limit", "status": 429},
+                           headers={"Retry-After": "1"})
+            return
+
+        conversation_id = payload.get("conversation_id") or str(uuid.uuid4())
+        message_id = str(uuid.uuid4())
+        parts = self.server.answer_parts(payload.get("query", ""))
+
+        if payload.get("response_mode") != "streaming":
+            time.sleep(sum(delays))
+            self.send_json(200, {
+                "event": "message",
+                "message_id": message_id,
+                "conversation_id": conversation_id,
+                "answer": "".join(parts),
+                "metadata": {"usage": {"total_tokens": len(parts)}}
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for index, (part, delay) in enumerate(zip(parts, delays)):
+                time.sleep(delay)
+                if outcome == "stream_error" and index == len(parts) // 2:
+                    event = {"event": "error", "status": 500, "code": "internal_server_error",
+                             "message": "fake stream error", "message_id": message_id}
+                    self.write_chunk("data: " + json.dumps(event, ensure_ascii=False) + "\n\n")
+                    break
+                event = {"event": "message", "answer": part, "conversation_id": conversation_id,
+                         "message_id": message_id}
+                self.write_chunk("data: " + json.dumps(event, ensure_ascii=False) + "\n\n")
+            else:
+                self.write_chunk("event: ping\n\n")
+                event = {"event": "message_end", "conversation_id": conversation_id, "message_id": message_id,
+                         "metadata": {"usage": {"total_tokens": len(parts)}}}
+                self.write_chunk("data: " + json.dumps(event, ensure_ascii=False) + "\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # クライアントが途中で切断した場合
+            self.close_connection = True
+
+
+class FakeDifyServer(ThreadingHTTPServer):
+    """設定と統計を持つスタンドインのサーバー"""
+
+    daemon_threads = True
+
+    def __init__(self, address, config=None):
+        """初期化メソッド"""
+        super().__init__(address, FakeDifyHandler)
+        self.config = config or FakeDifyConfig()
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._counts = {"requests": 0, "ok": 0, "error": 0, "rate_limit": 0, "stream_error": 0}
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def plan(self):
+        """次のリクエストの結果と各トークンの待ち時間を決める"""
+        config = self.config
+        with self._lock:
+            roll = self._rng.random()
+            if roll < config.error_rate:
+                outcome = "error"
+            elif roll < config.error_rate + config.rate_limit_rate:
+                outcome = "rate_limit"
+            elif roll < config.error_rate + config.rate_limit_rate + config.stream_error_rate:
+                outcome = "stream_error"
+            else:
+                outcome = "ok"
+            delays = [
+                max(0.0, base + self._rng.uniform(-config.jitter, config.jitter) * base)
+                for base in [config.first_token_latency] + [config.token_latency] * (config.tokens - 1)
+            ]
+            self._counts["requests"] += 1
+            self._counts[outcome] += 1
+        return outcome, delays
+
+    def answer_parts(self, query):
+        """回答をトークン数のチャンクに分割（最後に質問を含める）"""
+        text = f"{self.config.answer}（{query}）"
+        size = max(1, -(-len(text) // self.config.tokens))
+        parts = [text[i:i + size] for i in range(0, len(text), size)]
+        return parts + [""] * (self.config.tokens - len(parts))
+
+    def stats(self):
+        """リクエスト数と結果ごとの件数を返す"""
+        with self._lock:
+            return dict(self._counts)
+
+    def start(self):
+        """バックグラウンドのスレッドで応答を開始"""
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-dify", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """応答を停止"""
+        self.shutdown()
+        self.server_close()
+
+
+def add_config_arguments(parser):
+    """スタンドインの設定のコマンドライン引数を追加"""
+    parser.add_argument("--tokens", type=int, default=8, help="回答のトークン（チャンク）数")
+    parser.add_argument("--first-token-latency", type=float, default=0.2, help="最初のトークンまでの時間（秒）")
+    parser.add_argument("--token-latency", type=float, default=0.02, help="トークンの間隔（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="待ち時間のばらつき（割合、0.2で±20%%）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="HTTP 500を返す割合")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="HTTP 429を返す割合")
+    parser.add_argument("--stream-error-rate", type=float, default=0.0, help="ストリームの途中でerrorイベントを返す割合")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+
+
+def config_from_args(args):
+    """コマンドライン引数から設定を作成"""
+    return FakeDifyConfig(
+        tokens=args.tokens,
+        first_token_latency=args.first_token_latency,
+        token_latency=args.token_latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        stream_error_rate=args.stream_error_rate,
+        seed=args.seed
+    )
+
+
+def main():
+    """メイン関数"""
+    parser = argparse.ArgumentParser(description="ローカル用のDify APIスタンドイン")
+    parser.add_argument("--host", default="127.0.0.1", help="待ち受けるアドレス")
+    parser.add_argument("--port", type=int, default=8765, help="待ち受けるポート")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeDifyServer((args.host, args.port), config_from_args(args))
+    print(f"Dify APIスタンドインを起動しました: {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
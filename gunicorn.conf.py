@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+"""
+Asurada GPT + Zonos 統合システム 本番用gunicorn設定
+マルチプロセス・マルチスレッドでapi_serverを起動します。
+
+起動例:
+    gunicorn -c gunicorn.conf.py api_server:app
+
+統合システムやZonosClientはフォーク後の各ワーカー内で作成し、
+上流への接続と音声処理スタックをウォームアップしてから/readyzを200にします。
+SIGTERMを受けるとreadinessを落とし、実行中のリクエストとジョブの完了を待ってから終了します。
+"""
+
+import os
+import signal
+import multiprocessing
+
+# 待ち受けアドレス
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+# ワーカープロセス数とワーカーあたりのスレッド数
+workers = int(os.getenv("WEB_CONCURRENCY", str(min(multiprocessing.cpu_count(), 4))))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+
+# ワーカーごとにインポートして初期化する（フォーク前に接続やスレッドを作らない）
+preload_app = False
+
+# タイムアウト（秒）
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+# メモリリーク対策として一定数のリクエストごとにワーカーを入れ替える
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "0"))
+
+# ログ
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info").lower()
+
+
+def post_worker_init(worker):
+    """ワーカー起動後にサービスを作成・ウォームアップし、SIGTERMでドレインを開始するようにする"""
+    import api_server
+
+    # 設定不足の場合はプロセスを落とさず、/readyzでエラーを返し続ける
+    try:
+        api_server.warm_up()
+    except api_server.ConfigurationError as e:
+        worker.log.error(f"ワーカーの初期化に失敗しました: {e}")
+
+    # gunicornのSIGTERMハンドラの前にreadinessを落とす
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def on_sigterm(signum, frame):
+        api_server.mark_draining()
+        if callable(previous):
+            previous(signum, frame)
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+
+
+def worker_exit(server, worker):
+    """ワーカー終了時にジョブの完了を待ってから上流への接続を閉じる"""
+    import api_server
+
+    api_server.shutdown_services()
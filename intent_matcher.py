@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+インテントマッチャー
+ルールファイル（JSON）に定義したキーワードをAho-Corasickオートマトンにまとめ、
+正規化した入力テキストを1回走査するだけで一致するインテントを求めます。
+ルール数が数千件に増えても照合時間は入力の長さにほぼ比例します。
+正規化はNFKC（全角/半角の統一）、カタカナのひらがなへの統一、大文字小文字の同一視で行います。
+ルールファイルが更新されると新しいオートマトンを作成してから差し替えるため、
+処理中のリクエストを止めずに再読み込みできます。
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+import unicodedata
+from collections import deque
+
+logger = logging.getLogger("intent_matcher")
+
+# ルールファイルの場所と更新確認の間隔（秒、0以下で自動再読み込みしない）
+INTENT_RULES_PATH = os.getenv("INTENT_RULES_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "intents.json")
+INTENT_RELOAD_INTERVAL = float(os.getenv("INTENT_RELOAD_INTERVAL", "5"))
+
+# カタカナ（ァ〜ヶ）をひらがなに変換する表
+KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+
+
+def fold_text(text):
+    """照合用にテキストを正規化（全角/半角の統一、カタカナとひらがな、大文字小文字の同一視）"""
+    return unicodedata.normalize("NFKC", text).translate(KATAKANA_TO_HIRAGANA).casefold()
+
+
+class Intent:
+    """1件のインテント（キーワード・応答・優先度）"""
+
+    __slots__ = ("name", "patterns", "response", "priority", "order")
+
+    def __init__(self, name, patterns, response, priority=0, order=0):
+        """初期化メソッド"""
+        self.name = name
+        self.patterns = patterns
+        self.response = response
+        self.priority = priority
+        self.order = order
+
+    def rank(self):
+        """優先度の高い順、同じ優先度ならルールファイルで先に書かれた順"""
+        return (-self.priority, self.order)
+
+
+class KeywordAutomaton:
+    """キーワードをまとめたAho-Corasickオートマトン（作成後は変更しない）
+
+    各状態には、その状態で一致するキーワード（接尾辞での一致を含む）の値を_mergeでまとめたものを持ちます。
+    """
+
+    def __init__(self, keywords):
+        """初期化メソッド（keywordsは(キーワード, 値)の組）"""
+        self._goto = [{}]
+        self._fail = [0]
+        # 各状態で一致するキーワードの値（なければNone）
+        self._values = [None]
+
+        for pattern, value in keywords:
+            self._add(fold_text(pattern), value)
+        self._build()
+
+    def _merge(self, a, b):
+        """同じ状態で一致する2つの値をまとめる（どちらもNoneではない）"""
+        raise NotImplementedError
+
+    def _combine(self, a, b):
+        """Noneを考慮して2つの値をまとめる"""
+        if a is None:
+            return b
+        if b is None:
+            return a
+        return self._merge(a, b)
+
+    def _add(self, pattern, value):
+        """キーワードをトライ木に追加"""
+        if not pattern:
+            return
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._values.append(None)
+            state = next_state
+        self._values[state] = self._combine(self._values[state], value)
+
+    def _build(self):
+        """幅優先で失敗リンクを張り、接尾辞で一致するキーワードの値を各状態に集約"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[next_state] = fail
+                self._values[next_state] = self._combine(self._values[next_state], self._values[fail])
+
+    @property
+    def states(self):
+        """状態数"""
+        return len(self._goto)
+
+    def scan(self, text):
+        """正規化したテキストを1回走査し、一致した位置ごとにその状態の値を返す"""
+        goto, fail, values = self._goto, self._fail, self._values
+        state = 0
+        for char in fold_text(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if values[state] is not None:
+                yield values[state]
+
+
+class IntentAutomaton(KeywordAutomaton):
+    """インテントのキーワードをまとめたオートマトン（各状態には最も優先されるインテントを持つ）"""
+
+    def __init__(self, intents):
+        """初期化メソッド"""
+        self.intents = intents
+        super().__init__((pattern, intent) for intent in intents for pattern in intent.patterns)
+
+    def _merge(self, a, b):
+        """優先されるほうのインテントを返す"""
+        return a if a.rank() <= b.rank() else b
+
+    def match(self, text):
+        """正規化したテキストを1回走査し、最も優先される一致インテントを返す（なければNone）"""
+        best = None
+        for found in self.scan(text):
+            if best is None or found.rank() < best.rank():
+                best = found
+        return best
+
+
+def load_intents(path):
+    """ルールファイルを読み込んでインテントのリストを返す"""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    rules = data.get("intents", []) if isinstance(data, dict) else data
+    if not isinstance(rules, list):
+        raise ValueError("不正なルールファイルです: インテントのリストが必要です")
+
+    intents = []
+    for order, rule in enumerate(rules):
+        if not isinstance(rule, dict):
+            raise ValueError(f"不正なルールです（{order}番目）: オブジェクトが必要です")
+        patterns = rule.get("patterns") or []
+        if not rule.get("name") or not isinstance(patterns, list) or "response" not in rule:
+            raise ValueError(f"不正なルールです（{order}番目）: name, patterns, responseが必要です")
+        try:
+            priority = int(rule.get("priority") or 0)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"不正なルールです（{order}番目）: priorityは整数で指定してください") from e
+        intents.append(Intent(
+            name=rule["name"],
+            patterns=[str(p) for p in patterns],
+            response=rule["response"],
+            priority=priority,
+            order=order
+        ))
+    return intents
+
+
+class IntentMatcher:
+    """ルールファイルから作成したオートマトンでインテントを判定するクラス（ファイル更新時は自動で再読み込み）"""
+
+    def __init__(self, path=INTENT_RULES_PATH, reload_interval=INTENT_RELOAD_INTERVAL):
+        """初期化メソッド"""
+        self.path = path
+        self.reload_interval = reload_interval
+        self._automaton = IntentAutomaton([])
+        self._mtime = None
+        self._checked_at = 0.0
+        self._reload_lock = threading.Lock()
+        self.reloads = 0
+        self.reload_errors = 0
+        self.reload()
+
+    def reload(self):
+        """ルールファイルを読み込み直す（失敗した場合は現在のルールを使い続ける）"""
+        with self._reload_lock:
+            try:
+                mtime = os.stat(self.path).st_mtime
+                start = time.perf_counter()
+                automaton = IntentAutomaton(load_intents(self.path))
+            except (OSError, ValueError) as e:
+                self.reload_errors += 1
+                logger.error("インテントのルールを読み込めませんでした（%s）: %s", self.path, e)
+                return False
+            # 作成済みのオートマトンに参照を差し替えるだけなので、照合中のリクエストには影響しない
+            self._automaton = automaton
+            self._mtime = mtime
+            self.reloads += 1
+            logger.info(
+                "インテントのルールを読み込みました（%s件, 状態数: %s, %.3f秒）",
+                len(automaton.intents), automaton.states, time.perf_counter() - start
+            )
+            return True
+
+    def _reload_if_changed(self):
+        """一定間隔でルールファイルの更新日時を確認し、変わっていれば再読み込み"""
+        if self.reload_interval <= 0:
+            return
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime != self._mtime and not self._reload_lock.locked():
+            # 読み込みに失敗した場合も、同じファイルに対しては再試行しない
+            self._mtime = mtime
+            self.reload()
+
+    def match(self, text):
+        """テキストに一致する最も優先度の高いインテントを返す（なければNone）"""
+        self._reload_if_changed()
+        return self._automaton.match(text)
+
+    def stats(self):
+        """ルール数などの統計を返す"""
+        automaton = self._automaton
+        return {
+            "path": self.path,
+            "intents": len(automaton.intents),
+            "states": automaton.states,
+            "reloads": self.reloads,
+            "reload_errors": self.reload_errors
+        }
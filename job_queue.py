@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+非同期ジョブキュー
+時間のかかる音声処理をリクエストから切り離し、上限付きのキューとワーカースレッドで実行します。
+クライアントはジョブIDで結果をポーリング（またはロングポーリング）します。
+"""
+
+import os
+import time
+import uuid
+import queue
+import logging
+import threading
+from collections import OrderedDict, deque
+
+from log_setup import get_request_id, set_request_id
+
+logger = logging.getLogger("job_queue")
+
+# ジョブキューの設定
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+JOB_TTL = float(os.getenv("JOB_TTL", "600"))
+JOB_MAX_WAIT = float(os.getenv("JOB_MAX_WAIT", "30"))
+
+
+class QueueFullError(Exception):
+    """ジョブキューが満杯の場合の例外"""
+
+
+class Job:
+    """1件のジョブ"""
+
+    def __init__(self, payload):
+        """初期化メソッド"""
+        self.id = uuid.uuid4().hex
+        self.payload = payload
+        self.request_id = get_request_id()
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        """ジョブの状態を辞書で返す"""
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+        if self.status == "done":
+            data["result"] = self.result
+        elif self.status == "failed":
+            data["error"] = self.error
+        return data
+
+
+class JobQueue:
+    """上限付きキューとワーカースレッドでジョブを実行するクラス"""
+
+    def __init__(self, handler, workers=JOB_WORKERS, max_queue=JOB_QUEUE_SIZE, ttl=JOB_TTL):
+        """初期化メソッド"""
+        self.handler = handler
+        self.ttl = ttl
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._closed = False
+        self._wait_times = deque(maxlen=1000)
+        self._run_times = deque(maxlen=1000)
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.expired = 0
+
+        self._workers = [
+            threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+        self._reaper = threading.Thread(target=self._reap, name="job-reaper", daemon=True)
+        self._reaper.start()
+        logger.info("JobQueueを初期化しました（ワーカー数: %s, キュー上限: %s, TTL: %s秒）", workers, max_queue, ttl)
+
+    def submit(self, payload):
+        """ジョブを投入（キューが満杯、または停止中の場合はQueueFullError）"""
+        if self._closed:
+            raise QueueFullError("ジョブキューは停止中です")
+        job = Job(payload)
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+                self.rejected += 1
+            raise QueueFullError("ジョブキューが満杯です")
+        logger.info("ジョブを投入しました: %s（キュー長: %s）", job.id, self._queue.qsize())
+        return job
+
+    def get(self, job_id):
+        """ジョブを取得（存在しないか期限切れの場合はNone）"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def wait(self, job_id, timeout):
+        """ジョブの完了を最大timeout秒待ってから返す（ロングポーリング用）"""
+        job = self.get(job_id)
+        if job is not None and timeout > 0:
+            job.done.wait(min(timeout, JOB_MAX_WAIT))
+        return job
+
+    def _worker(self):
+        """キューからジョブを取り出して実行"""
+        while not self._stopping.is_set():
+            try:
+                job = self._queue.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            # ジョブのログには投入したリクエストのIDを付ける
+            set_request_id(job.request_id)
+            job.status = "running"
+            job.started_at = time.time()
+            with self._lock:
+                self.running += 1
+                self._wait_times.append(job.started_at - job.created_at)
+
+            try:
+                job.result = self.handler(job.payload)
+                job.status = "done"
+            except Exception as e:
+                logger.error("ジョブ %s の実行中にエラーが発生しました: %s", job.id, e)
+                job.error = "ジョブの実行中にエラーが発生しました"
+                job.status = "failed"
+            finally:
+                close = getattr(job.payload, "close", None)
+                if close is not None:
+                    close()
+                job.payload = None
+                job.finished_at = time.time()
+                with self._lock:
+                    self.running -= 1
+                    self._run_times.append(job.finished_at - job.started_at)
+                    if job.status == "done":
+                        self.completed += 1
+                    else:
+                        self.failed += 1
+                job.done.set()
+                self._queue.task_done()
+
+    def _reap(self):
+        """TTLを過ぎた完了済みジョブを定期的に削除"""
+        while not self._stopping.wait(min(self.ttl, 10)):
+            now = time.time()
+            with self._lock:
+                expired = [
+                    job_id for job_id, job in self._jobs.items()
+                    if job.finished_at is not None and now - job.finished_at > self.ttl
+                ]
+                for job_id in expired:
+                    del self._jobs[job_id]
+                self.expired += len(expired)
+            if expired:
+                logger.debug("期限切れのジョブを%s件削除しました", len(expired))
+
+    @staticmethod
+    def _summary(samples):
+        """サンプル列から平均とパーセンタイルを計算"""
+        if not samples:
+            return {"count": 0}
+        ordered = sorted(samples)
+        return {
+            "count": len(ordered),
+            "avg": sum(ordered) / len(ordered),
+            "p50": ordered[int(0.50 * (len(ordered) - 1))],
+            "p95": ordered[int(0.95 * (len(ordered) - 1))]
+        }
+
+    def stats(self):
+        """キュー長や待ち時間などの統計を返す"""
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "queue_capacity": self._queue.maxsize,
+                "workers": len(self._workers),
+                "running": self.running,
+                "tracked_jobs": len(self._jobs),
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "expired": self.expired,
+                "wait_time": self._summary(self._wait_times),
+                "run_time": self._summary(self._run_times)
+            }
+
+    def drain(self, timeout):
+        """新規の受け付けを止め、キュー内と実行中のジョブが終わるまで最大timeout秒待つ"""
+        self._closed = True
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            # unfinished_tasksはキュー内と実行中のジョブの合計
+            if self._queue.unfinished_tasks == 0:
+                return True
+            time.sleep(0.1)
+        logger.warning("ジョブの完了を待たずに停止します（残り: %s件）", self._queue.qsize())
+        return False
+
+    def shutdown(self):
+        """ワーカーを停止"""
+        self._closed = True
+        self._stopping.set()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+ロギングの設定
+ログはキュー経由で専用スレッド（QueueListener）に渡し、リクエストを処理するスレッドでは
+ファイルへの書き込みを行いません。キューが満杯の場合はログを破棄して処理を止めません。
+出力はテキストまたはJSON Lines（リクエストID付き）で、ファイルはサイズでローテーションします。
+WARNING未満のログはロガーごとにサンプリングできます。
+"""
+
+import os
+import sys
+import json
+import queue
+import asyncio
+import functools
+import atexit
+import uuid
+import random
+import logging
+import threading
+import contextvars
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# ログ設定
+LOG_LEVEL = os.getenv("LOG_LEVEL") or ("DEBUG" if os.getenv("DEBUG", "False").lower() == "true" else "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_FILE = os.getenv("LOG_FILE")
+# LOG_FILEを指定しない場合にログファイルを置くディレクトリ
+LOG_DIR = os.getenv("LOG_DIR", "logs")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# WARNING未満のログを残す割合（例: "asurada_zonos=0.1,zonos_mock=0.01"、指定のないロガーは1.0）
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s"
+
+# 処理中のリクエストID（スレッドおよびasyncioのタスクごと）
+request_id_var = contextvars.ContextVar("request_id", default="-")
+
+_handler = None
+_listener = None
+_setup_lock = threading.Lock()
+
+
+def run_in_executor(func, *args):
+    """イベントループのスレッドプールで関数を実行（リクエストIDと段階の記録などのコンテキストを引き継ぐ）"""
+    context = contextvars.copy_context()
+    return asyncio.get_running_loop().run_in_executor(None, functools.partial(context.run, func, *args))
+
+
+def get_request_id():
+    """現在のリクエストIDを返す"""
+    return request_id_var.get()
+
+
+def set_request_id(request_id):
+    """現在のリクエストIDを設定し、元に戻すためのトークンを返す"""
+    return request_id_var.set(request_id or "-")
+
+
+def new_request_id(requested=None):
+    """クライアントが指定したリクエストIDが使える場合はそれを、そうでなければ新しいIDを返す"""
+    if requested and len(requested) <= 64 and requested.isprintable():
+        return requested
+    return uuid.uuid4().hex
+
+
+def parse_sample_rates(value):
+    """"name=rate,..." 形式の文字列をロガー名と割合の辞書に変換"""
+    rates = {}
+    for part in value.split(","):
+        name, sep, rate = part.strip().partition("=")
+        if sep and name:
+            rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+class Preview:
+    """ログを出力するときだけ値の先頭部分を文字列にするラッパー（ペイロード全体はシリアライズしない）"""
+
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value, limit=100):
+        """初期化メソッド"""
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        value, limit = self.value, self.limit
+        if isinstance(value, str):
+            return value if len(value) <= limit else value[:limit] + "..."
+        if isinstance(value, dict):
+            # 先頭から上限の長さまでのキーと値だけを文字列にする
+            parts = []
+            size = 0
+            for key, item in value.items():
+                if size >= limit:
+                    parts.append("...")
+                    break
+                if isinstance(item, (dict, list, tuple)):
+                    text = f"{key}=<{type(item).__name__} {len(item)}件>"
+                else:
+                    text = f"{key}={str(Preview(item, max(limit - size, 10)))}"
+                parts.append(text)
+                size += len(text)
+            return "{" + ", ".join(parts) + "}"
+        if isinstance(value, (list, tuple)):
+            return f"<{type(value).__name__} {len(value)}件>"
+        text = str(value)
+        return text if len(text) <= limit else text[:limit] + "..."
+
+
+class RequestIdFilter(logging.Filter):
+    """ログレコードにリクエストIDを付与するフィルター"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """WARNING未満のログをロガーごとの割合で間引くフィルター"""
+
+    def __init__(self, rates):
+        """初期化メソッド"""
+        super().__init__()
+        self.rates = rates
+        self._cache = {}
+
+    def _rate(self, name):
+        """ロガー名（上位の名前も含めて）に対応する割合"""
+        rate = self._cache.get(name)
+        if rate is None:
+            rate = 1.0
+            current = name
+            while current:
+                if current in self.rates:
+                    rate = self.rates[current]
+                    break
+                current = current.rpartition(".")[0]
+            self._cache[name] = rate
+        return rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """ログを1行のJSONに変換するフォーマッター"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "pid": record.process,
+            "thread": record.threadName,
+            "message": record.getMessage()
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """キューが満杯の場合はログを破棄して呼び出し元を待たせないハンドラー"""
+
+    def __init__(self, log_queue):
+        """初期化メソッド"""
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # メッセージの組み立てのみ行い、整形（日時・JSON化）は出力スレッドで行う
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(log_file=None):
+    """プロセス全体のロギングを設定（2回目以降の呼び出しは何もしない）
+
+    log_fileは出力先ファイルの既定値（LOG_DIRの下に作成）で、環境変数LOG_FILEが優先されます（空文字でファイル出力なし）
+    """
+    global _handler, _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+
+        formatter = JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT)
+        outputs = [logging.StreamHandler(sys.stderr)]
+        path = LOG_FILE
+        if path is None and log_file:
+            path = os.path.join(LOG_DIR, log_file) if LOG_DIR else log_file
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            outputs.append(RotatingFileHandler(
+                path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+            ))
+        for output in outputs:
+            output.setFormatter(formatter)
+
+        _handler = NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+        _handler.addFilter(RequestIdFilter())
+        _handler.addFilter(SamplingFilter(parse_sample_rates(LOG_SAMPLE_RATES)))
+
+        root = logging.getLogger()
+        root.setLevel(LOG_LEVEL.upper())
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(_handler)
+
+        _listener = QueueListener(_handler.queue, *outputs, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """キューに残ったログを書き出して出力スレッドを停止"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def logging_stats():
+    """ログキューの統計を返す"""
+    if _handler is None:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        "queue_depth": _handler.queue.qsize(),
+        "queue_capacity": _handler.queue.maxsize,
+        "dropped": _handler.dropped
+    }
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+レスポンスキャッシュ
+同じ入力テキストに対するDify API / Zonos直接レスポンスの結果を再利用するための
+TTL付きLRUキャッシュです。任意でSQLiteによるディスク層を持ち、再起動後も結果を保持します。
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+import unicodedata
+from datetime import datetime
+from collections import OrderedDict
+
+logger = logging.getLogger("response_cache")
+
+# キャッシュ設定
+DEFAULT_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+DEFAULT_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+DEFAULT_DISK_PATH = os.getenv("RESPONSE_CACHE_PATH") or None
+DEFAULT_DISK_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_DISK_SIZE", "100000"))
+
+# 最初のリクエストに固有で、キャッシュから返すときに引き継がない項目
+PER_REQUEST_FIELDS = ("session_id",)
+
+
+def normalize_text(text):
+    """キャッシュキー用にテキストを正規化（全角/半角の統一、大文字小文字、空白）"""
+    text = unicodedata.normalize("NFKC", text)
+    return " ".join(text.split()).casefold()
+
+
+class DiskCacheStore:
+    """SQLiteを使ったキャッシュのディスク層"""
+
+    def __init__(self, path, max_entries=DEFAULT_DISK_MAX_ENTRIES):
+        """初期化メソッド"""
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires_at)")
+        self._writes = 0
+
+    def get(self, key):
+        """キーに対応する値と有効期限を返す（ない場合はNone）"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at <= time.time():
+            self.delete(key)
+            return None
+        return json.loads(value), expires_at
+
+    def set(self, key, value, expires_at):
+        """値を保存"""
+        data = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, data, expires_at)
+            )
+            self._writes += 1
+            # 書き込みが一定数たまるごとに期限切れと上限超過分を削除
+            if self._writes % 100 == 0:
+                self._prune()
+
+    def delete(self, key):
+        """値を削除"""
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        """すべての値を削除"""
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+
+    def _prune(self):
+        """期限切れのエントリと上限を超えた古いエントリを削除（ロック取得済みで呼ぶ）"""
+        self._conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+        self._conn.execute(
+            "DELETE FROM cache WHERE key IN ("
+            "SELECT key FROM cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def close(self):
+        """接続を閉じる"""
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCache:
+    """スレッドセーフなTTL付きLRUレスポンスキャッシュ
+
+    値はJSON文字列で保持し、取得のたびに新しいオブジェクトへ復元するため、
+    呼び出し側が結果を書き換えても他のリクエストやキャッシュ自体には影響しません。
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, disk_path=DEFAULT_DISK_PATH):
+        """初期化メソッド"""
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self.disk = DiskCacheStore(disk_path) if disk_path else None
+        logger.debug("ResponseCacheを初期化しました（最大件数: %s, TTL: %s秒, ディスク: %s）", max_entries, ttl, disk_path)
+
+    @property
+    def enabled(self):
+        """キャッシュが有効かどうか"""
+        return self.max_entries > 0
+
+    @staticmethod
+    def make_key(text_input, use_dify):
+        """正規化した入力テキストとモードからキャッシュキーを作成"""
+        mode = "dify" if use_dify else "direct"
+        return f"{mode}:{normalize_text(text_input)}"
+
+    def get(self, key):
+        """キャッシュから値を取得（ない場合や期限切れの場合はNone）"""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._as_hit(json.loads(value))
+                del self._entries[key]
+
+        # メモリにない場合はディスク層を確認
+        if self.disk is not None:
+            stored = self.disk.get(key)
+            if stored is not None:
+                value, expires_at = stored
+                with self._lock:
+                    self._store(key, json.dumps(value, ensure_ascii=False), expires_at)
+                    self.hits += 1
+                    self.disk_hits += 1
+                return self._as_hit(value)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value, ttl=None):
+        """値をキャッシュに保存"""
+        if not self.enabled:
+            return
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        value = {k: v for k, v in value.items() if k not in PER_REQUEST_FIELDS}
+        with self._lock:
+            self._store(key, json.dumps(value, ensure_ascii=False), expires_at)
+        if self.disk is not None:
+            self.disk.set(key, value, expires_at)
+
+    @staticmethod
+    def _as_hit(value):
+        """キャッシュから返す値にヒットの印と今回のリクエストの時刻を付与"""
+        value["cached"] = True
+        if "timestamp" in value:
+            value["timestamp"] = datetime.now().isoformat()
+        for field in PER_REQUEST_FIELDS:
+            value[field] = ""
+        return value
+
+    def _store(self, key, value, expires_at):
+        """メモリ層に保存し、上限を超えた分を古い順に削除（ロック取得済みで呼ぶ）"""
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """キャッシュをすべて削除"""
+        with self._lock:
+            self._entries.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self):
+        """ヒット/ミスなどの統計を返す"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "disk_enabled": self.disk is not None
+            }
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+レスポンスの整形とエンコード
+処理結果から必要なフィールドだけを選ぶ（fields=）、上流の生のレスポンス（dify_response）を
+省くコンパクトモード、高速なJSONエンコード（orjsonがあれば使用）、Acceptヘッダーによる
+MessagePackの選択、大きなレスポンスのgzip圧縮を提供します。
+orjsonとmsgpackは任意の依存パッケージで、ない場合は標準のjsonで返します。
+"""
+
+import os
+import json
+import gzip
+import logging
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger("response_format")
+
+# コンパクトモードをデフォルトにするか（リクエストのcompactで上書き可能）
+RESPONSE_COMPACT = os.getenv("RESPONSE_COMPACT", "False").lower() == "true"
+
+# gzip圧縮するレスポンスの最小サイズ（バイト）と圧縮レベル
+RESPONSE_GZIP_MIN_BYTES = int(os.getenv("RESPONSE_GZIP_MIN_BYTES", "1024"))
+RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "5"))
+
+# コンパクトモードで省くフィールド（上流のレスポンスのコピー）
+COMPACT_DROP_FIELDS = ("dify_response",)
+
+# fieldsを指定しても常に返すフィールド（成否の判定に必要）
+ALWAYS_FIELDS = ("status", "message", "error")
+
+JSON_TYPE = "application/json"
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+
+_msgpack = None
+
+
+def parse_flag(value):
+    """クエリやボディの真偽値（"1"・"true"・true など）を解釈"""
+    if isinstance(value, bool):
+        return value
+    if value is None:
+        return None
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
+
+
+def parse_fields(value):
+    """"content,session.turns" 形式の文字列（またはリスト）をパスのタプルに変換（指定なしはNone）"""
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = value.split(",")
+    paths = tuple(tuple(part for part in str(name).strip().split(".") if part) for name in value)
+    return tuple(path for path in paths if path) or None
+
+
+def read_options(args, body=None):
+    """クエリパラメータとボディからfieldsとcompactを読み取る（クエリが優先）"""
+    body = body if hasattr(body, "get") else {}
+    fields = args.get("fields") or body.get("fields")
+    compact = parse_flag(args.get("compact"))
+    if compact is None:
+        compact = parse_flag(body.get("compact"))
+    return parse_fields(fields), RESPONSE_COMPACT if compact is None else compact
+
+
+def _select(data, paths):
+    """辞書から指定したパスの値だけを持つ辞書を作成（存在しないパスは無視）"""
+    selected = {}
+    for path in paths:
+        value = data
+        for key in path:
+            if not isinstance(value, dict) or key not in value:
+                break
+            value = value[key]
+        else:
+            target = selected
+            for key in path[:-1]:
+                target = target.setdefault(key, {})
+            target[path[-1]] = value
+    return selected
+
+
+def shape_result(result, fields=None, compact=False):
+    """処理結果をfieldsとコンパクトモードに合わせて整形（元の辞書は変更しない）"""
+    if not isinstance(result, dict) or (fields is None and not compact):
+        return result
+    if fields is not None:
+        return _select(result, [(name,) for name in ALWAYS_FIELDS] + list(fields))
+    return {key: value for key, value in result.items() if key not in COMPACT_DROP_FIELDS}
+
+
+def dumps_json(data):
+    """JSONのバイト列にエンコード（orjsonがあれば使用）"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # orjsonが扱えない値（64bitを超える整数など）は標準のjsonで処理
+            pass
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _load_msgpack():
+    """msgpackを読み込む（インストールされていない場合はNone）"""
+    global _msgpack
+    if _msgpack is None:
+        try:
+            import msgpack
+        except ImportError:
+            _msgpack = False
+        else:
+            _msgpack = msgpack
+    return _msgpack or None
+
+
+def _parse_header(value):
+    """Accept系ヘッダーを(値, q値)のリストに変換"""
+    items = []
+    for part in (value or "").split(","):
+        token, _, params = part.strip().partition(";")
+        if not token:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, number = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(number)
+                except ValueError:
+                    quality = 0.0
+        items.append((token.strip().lower(), quality))
+    return items
+
+
+def wants_msgpack(accept):
+    """AcceptヘッダーでJSONよりMessagePackが優先されているか（msgpackがない場合は常にFalse）"""
+    msgpack_quality = json_quality = 0.0
+    for media_type, quality in _parse_header(accept):
+        if media_type in MSGPACK_TYPES:
+            msgpack_quality = max(msgpack_quality, quality)
+        elif media_type in (JSON_TYPE, "application/*", "*/*"):
+            json_quality = max(json_quality, quality)
+    return msgpack_quality > 0 and msgpack_quality >= json_quality and _load_msgpack() is not None
+
+
+def accepts_gzip(accept_encoding):
+    """Accept-Encodingでgzipを受け付けるか"""
+    return any(coding in ("gzip", "*") and quality > 0 for coding, quality in _parse_header(accept_encoding))
+
+
+def encode_response(data, accept="", accept_encoding=""):
+    """データをネゴシエーションした形式でエンコードし、(本文, ヘッダーの辞書)を返す"""
+    if wants_msgpack(accept):
+        body = _load_msgpack().packb(data, use_bin_type=True)
+        headers = {"Content-Type": MSGPACK_TYPES[0]}
+    else:
+        body = dumps_json(data)
+        headers = {"Content-Type": JSON_TYPE}
+    headers["Vary"] = "Accept, Accept-Encoding"
+
+    if len(body) >= RESPONSE_GZIP_MIN_BYTES and accepts_gzip(accept_encoding):
+        body = gzip.compress(body, compresslevel=RESPONSE_GZIP_LEVEL)
+        headers["Content-Encoding"] = "gzip"
+    return body, headers
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+会話セッション
+クライアントが指定するセッションキーごとに、Difyのconversation_idとZonosのセッションIDを保持します。
+2回目以降の発話では前回のconversation_idを送るため、クライアントが履歴を再送する必要がありません。
+通常はプロセス内の件数上限付きLRUに保存し、SESSION_STORE_PATHを指定した場合は
+複数のワーカープロセスから共有できるSQLiteに保存します。一定時間使われないセッションは破棄します。
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger("session_store")
+
+# セッション設定
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "10000"))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "1800"))
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH") or None
+
+# セッションキーの最大長
+SESSION_KEY_MAX_LENGTH = 128
+
+
+def new_session(key):
+    """新しいセッションを作成"""
+    now = time.time()
+    return {
+        "key": key,
+        "conversation_id": "",
+        "zonos_session_id": uuid.uuid4().hex,
+        "turns": 0,
+        "created_at": now,
+        "last_used": now
+    }
+
+
+def valid_session_key(key):
+    """セッションキーとして使える文字列か確認"""
+    return isinstance(key, str) and 0 < len(key) <= SESSION_KEY_MAX_LENGTH and key.isprintable()
+
+
+class SqliteSessionBackend:
+    """SQLiteを使った共有セッションストア（複数のワーカープロセスから利用可能）"""
+
+    def __init__(self, path, max_entries, idle_ttl):
+        """初期化メソッド"""
+        self.path = path
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_used ON sessions (last_used)")
+        self._writes = 0
+
+    def get(self, key):
+        """期限内のセッションを返す（ない場合はNone）"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM sessions WHERE key = ? AND last_used > ?",
+                (key, time.time() - self.idle_ttl)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, session):
+        """セッションを保存"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (key, value, last_used) VALUES (?, ?, ?)",
+                (session["key"], json.dumps(session, ensure_ascii=False), session["last_used"])
+            )
+            self._writes += 1
+            # 書き込みが一定数たまるごとに期限切れと上限超過分を削除
+            if self._writes % 100 == 0:
+                self._prune()
+
+    def delete(self, key):
+        """セッションを削除（存在した場合はTrue）"""
+        with self._lock:
+            return self._conn.execute("DELETE FROM sessions WHERE key = ?", (key,)).rowcount > 0
+
+    def count(self):
+        """保存されているセッション数"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def _prune(self):
+        """期限切れのセッションと上限を超えた古いセッションを削除（ロック取得済みで呼ぶ）"""
+        self._conn.execute("DELETE FROM sessions WHERE last_used <= ?", (time.time() - self.idle_ttl,))
+        self._conn.execute(
+            "DELETE FROM sessions WHERE key IN ("
+            "SELECT key FROM sessions ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def close(self):
+        """接続を閉じる"""
+        with self._lock:
+            self._conn.close()
+
+
+class SessionStore:
+    """スレッドセーフな会話セッションストア（件数上限付きLRU + 無操作時間での期限切れ）"""
+
+    def __init__(self, max_entries=SESSION_MAX_ENTRIES, idle_ttl=SESSION_IDLE_TTL, path=SESSION_STORE_PATH):
+        """初期化メソッド"""
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.resumed = 0
+        self.expired = 0
+        self.evictions = 0
+        self.shared = SqliteSessionBackend(path, max_entries, idle_ttl) if path else None
+        logger.debug("SessionStoreを初期化しました（最大件数: %s, 期限: %s秒, 共有: %s）", max_entries, idle_ttl, path)
+
+    def get_or_create(self, key):
+        """セッションを取得し、ない場合や期限切れの場合は新しく作成"""
+        session = self._get(key)
+        with self._lock:
+            if session is None:
+                session = new_session(key)
+                self.created += 1
+            else:
+                self.resumed += 1
+        return session
+
+    def _get(self, key):
+        """期限内のセッションを返す（ない場合はNone）"""
+        if self.shared is not None:
+            return self.shared.get(key)
+
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                return None
+            if now - session["last_used"] > self.idle_ttl:
+                del self._sessions[key]
+                self.expired += 1
+                return None
+            self._sessions.move_to_end(key)
+            return dict(session)
+
+    def record_turn(self, session, conversation_id=None):
+        """1往復の完了を記録し、Difyから返されたconversation_idを保存"""
+        session = dict(session)
+        if conversation_id:
+            session["conversation_id"] = conversation_id
+        session["turns"] += 1
+        session["last_used"] = time.time()
+
+        if self.shared is not None:
+            self.shared.put(session)
+            return session
+
+        with self._lock:
+            self._sessions[session["key"]] = session
+            self._sessions.move_to_end(session["key"])
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+        return session
+
+    def end(self, key):
+        """セッションを終了（存在した場合はTrue）"""
+        if self.shared is not None:
+            return self.shared.delete(key)
+        with self._lock:
+            return self._sessions.pop(key, None) is not None
+
+    def stats(self):
+        """セッション数などの統計を返す"""
+        active = self.shared.count() if self.shared is not None else None
+        with self._lock:
+            return {
+                "active": len(self._sessions) if active is None else active,
+                "max_entries": self.max_entries,
+                "idle_ttl": self.idle_ttl,
+                "created": self.created,
+                "resumed": self.resumed,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "shared": self.shared is not None
+            }
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+同一リクエストの集約（シングルフライト）
+同じキーの処理が実行中の場合は新たに実行せず、実行中の処理の結果（例外を含む）を
+待っている全員に返します。キャッシュに結果が入る前に同じ入力が集中した場合でも、
+上流への呼び出しは1回になります。
+
+asyncio版では処理を共有のタスクとして実行し、待っている呼び出し元の一部がキャンセルされても
+処理は続けます。全員がキャンセルされた場合のみ処理をキャンセルします。
+"""
+
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger("single_flight")
+
+
+class _Call:
+    """実行中の1回分の処理"""
+
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        """初期化メソッド"""
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class _AsyncCall:
+    """実行中の1回分の処理（asyncio版）"""
+
+    __slots__ = ("task", "refs", "waiters")
+
+    def __init__(self, task):
+        """初期化メソッド"""
+        self.task = task
+        self.refs = 0
+        self.waiters = 0
+
+
+class SingleFlight:
+    """同じキーの同時実行を1回にまとめるクラス"""
+
+    def __init__(self, name):
+        """初期化メソッド"""
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+        self.executions = 0
+        self.coalesced = 0
+        self.max_waiters = 0
+        self.cancelled = 0
+
+    def _joined(self, call):
+        """待っている呼び出し元を1件追加（ロック取得済みで呼ぶ）"""
+        call.waiters += 1
+        self.coalesced += 1
+        self.max_waiters = max(self.max_waiters, call.waiters)
+
+    def do(self, key, func):
+        """keyの処理が実行中であればその結果を待ち、なければfunc()を実行して結果を返す"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+            else:
+                self._joined(call)
+
+        if not leader:
+            logger.debug("%s: 実行中の処理の結果を待ちます", self.name)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def do_async(self, key, func):
+        """keyの処理が実行中であればその結果を待ち、なければawait func()を共有のタスクで実行して結果を返す"""
+        with self._lock:
+            call = self._async_calls.get(key)
+            if call is not None:
+                self._joined(call)
+            else:
+                call = self._async_calls[key] = _AsyncCall(asyncio.ensure_future(func()))
+                call.task.add_done_callback(lambda task: self._forget(key, call))
+                self.executions += 1
+            call.refs += 1
+
+        try:
+            # 呼び出し元がキャンセルされても共有のタスクはキャンセルしない
+            result = await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            with self._lock:
+                call.refs -= 1
+                if call.refs == 0 and not call.task.done():
+                    # 待っている呼び出し元がいなくなった処理は止め、次の呼び出しでは新しく実行する
+                    self.cancelled += 1
+                    if self._async_calls.get(key) is call:
+                        del self._async_calls[key]
+                    call.task.cancel()
+                    logger.debug("%s: 待っている呼び出し元がいなくなったため処理をキャンセルしました", self.name)
+            raise
+        with self._lock:
+            call.refs -= 1
+        return result
+
+    def _forget(self, key, call):
+        """完了したタスクを実行中の一覧から外す"""
+        with self._lock:
+            if self._async_calls.get(key) is call:
+                del self._async_calls[key]
+
+    def stats(self):
+        """実行回数と集約した（上流への呼び出しを省略した）回数を返す"""
+        with self._lock:
+            total = self.executions + self.coalesced
+            return {
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "coalesced_ratio": self.coalesced / total if total else 0.0,
+                "max_waiters": self.max_waiters,
+                "in_flight": len(self._calls) + len(self._async_calls),
+                "cancelled": self.cancelled
+            }
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+応答テキストの音声合成
+応答を文ごとに区切ってZonosで合成し、1文ごとに音声を返します。全体の合成を待たずに
+最初の文から再生を始められます。ストリーミングで届く回答は文が完成した時点で合成します。
+定型のあいさつなど短い文の音声はサイズ上限付きのLRUキャッシュ（フレーズキャッシュ）から返し、
+同じ文の合成が同時に来た場合は1回にまとめます。
+
+出力は16bitモノラルのPCMで、WAV（ストリーミング用のヘッダー＋PCM）・PCM・
+JSONフレーム用の文ごとのWAV/PCM（Base64）に変換できます。
+"""
+
+import io
+import os
+import re
+import time
+import wave
+import base64
+import struct
+import logging
+import threading
+from collections import OrderedDict
+
+from response_cache import normalize_text
+from single_flight import SingleFlight
+from stage_metrics import timed
+
+logger = logging.getLogger("speech_synth")
+
+# フレーズキャッシュのサイズ（MB、0で無効）と、キャッシュする文の最大文字数
+SPEECH_CACHE_MB = float(os.getenv("SPEECH_CACHE_MB", "32"))
+SPEECH_CACHE_MAX_CHARS = int(os.getenv("SPEECH_CACHE_MAX_CHARS", "80"))
+
+# 句読点がないまま長くなった文を区切る文字数
+SPEECH_MAX_SENTENCE_CHARS = int(os.getenv("SPEECH_MAX_SENTENCE_CHARS", "120"))
+
+# 起動時にインテントの定型応答を合成してキャッシュに入れるか
+SPEECH_PRELOAD = os.getenv("SPEECH_PRELOAD", "True").lower() == "true"
+
+# 文末（連続する文末記号と閉じ括弧までを1文に含める）
+SENTENCE_PATTERN = re.compile(r".*?[。．！？!?\n]+[」』）)\"']*", re.S)
+
+# 長い文を区切る位置の候補
+CLAUSE_BREAKS = "、，, "
+
+# /api/speakの出力形式と、JSONフレームに載せる音声の形式
+STREAM_FORMATS = ("wav", "pcm", "sse", "ndjson")
+FRAME_AUDIO_FORMATS = ("wav", "pcm")
+
+
+class SpeechSynthesisError(RuntimeError):
+    """Zonosでの音声合成に失敗した場合の例外"""
+
+
+class SentenceSplitter:
+    """少しずつ届くテキストを文ごとに区切るクラス"""
+
+    def __init__(self, max_chars=SPEECH_MAX_SENTENCE_CHARS):
+        """初期化メソッド"""
+        self.max_chars = max_chars
+        self._buffer = ""
+
+    def feed(self, text):
+        """テキストを追加し、完成した文のリストを返す（末尾の文末記号は続きが届くまで保留）"""
+        self._buffer += text
+        sentences = []
+        position = 0
+        for match in SENTENCE_PATTERN.finditer(self._buffer):
+            if match.end() >= len(self._buffer):
+                # 「！？」のように文末記号が続く可能性がある
+                break
+            sentences.append(match.group())
+            position = match.end()
+        self._buffer = self._buffer[position:]
+
+        # 句読点がないまま長くなった場合は読点などで区切る
+        while len(self._buffer) > self.max_chars:
+            cut = max(self._buffer.rfind(char, 0, self.max_chars) for char in CLAUSE_BREAKS) + 1
+            cut = cut or self.max_chars
+            sentences.append(self._buffer[:cut])
+            self._buffer = self._buffer[cut:]
+        return [sentence.strip() for sentence in sentences if sentence.strip()]
+
+    def flush(self):
+        """残りのテキストを最後の文として返す"""
+        sentences = self.feed("")
+        rest, self._buffer = self._buffer.strip(), ""
+        return sentences + ([rest] if rest else [])
+
+
+def split_sentences(text):
+    """テキスト全体を文のリストに区切る"""
+    splitter = SentenceSplitter()
+    return splitter.feed(text or "") + splitter.flush()
+
+
+def to_wav(pcm, sample_rate):
+    """16bitモノラルのPCMをWAVファイルのバイト列にする"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def streaming_wav_header(sample_rate):
+    """長さを決めずに送るWAVのヘッダー（サイズ欄は最大値）"""
+    return b"".join((
+        b"RIFF", struct.pack("<I", 0xFFFFFFFF), b"WAVE",
+        b"fmt ", struct.pack("<IHHIIHH", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16),
+        b"data", struct.pack("<I", 0xFFFFFFFF - 36)
+    ))
+
+
+def audio_frame(chunk, audio_format="wav"):
+    """合成した1文をSSE/NDJSON用のフレームにする（音声はBase64）"""
+    audio = to_wav(chunk["audio"], chunk["sample_rate"]) if audio_format == "wav" else chunk["audio"]
+    return {
+        "event": "audio",
+        "index": chunk["index"],
+        "text": chunk["text"],
+        "format": audio_format,
+        "sample_rate": chunk["sample_rate"],
+        "duration": chunk["duration"],
+        "cached": chunk["cached"],
+        "audio": base64.b64encode(audio).decode("ascii")
+    }
+
+
+def encode_audio_stream(first, chunks, stream_format="wav"):
+    """合成した文の列を音声のバイト列のストリームにする（WAVは先頭にヘッダーを付ける）"""
+    if stream_format == "wav":
+        yield streaming_wav_header(first["sample_rate"])
+    yield first["audio"]
+    for chunk in chunks:
+        yield chunk["audio"]
+
+
+class PhraseCache:
+    """合成した音声のLRUキャッシュ（合計バイト数で上限を管理）"""
+
+    def __init__(self, max_mb=SPEECH_CACHE_MB, max_chars=SPEECH_CACHE_MAX_CHARS):
+        """初期化メソッド"""
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.max_chars = max_chars
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(text, voice=None):
+        """文と声からキャッシュキーを作成"""
+        return f"{voice or ''}\x00{normalize_text(text)}"
+
+    def cacheable(self, text):
+        """キャッシュの対象の文か（長い文は再利用されにくいため対象外）"""
+        return self.max_bytes > 0 and len(text) <= self.max_chars
+
+    def get(self, key):
+        """キャッシュから(PCM, サンプリングレート)を取得（ない場合はNone）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def contains(self, key):
+        """キーが保存されているか（ヒット/ミスには数えない）"""
+        with self._lock:
+            return key in self._entries
+
+    def set(self, key, pcm, sample_rate):
+        """音声を保存し、上限を超えた分を古い順に削除"""
+        if len(pcm) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous[0])
+            self._entries[key] = (pcm, sample_rate)
+            self._size += len(pcm)
+            while self._size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def stats(self):
+        """ヒット/ミスなどの統計を返す"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+
+class SpeechSynthesizer:
+    """Zonosクライアントで文ごとに音声を合成するクラス"""
+
+    def __init__(self, zonos_client, cache=None):
+        """初期化メソッド"""
+        self.zonos_client = zonos_client
+        self.cache = cache if cache is not None else PhraseCache()
+        self._flight = SingleFlight("speech")
+        self._lock = threading.Lock()
+        self.sentences = 0
+        self.synthesized = 0
+        self.audio_seconds = 0.0
+        self.synth_seconds = 0.0
+
+    def _synthesize(self, text, voice):
+        """Zonosで1文を合成して(PCM, サンプリングレート)を返す"""
+        synthesize = getattr(self.zonos_client, "synthesize", None)
+        if synthesize is None:
+            raise SpeechSynthesisError("Zonosクライアントが音声合成に対応していません")
+        start = time.perf_counter()
+        with timed("synthesize") as span:
+            result = synthesize(text, voice=voice)
+            span.error = result.get("status") != "success"
+        if span.error:
+            raise SpeechSynthesisError(result.get("message", "音声合成に失敗しました"))
+        pcm, sample_rate = result["audio"], result["sample_rate"]
+        with self._lock:
+            self.synthesized += 1
+            self.synth_seconds += time.perf_counter() - start
+            self.audio_seconds += len(pcm) / 2 / sample_rate
+        return pcm, sample_rate
+
+    def synthesize(self, text, voice=None):
+        """1文を合成して(PCM, サンプリングレート, キャッシュから返したか)を返す"""
+        with self._lock:
+            self.sentences += 1
+        if not self.cache.cacheable(text):
+            return self._synthesize(text, voice) + (False,)
+
+        key = PhraseCache.make_key(text, voice)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached + (True,)
+
+        def synthesize_and_cache():
+            pcm, sample_rate = self._synthesize(text, voice)
+            self.cache.set(key, pcm, sample_rate)
+            return pcm, sample_rate
+
+        return self._flight.do(key, synthesize_and_cache) + (False,)
+
+    def stream(self, sentences, voice=None, start_index=0):
+        """文ごとに合成した音声を順に返すジェネレータ"""
+        for index, text in enumerate(sentences, start_index):
+            pcm, sample_rate, cached = self.synthesize(text, voice)
+            yield {
+                "index": index,
+                "text": text,
+                "audio": pcm,
+                "sample_rate": sample_rate,
+                "duration": round(len(pcm) / 2 / sample_rate, 3),
+                "cached": cached
+            }
+
+    def preload(self, texts, voice=None):
+        """よく使う応答を合成してフレーズキャッシュに入れる（合成した文の数を返す）"""
+        start = time.perf_counter()
+        count = 0
+        for text in texts:
+            for sentence in split_sentences(text):
+                if not self.cache.cacheable(sentence):
+                    continue
+                key = PhraseCache.make_key(sentence, voice)
+                if self.cache.contains(key):
+                    continue
+                pcm, sample_rate = self._synthesize(sentence, voice)
+                self.cache.set(key, pcm, sample_rate)
+                count += 1
+        logger.info("定型の応答の音声を合成しました（%s文, %.2f秒）", count, time.perf_counter() - start)
+        return count
+
+    def stats(self):
+        """合成した文の数とフレーズキャッシュの統計を返す"""
+        with self._lock:
+            return {
+                "sentences": self.sentences,
+                "synthesized": self.synthesized,
+                "audio_seconds": round(self.audio_seconds, 3),
+                "real_time_factor": self.synth_seconds / self.audio_seconds if self.audio_seconds else 0.0,
+                "cache": self.cache.stats()
+            }
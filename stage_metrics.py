@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+処理段階ごとのレイテンシ計測
+音声の受信・デコード・音声認識・Dify API・Zonosなどの各段階の所要時間をヒストグラムに集計し、
+エラー数とあわせてPrometheusのテキスト形式で出力します。
+DEBUG_TIMINGを有効にすると、リクエストごとの各段階の時間をServer-Timingヘッダーで返します。
+集計はプロセスごとのため、複数ワーカーの場合はワーカーごとの値になります。
+"""
+
+import os
+import time
+import bisect
+import threading
+import contextvars
+from collections import deque
+
+# ヒストグラムのバケット（秒）
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# パーセンタイル計算用に保持するサンプル数（段階ごと）
+STAGE_MAX_SAMPLES = int(os.getenv("STAGE_MAX_SAMPLES", "1000"))
+
+# リクエストごとの各段階の時間をレスポンスヘッダーで返すか
+DEBUG_TIMING = os.getenv("DEBUG_TIMING", "False").lower() == "true"
+
+# 処理中のリクエストで計測した段階（リクエストごと、計測していない場合はNone）
+_request_spans = contextvars.ContextVar("request_spans", default=None)
+
+
+class StageHistogram:
+    """1つの段階の所要時間のヒストグラムとエラー数"""
+
+    def __init__(self, buckets=STAGE_BUCKETS, max_samples=STAGE_MAX_SAMPLES):
+        """初期化メソッド"""
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+        self.samples = deque(maxlen=max_samples)
+
+    def observe(self, seconds, error=False):
+        """1回分の所要時間を記録（ロック取得済みで呼ぶ）"""
+        self.bucket_counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if error:
+            self.errors += 1
+        self.samples.append(seconds)
+
+    def snapshot(self):
+        """件数・エラー数・平均とパーセンタイルを返す（ロック取得済みで呼ぶ）"""
+        summary = {"count": self.count, "errors": self.errors}
+        if self.samples:
+            ordered = sorted(self.samples)
+            last = len(ordered) - 1
+            summary.update({
+                "avg": self.sum / self.count,
+                "p50": ordered[int(0.50 * last)],
+                "p95": ordered[int(0.95 * last)],
+                "p99": ordered[int(0.99 * last)]
+            })
+        return summary
+
+
+class StageMetrics:
+    """段階ごとのヒストグラムをまとめて管理するクラス"""
+
+    def __init__(self):
+        """初期化メソッド"""
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, error=False):
+        """段階の所要時間を記録"""
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = StageHistogram()
+            histogram.observe(seconds, error)
+
+    def snapshot(self):
+        """段階ごとの統計を辞書で返す"""
+        with self._lock:
+            return {stage: histogram.snapshot() for stage, histogram in sorted(self._stages.items())}
+
+    def render_prometheus(self, prefix="asurada"):
+        """Prometheusのテキスト形式で出力"""
+        lines = [
+            f"# HELP {prefix}_stage_duration_seconds 処理段階ごとの所要時間",
+            f"# TYPE {prefix}_stage_duration_seconds histogram"
+        ]
+        errors = [
+            f"# HELP {prefix}_stage_errors_total 処理段階ごとのエラー数",
+            f"# TYPE {prefix}_stage_errors_total counter"
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self._stages.items()):
+                label = f'stage="{stage}"'
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.bucket_counts):
+                    cumulative += count
+                    lines.append(f'{prefix}_stage_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_duration_seconds_bucket{{{label},le="+Inf"}} {histogram.count}')
+                lines.append(f"{prefix}_stage_duration_seconds_sum{{{label}}} {histogram.sum}")
+                lines.append(f"{prefix}_stage_duration_seconds_count{{{label}}} {histogram.count}")
+                errors.append(f"{prefix}_stage_errors_total{{{label}}} {histogram.errors}")
+        return "\n".join(lines + errors) + "\n"
+
+
+# プロセス全体で共有する集計
+stage_metrics = StageMetrics()
+
+
+class Span:
+    """with文で囲んだ処理の所要時間を段階として記録する（例外またはerror=Trueでエラーとして数える）"""
+
+    __slots__ = ("stage", "error", "start")
+
+    def __init__(self, stage):
+        """初期化メソッド"""
+        self.stage = stage
+        self.error = False
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record_stage(self.stage, time.perf_counter() - self.start, self.error or exc_type is not None)
+        return False
+
+
+def timed(stage):
+    """処理段階の計測を開始するコンテキストマネージャーを返す"""
+    return Span(stage)
+
+
+def record_stage(stage, seconds, error=False):
+    """段階の所要時間を集計に記録し、リクエストごとの計測にも追加"""
+    stage_metrics.observe(stage, seconds, error)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+
+def begin_request_spans():
+    """現在のリクエストの段階の記録を開始"""
+    _request_spans.set([])
+
+
+def format_server_timing(extra=()):
+    """現在のリクエストで記録した段階をServer-Timingヘッダーの値にする"""
+    spans = list(_request_spans.get() or ()) + list(extra)
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in spans)
@@ -9,6 +9,7 @@ APIサーバーのエンドポイントをテストするためのスクリプ
 import os
 import sys
 import json
+import time
 import requests
 import argparse
 from pathlib import Path
@@ -47,6 +48,40 @@ def test_process_text(api_url, text):
         print(response.text)
         return False
 
+def test_process_text_stream(api_url, text):
+    """ストリーミングテキスト処理エンドポイントのテスト"""
+    print(f"ストリーミングテキスト処理をテスト中: '{text}'")
+    
+    payload = {"text": text}
+    response = requests.post(
+        f"{api_url}/api/process-text/stream",
+        params={"format": "ndjson"},
+        json=payload,
+        stream=True
+    )
+    
+    if response.status_code != 200:
+        print(f"エラー: ステータスコード {response.status_code}")
+        print(response.text)
+        return False
+    
+    success = False
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            continue
+        frame = json.loads(line)
+        if frame.get("event") == "message":
+            print(frame.get("delta", ""), end="", flush=True)
+        elif frame.get("event") == "done":
+            print()
+            print("成功！処理結果:")
+            print(json.dumps(frame.get("result"), ensure_ascii=False, indent=2))
+            success = True
+        else:
+            print()
+            print(f"エラー: {frame.get('message')}")
+    return success
+
 def test_direct_response(api_url, text):
     """直接レスポンス生成エンドポイントのテスト"""
     print(f"直接レスポンス生成をテスト中: '{text}'")
@@ -63,6 +98,131 @@ def test_direct_response(api_url, text):
         print(response.text)
         return False
 
+def test_process_audio_job(api_url, audio_file_path):
+    """音声処理ジョブエンドポイントのテスト（投入してロングポーリングで結果を取得）"""
+    if not Path(audio_file_path).exists():
+        print(f"エラー: 音声ファイル '{audio_file_path}' が見つかりません。")
+        return False
+    
+    print(f"音声処理ジョブをテスト中: '{audio_file_path}'")
+    
+    with open(audio_file_path, 'rb') as audio_file:
+        files = {'audio': (Path(audio_file_path).name, audio_file, 'audio/mpeg')}
+        response = requests.post(f"{api_url}/api/jobs/process-audio", files=files)
+    
+    if response.status_code != 202:
+        print(f"エラー: ステータスコード {response.status_code}")
+        print(response.text)
+        return False
+    
+    job_id = response.json()["job_id"]
+    print(f"ジョブを投入しました: {job_id}")
+    
+    while True:
+        response = requests.get(f"{api_url}/api/jobs/{job_id}", params={"wait": 30})
+        if response.status_code != 200:
+            print(f"エラー: ステータスコード {response.status_code}")
+            print(response.text)
+            return False
+        job = response.json()
+        if job["status"] in ("done", "failed"):
+            break
+    
+    print("成功！処理結果:")
+    print(json.dumps(job, ensure_ascii=False, indent=2))
+    return job["status"] == "done"
+
+def test_batch(api_url, texts):
+    """バッチ処理エンドポイントのテスト"""
+    print(f"バッチ処理をテスト中: {len(texts)}件")
+    
+    payload = [{"id": i, "text": text} for i, text in enumerate(texts)]
+    response = requests.post(f"{api_url}/api/batch", json=payload, stream=True)
+    
+    if response.status_code != 200:
+        print(f"エラー: ステータスコード {response.status_code}")
+        print(response.text)
+        return False
+    
+    print("成功！処理結果（完了順）:")
+    for line in response.iter_lines(decode_unicode=True):
+        if line:
+            print(json.dumps(json.loads(line), ensure_ascii=False))
+    return True
+
+def test_session(api_url, texts):
+    """会話セッションのテスト（同じセッションキーで続けて送信し、最後にセッションを終了）"""
+    session_key = f"test-{int(time.time())}"
+    print(f"会話セッションをテスト中: {session_key}（{len(texts)}往復）")
+    
+    for text in texts:
+        payload = {"text": text, "session_key": session_key}
+        response = requests.post(f"{api_url}/api/process-text", json=payload)
+        if response.status_code != 200:
+            print(f"エラー: ステータスコード {response.status_code}")
+            print(response.text)
+            return False
+        result = response.json()
+        print(f"> {text}")
+        print(f"< {result.get('content', '')}（セッション: {result.get('session')}）")
+    
+    response = requests.delete(f"{api_url}/api/sessions/{session_key}")
+    print(f"セッションを終了しました: ステータスコード {response.status_code}")
+    return response.status_code == 200
+
+def test_response_formats(api_url, text):
+    """レスポンスの整形（compact・fields）とエンコード（gzip・MessagePack）のテスト"""
+    print(f"レスポンスの形式をテスト中: '{text}'")
+    
+    variants = [
+        ("通常", {}, {}),
+        ("compact", {"compact": "1"}, {}),
+        ("fields=content", {"fields": "content"}, {}),
+        ("gzip", {}, {"Accept-Encoding": "gzip"}),
+        ("msgpack", {"compact": "1"}, {"Accept": "application/msgpack"})
+    ]
+    for name, params, headers in variants:
+        response = requests.post(
+            f"{api_url}/api/process-text",
+            params=params,
+            headers=dict({"Accept-Encoding": "identity"}, **headers),
+            json={"text": text},
+            stream=True
+        )
+        # 転送時のサイズ（圧縮後）を表示
+        size = len(response.raw.read())
+        print(f"{name:<16} ステータス {response.status_code}  {size:>7}バイト  "
+              f"{response.headers.get('Content-Type')}  {response.headers.get('Content-Encoding', '')}")
+        if response.status_code != 200:
+            return False
+    return True
+
+def test_speak(api_url, text, output="speak_output.wav"):
+    """音声合成エンドポイントのテスト（最初の音声が届くまでの時間を表示し、WAVを保存）"""
+    print(f"音声合成をテスト中: '{text}'")
+    
+    start = time.perf_counter()
+    response = requests.post(f"{api_url}/api/speak", json={"text": text, "format": "wav"}, stream=True)
+    if response.status_code != 200:
+        print(f"エラー: ステータスコード {response.status_code}")
+        print(response.text)
+        return False
+    
+    first_audio = None
+    size = 0
+    with open(output, "wb") as f:
+        for chunk in response.iter_content(chunk_size=None):
+            # 先頭の44バイトはWAVのヘッダー
+            if first_audio is None and size + len(chunk) > 44:
+                first_audio = time.perf_counter() - start
+            size += len(chunk)
+            f.write(chunk)
+    
+    print(f"{response.headers.get('X-Sentence-Count')}文, {response.headers.get('X-Audio-Sample-Rate')}Hz, "
+          f"{size}バイト, 最初の音声まで {first_audio or 0:.3f}秒, 合計 {time.perf_counter() - start:.3f}秒")
+    print(f"音声を保存しました: {output}")
+    return True
+
 def test_process_audio(api_url, audio_file_path):
     """音声処理エンドポイントのテスト"""
     if not Path(audio_file_path).exists():
@@ -84,14 +244,289 @@ def test_process_audio(api_url, audio_file_path):
         print(response.text)
         return False
 
+def test_breaker_release():
+    """サーキットブレーカーの試しの呼び出しが切断・キャンセルで終わっても半開のまま固まらないかを確認（サーバー不要）"""
+    import asyncio
+    from upstream_guard import UpstreamGuard, CircuitOpenError, HALF_OPEN
+    
+    def open_guard():
+        guard = UpstreamGuard("check", failure_threshold=1, reset_timeout=0.05)
+        try:
+            guard.call(lambda deadline: 1 / 0)
+        except ZeroDivisionError:
+            pass
+        time.sleep(0.06)
+        return guard
+    
+    def still_probes(guard):
+        try:
+            return guard.call(lambda deadline: "ok") == "ok"
+        except CircuitOpenError:
+            return False
+    
+    # 統合システムのストリーミングの途中でクライアントが切断した場合（Dify APIはスタブ）
+    use_local_services()
+    from asulada_zonos_integration import AsuradaZonosIntegration
+    
+    class StubDifyClient:
+        def stream_chat(self, query, deadline=None, **kwargs):
+            yield {"event": "message", "answer": "途中まで"}
+            yield {"event": "message", "answer": "の回答"}
+    
+    integration = AsuradaZonosIntegration()
+    integration.dify_client = StubDifyClient()
+    integration.dify_guard = guard = open_guard()
+    frames = integration.stream_with_zonos("こんにちは")
+    next(frames)
+    frames.close()
+    closed_ok = guard.breaker.state == HALF_OPEN and still_probes(guard)
+    
+    # 試しの呼び出しのタスクがキャンセルされた場合
+    guard = open_guard()
+    async def cancel_probe():
+        async def slow(deadline):
+            await asyncio.sleep(1)
+        task = asyncio.ensure_future(guard.call_async(slow))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    asyncio.run(cancel_probe())
+    cancelled_ok = still_probes(guard)
+    
+    print(f"切断後の試し: {'OK' if closed_ok else 'NG'}, キャンセル後の試し: {'OK' if cancelled_ok else 'NG'}")
+    return closed_ok and cancelled_ok
+
+def test_merge_overlap():
+    """分割認識の連結でオーバーラップだけが取り除かれ、重複のない境界の文字が残るかを確認（サーバー不要）"""
+    from audio_segmenter import merge_overlap
+    
+    cases = [
+        # 重複のない境界（末尾と先頭の1文字が一致しても残す）
+        (("hello world", "dog barks"), "hello world dog barks"),
+        (("今日は晴れです", "すごく良い天気"), "今日は晴れですすごく良い天気"),
+        (("I saw the cat", "cathedral"), "I saw the cat cathedral"),
+        # オーバーラップ部分の重複
+        (("hello world", "world peace"), "hello world peace"),
+        (("今日は晴れですね", "晴れですね。明日は"), "今日は晴れですね。明日は"),
+    ]
+    ok = True
+    for (left, right), expected in cases:
+        merged = merge_overlap(left, right)
+        if merged != expected:
+            print(f"NG: {left!r} + {right!r} → {merged!r}（期待値: {expected!r}）")
+            ok = False
+    print(f"オーバーラップの連結: {'OK' if ok else 'NG'}")
+    return ok
+
+def test_response_cache():
+    """キャッシュのヒットが独立したコピーで、ヒットの印と今回の時刻を持つかを確認（サーバー不要）"""
+    from response_cache import ResponseCache
+    
+    cache = ResponseCache(max_entries=8, ttl=60, disk_path=None)
+    cache.set("key", {
+        "status": "success",
+        "session_id": "first-request",
+        "timestamp": "2000-01-01T00:00:00",
+        "zonos_metadata": {"emotion": "neutral"}
+    })
+    first = cache.get("key")
+    first["zonos_metadata"]["emotion"] = "changed"
+    second = cache.get("key")
+    
+    isolated_ok = second["zonos_metadata"]["emotion"] == "neutral"
+    fresh_ok = second["cached"] is True and second["session_id"] == "" and second["timestamp"] != "2000-01-01T00:00:00"
+    print(f"キャッシュのコピー: {'OK' if isolated_ok else 'NG'}, ヒットの印と時刻: {'OK' if fresh_ok else 'NG'}")
+    return isolated_ok and fresh_ok
+
+def test_transcript_cache():
+    """壊れたディスクキャッシュのファイルが削除され、ミスとして扱われるかを確認（サーバー不要）"""
+    import tempfile
+    from transcript_cache import TranscriptCache
+    
+    with tempfile.TemporaryDirectory() as directory:
+        cache = TranscriptCache(directory=directory)
+        cache.disk.set("broken", {"text": "こんにちは"})
+        path = cache.disk._path("broken")
+        path.write_bytes(path.read_bytes()[:5])
+        ok = cache.get("broken") is None and not path.exists()
+    print(f"壊れた文字起こしキャッシュの扱い: {'OK' if ok else 'NG'}")
+    return ok
+
+def test_intent_reload():
+    """構造の壊れたルールファイルへの更新で、読み込み済みのルールが使われ続けるかを確認（サーバー不要）"""
+    import json
+    import tempfile
+    from intent_matcher import IntentMatcher
+    
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "intents.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"intents": [{"name": "greeting", "patterns": ["こんにちは"], "response": "こんにちは！"}]}, f)
+        matcher = IntentMatcher(path, reload_interval=0)
+        
+        broken = [
+            ["こんにちは"],
+            {"intents": [{"name": "greeting", "patterns": ["こんにちは"], "response": "やあ", "priority": "high"}]},
+            {"intents": "greeting"}
+        ]
+        ok = True
+        for rules in broken:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(rules, f)
+            reloaded = matcher.reload()
+            intent = matcher.match("こんにちは")
+            if reloaded or intent is None or intent.response != "こんにちは！":
+                print(f"NG: {rules!r}")
+                ok = False
+    print(f"壊れたインテントのルールの再読み込み: {'OK' if ok else 'NG'}")
+    return ok
+
+# サーバーを使わない確認で使うDify APIスタンドイン（最初に必要になった時点で起動）
+_local_dify = None
+
+def use_local_services():
+    """Dify APIスタンドインとフェイクの音声認識を使う環境を用意（統合システムを読み込む前に呼ぶ）"""
+    global _local_dify
+    if _local_dify is None:
+        from fake_dify_server import FakeDifyServer, FakeDifyConfig
+        _local_dify = FakeDifyServer(("127.0.0.1", 0), FakeDifyConfig(first_token_latency=0.01, token_latency=0.005)).start()
+        os.environ.update(
+            DIFY_API_KEY="self-check",
+            DIFY_API_ENDPOINT=_local_dify.url,
+            ASR_BACKEND="fake",
+            LOG_FILE=""
+        )
+    return _local_dify
+
+def test_voice_session_ws():
+    """/ws/voiceにPCMを送り、ready → speech_start → utterance → done の順に届くかを確認（サーバー不要）"""
+    import math
+    import struct
+    use_local_services()
+    from starlette.testclient import TestClient
+    import asgi_server
+    
+    rate = 16000
+    chunk = rate * 20 // 1000
+    tone = b"".join(struct.pack("<h", int(8000 * math.sin(2 * math.pi * 300 * i / rate))) for i in range(int(rate * 0.6)))
+    silence = b"\x00\x00" * int(rate * 1.0)
+    
+    seen = []
+    with TestClient(asgi_server.app) as client:
+        with client.websocket_connect(f"/ws/voice?sample_rate={rate}") as ws:
+            seen.append(ws.receive_json()["type"])
+            for pcm in (tone, silence):
+                for i in range(0, len(pcm), chunk * 2):
+                    ws.send_bytes(pcm[i:i + chunk * 2])
+            for _ in range(200):
+                message = ws.receive_json()
+                seen.append(message["type"])
+                if message["type"] in ("done", "error"):
+                    break
+    
+    expected = ["ready", "speech_start", "utterance", "done"]
+    order = [kind for kind in seen if kind in expected]
+    ok = order == expected
+    print(f"音声セッション（WebSocket）: {'OK' if ok else 'NG'} {' → '.join(seen if not ok else order)}")
+    return ok
+
+def test_asgi_server_timing():
+    """ASGIサーバーでスレッドプールの処理の段階（recognize・zonos）がServer-Timingに含まれ、終了時に統合システムが停止するかを確認（サーバー不要）"""
+    import io
+    import math
+    import wave
+    import struct
+    use_local_services()
+    from starlette.testclient import TestClient
+    import asgi_server
+    
+    rate = 16000
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(b"".join(struct.pack("<h", int(8000 * math.sin(2 * math.pi * 300 * i / rate))) for i in range(rate)))
+    
+    debug_timing = asgi_server.DEBUG_TIMING
+    asgi_server.DEBUG_TIMING = True
+    try:
+        with TestClient(asgi_server.app) as client:
+            response = client.post("/api/process-audio", files={"audio": ("check.wav", buffer.getvalue(), "audio/wav")})
+    finally:
+        asgi_server.DEBUG_TIMING = debug_timing
+    
+    timing = response.headers.get("Server-Timing", "")
+    stages = {part.split(";")[0].strip() for part in timing.split(",") if part.strip()}
+    missing = {"recognize", "zonos", "http.process_audio"} - stages
+    ok = response.status_code == 200 and not missing
+    print(f"ASGIのServer-Timing: {'OK' if ok else 'NG'} {timing}")
+    
+    # 終了時に分析バッチのスレッドまで停止したか
+    closed_ok = not asgi_server.integration.analysis_batcher._thread.is_alive()
+    print(f"ASGIサーバーの終了処理: {'OK' if closed_ok else 'NG'}")
+    return ok and closed_ok
+
+def test_zonos_engine():
+    """Zonosの実行エンジンが同時の呼び出しをまとめ、期限を過ぎたワーカーを入れ替えるかを確認（サーバー不要）"""
+    from concurrent.futures import ThreadPoolExecutor
+    from zonos_engine import ZonosEngine
+    
+    # 1ワーカーに同時に8件送ると、1件目の処理中に届いた呼び出しがまとめられる
+    engine = ZonosEngine(workers=1, max_batch=8, max_wait=0.05, timeout=10, config={"latency": 0.2})
+    try:
+        engine.wait_ready()
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(engine.analyze_audio, [f"テスト{i}" for i in range(8)]))
+        stats = engine.stats()
+    finally:
+        engine.close()
+    batched_ok = all(result.get("status") == "success" for result in results) and stats["batches"] < 8
+    print(f"Zonosのバッチ処理: {'OK' if batched_ok else 'NG'}（8件を{stats['batches']}バッチ、最大{stats['max_batch_size']}件）")
+    
+    # CPUを使い続けるワーカーは期限を過ぎると強制終了され、新しいワーカーに入れ替わる
+    engine = ZonosEngine(workers=1, timeout=0.5, config={"latency": 5, "cpu_bound": True})
+    try:
+        engine.wait_ready()
+        result = engine.generate_response("テスト")
+        deadline = time.monotonic() + 10
+        while engine.stats()["restarts"] < 1 and time.monotonic() < deadline:
+            time.sleep(0.1)
+        replaced = engine.wait_ready(30)
+        stats = engine.stats()
+    finally:
+        engine.close()
+    replaced_ok = (
+        result.get("status") == "error" and stats["restarts"] >= 1
+        and replaced and stats["workers"] == 1 and stats["busy"] == 0
+    )
+    print(f"応答のないZonosワーカーの入れ替え: {'OK' if replaced_ok else 'NG'}（{stats}）")
+    return batched_ok and replaced_ok
+
+def run_self_checks():
+    """サーバーを使わない確認をすべて実行"""
+    results = [test_breaker_release(), test_merge_overlap(), test_response_cache(), test_transcript_cache(), test_intent_reload(), test_voice_session_ws(), test_asgi_server_timing(), test_zonos_engine()]
+    print("すべての確認に成功しました" if all(results) else "失敗した確認があります")
+    return all(results)
+
 def main():
     """メイン関数"""
     parser = argparse.ArgumentParser(description="Asurada GPT + Zonos 統合システム APIテスト")
     parser.add_argument("--url", default=DEFAULT_API_URL, help="APIサーバーのURL")
     parser.add_argument("--info", action="store_true", help="APIの基本情報を取得")
     parser.add_argument("--text", help="テキスト処理をテスト")
+    parser.add_argument("--stream", help="ストリーミングテキスト処理をテスト")
     parser.add_argument("--direct", help="直接レスポンス生成をテスト")
     parser.add_argument("--audio", help="音声処理をテスト（音声ファイルのパス）")
+    parser.add_argument("--audio-job", help="音声処理ジョブをテスト（音声ファイルのパス）")
+    parser.add_argument("--batch", nargs="+", help="バッチ処理をテスト（複数のテキスト）")
+    parser.add_argument("--session", nargs="+", help="会話セッションをテスト（続けて送信する複数のテキスト）")
+    parser.add_argument("--formats", help="レスポンスの整形とエンコードをテスト")
+    parser.add_argument("--speak", help="音声合成をテスト（合成するテキスト、結果はspeak_output.wavに保存）")
+    parser.add_argument("--self-check", action="store_true", help="サーバーを使わない内部処理の確認を実行")
     args = parser.parse_args()
     
     # 引数がない場合はヘルプを表示
@@ -107,6 +542,10 @@ def main():
     if args.text:
         test_process_text(args.url, args.text)
     
+    # ストリーミングテキスト処理をテスト
+    if args.stream:
+        test_process_text_stream(args.url, args.stream)
+    
     # 直接レスポンス生成をテスト
     if args.direct:
         test_direct_response(args.url, args.direct)
@@ -114,6 +553,31 @@ def main():
     # 音声処理をテスト
     if args.audio:
         test_process_audio(args.url, args.audio)
+    
+    # 音声処理ジョブをテスト
+    if args.audio_job:
+        test_process_audio_job(args.url, args.audio_job)
+    
+    # バッチ処理をテスト
+    if args.batch:
+        test_batch(args.url, args.batch)
+    
+    # レスポンスの形式をテスト
+    if args.formats:
+        test_response_formats(args.url, args.formats)
+    
+    # 音声合成をテスト
+    if args.speak:
+        test_speak(args.url, args.speak)
+    
+    # 会話セッションをテスト
+    if args.session:
+        test_session(args.url, args.session)
+    
+    # 内部処理の確認
+    if args.self_check:
+        if not run_self_checks():
+            sys.exit(1)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
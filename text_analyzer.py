@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+テキスト分析
+複数のテキストをまとめてNumPyの配列演算で分析します。
+感情はJSONの辞書（語と重み）との一致数から、文字数・単語数・文字種の内訳は
+テキストを連結したコードポイント配列から一括で求めます。
+辞書の語はAho-Corasickオートマトンにまとめ、各テキストを1回走査して出現回数を数えます。
+単語は日本語向けに文字種（ひらがな・カタカナ・漢字・英数字）の切れ目で区切ります。
+NumPyは最初の分析時に読み込みます。
+"""
+
+import os
+import json
+import logging
+import unicodedata
+
+from intent_matcher import KeywordAutomaton, fold_text
+
+logger = logging.getLogger("text_analyzer")
+
+# 感情辞書の場所と、ポジティブ/ネガティブと判定するスコアの閾値
+SENTIMENT_LEXICON_PATH = os.getenv("SENTIMENT_LEXICON_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "sentiment_lexicon.json")
+SENTIMENT_THRESHOLD = float(os.getenv("SENTIMENT_THRESHOLD", "0.5"))
+
+# 文字種（0は区切り: 空白・句読点・記号）
+OTHER, HIRAGANA, KATAKANA, KANJI, LATIN = range(5)
+CHAR_CLASS_NAMES = {HIRAGANA: "hiragana", KATAKANA: "katakana", KANJI: "kanji", LATIN: "latin"}
+
+# 文字種ごとのコードポイントの範囲（両端を含む）
+CHAR_CLASS_RANGES = [
+    (HIRAGANA, 0x3041, 0x309F),
+    (KATAKANA, 0x30A0, 0x30FF),
+    (KATAKANA, 0x31F0, 0x31FF),
+    (KANJI, 0x3400, 0x4DBF),
+    (KANJI, 0x4E00, 0x9FFF),
+    (KANJI, 0xF900, 0xFAFF),
+    (KANJI, 0x3005, 0x3007),
+    (LATIN, 0x30, 0x39),
+    (LATIN, 0x41, 0x5A),
+    (LATIN, 0x61, 0x7A),
+    (LATIN, 0xC0, 0x24F)
+]
+
+
+def char_class(char):
+    """1文字の文字種を返す"""
+    code = ord(char)
+    for cls, low, high in CHAR_CLASS_RANGES:
+        if low <= code <= high:
+            return cls
+    return OTHER
+
+
+def tokenize(text):
+    """文字種の切れ目で単語に分割（空白・句読点・記号は捨てる）"""
+    tokens = []
+    current = []
+    previous = OTHER
+    for char in unicodedata.normalize("NFKC", text):
+        cls = char_class(char)
+        if current and cls != previous:
+            tokens.append("".join(current))
+            current = []
+        if cls != OTHER:
+            current.append(char)
+        previous = cls
+    if current:
+        tokens.append("".join(current))
+    return tokens
+
+
+def load_lexicon(path):
+    """感情辞書を読み込んで(語のリスト, 重みのリスト)を返す
+
+    形式: {"positive": ["語", ...] または {"語": 重み}, "negative": 同左}
+    ネガティブの語の重みは負の値として扱う
+    """
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+
+    weights = {}
+    for polarity, sign in (("positive", 1.0), ("negative", -1.0)):
+        entries = data.get(polarity, {})
+        if isinstance(entries, list):
+            entries = {term: 1.0 for term in entries}
+        for term, weight in entries.items():
+            term = fold_text(term)
+            if term:
+                weights[term] = weights.get(term, 0.0) + sign * abs(float(weight))
+    return list(weights), list(weights.values())
+
+
+class LexiconAutomaton(KeywordAutomaton):
+    """感情辞書の語をまとめたオートマトン（各状態には一致する語の番号のタプルを持つ）"""
+
+    def __init__(self, terms):
+        """初期化メソッド"""
+        super().__init__((term, (index,)) for index, term in enumerate(terms))
+
+    def _merge(self, a, b):
+        """一致する語の番号をまとめる"""
+        return a + b
+
+
+class TextAnalyzer:
+    """感情辞書と文字種の統計で複数のテキストを一括分析するクラス"""
+
+    def __init__(self, lexicon_path=SENTIMENT_LEXICON_PATH, threshold=SENTIMENT_THRESHOLD):
+        """初期化メソッド"""
+        self.threshold = threshold
+        try:
+            self.terms, self.weights = load_lexicon(lexicon_path)
+        except (OSError, ValueError) as e:
+            logger.error("感情辞書を読み込めませんでした（%s）: %s", lexicon_path, e)
+            self.terms, self.weights = [], []
+        self.automaton = LexiconAutomaton(self.terms)
+        logger.debug("TextAnalyzerを初期化しました（辞書: %s語）", len(self.terms))
+
+    def _char_classes(self, np, codes):
+        """コードポイント配列の各要素の文字種を返す"""
+        classes = np.zeros(len(codes), dtype=np.int8)
+        for cls, low, high in CHAR_CLASS_RANGES:
+            classes[(codes >= low) & (codes <= high)] = cls
+        return classes
+
+    def analyze_batch(self, texts):
+        """テキストのリストを分析し、テキストごとの分析結果のリストを返す"""
+        import numpy as np
+
+        count = len(texts)
+        if count == 0:
+            return []
+
+        # 感情スコア: 辞書の語の出現回数の行列と重みベクトルの積
+        # （各テキストを1回走査して見つかった(テキスト, 語)の組を行列に加算）
+        if self.terms:
+            rows, columns = [], []
+            for row, text in enumerate(texts):
+                for indexes in self.automaton.scan(text):
+                    rows.extend([row] * len(indexes))
+                    columns.extend(indexes)
+            occurrences = np.zeros((count, len(self.terms)), dtype=np.float32)
+            np.add.at(occurrences, (np.asarray(rows, dtype=np.intp), np.asarray(columns, dtype=np.intp)), 1)
+            scores = occurrences @ np.asarray(self.weights, dtype=np.float32)
+        else:
+            scores = np.zeros(count, dtype=np.float32)
+        sentiments = np.where(
+            scores >= self.threshold, "positive",
+            np.where(scores <= -self.threshold, "negative", "neutral")
+        )
+
+        # 文字種と単語数: 全テキストを連結したコードポイント配列で一括計算
+        normalized = [unicodedata.normalize("NFKC", text) for text in texts]
+        lengths = np.fromiter((len(text) for text in normalized), dtype=np.int64, count=count)
+        codes = np.frombuffer("".join(normalized).encode("utf-32-le"), dtype=np.uint32)
+        owners = np.repeat(np.arange(count), lengths)
+        classes = self._char_classes(np, codes)
+
+        # 文字種が前の文字と変わる位置（各テキストの先頭を含む）を単語の始まりとする
+        starts = np.ones(len(codes), dtype=bool)
+        if len(codes) > 1:
+            starts[1:] = classes[1:] != classes[:-1]
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        starts[offsets[lengths > 0]] = True
+        starts &= classes != OTHER
+        word_counts = np.bincount(owners[starts], minlength=count)
+
+        class_counts = np.zeros((count, len(CHAR_CLASS_NAMES) + 1), dtype=np.int64)
+        np.add.at(class_counts, (owners, classes), 1)
+
+        return [
+            {
+                "text": text,
+                "sentiment": str(sentiments[i]),
+                "score": float(scores[i]),
+                "word_count": int(word_counts[i]),
+                "char_count": len(text),
+                "char_classes": {name: int(class_counts[i, cls]) for cls, name in CHAR_CLASS_NAMES.items()}
+            }
+            for i, text in enumerate(texts)
+        ]
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+文字起こしキャッシュ
+アップロードされた音声のバイト列のハッシュをキーに、文字起こしとZonosの分析結果を保存します。
+同じ音声が再送された場合はデコードと音声認識を丸ごと省略できます。
+メモリ層とディスク層（1エントリ1ファイル）の両方をサイズ上限で管理します。
+"""
+
+import os
+import json
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from collections import OrderedDict
+
+logger = logging.getLogger("transcript_cache")
+
+# キャッシュ設定（サイズはMB）
+TRANSCRIPT_CACHE_MEMORY_MB = float(os.getenv("TRANSCRIPT_CACHE_MEMORY_MB", "16"))
+TRANSCRIPT_CACHE_DIR = os.getenv("TRANSCRIPT_CACHE_DIR") or None
+TRANSCRIPT_CACHE_DISK_MB = float(os.getenv("TRANSCRIPT_CACHE_DISK_MB", "256"))
+
+
+class TranscriptDiskStore:
+    """キーごとにJSONファイルを保存するディスク層（合計サイズが上限を超えたら古い順に削除）"""
+
+    def __init__(self, directory, max_bytes):
+        """初期化メソッド"""
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total = sum(path.stat().st_size for path in self.directory.glob("*.json"))
+
+    def _path(self, key):
+        return self.directory / f"{key}.json"
+
+    def get(self, key):
+        """キーに対応する値を返す（ない場合はNone）"""
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        # 最近使われたことを記録（削除は更新日時の古い順）
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        try:
+            return json.loads(data)
+        except ValueError:
+            # 書き込み途中のクラッシュなどで壊れたファイルは削除してミスとして扱う
+            logger.warning("壊れた文字起こしキャッシュを削除します: %s", path)
+            self._discard(path)
+            return None
+
+    def _discard(self, path):
+        """ファイルを削除して合計サイズから差し引く"""
+        with self._lock:
+            try:
+                size = path.stat().st_size
+                path.unlink()
+                self._total -= size
+            except FileNotFoundError:
+                pass
+
+    def set(self, key, value):
+        """値をアトミックに書き込む"""
+        data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        path = self._path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        with self._lock:
+            previous = path.stat().st_size if path.exists() else 0
+            os.replace(tmp_path, path)
+            self._total += len(data) - previous
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """合計サイズが上限の9割になるまで古いファイルから削除（ロック取得済みで呼ぶ）"""
+        files = sorted(self.directory.glob("*.json"), key=lambda p: p.stat().st_mtime)
+        target = self.max_bytes * 0.9
+        for path in files:
+            if self._total <= target:
+                break
+            try:
+                size = path.stat().st_size
+                path.unlink()
+                self._total -= size
+            except FileNotFoundError:
+                continue
+
+
+class TranscriptCache:
+    """音声のハッシュをキーにした文字起こしキャッシュ（メモリ層はサイズ上限付きLRU）"""
+
+    def __init__(self, memory_mb=TRANSCRIPT_CACHE_MEMORY_MB, directory=TRANSCRIPT_CACHE_DIR,
+                 disk_mb=TRANSCRIPT_CACHE_DISK_MB):
+        """初期化メソッド"""
+        self.max_bytes = int(memory_mb * 1024 * 1024)
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self.disk = TranscriptDiskStore(directory, int(disk_mb * 1024 * 1024)) if directory else None
+        logger.debug("TranscriptCacheを初期化しました（メモリ: %sMB, ディスク: %s）", memory_mb, directory)
+
+    @staticmethod
+    def make_key(digest, backend_name, language):
+        """音声のハッシュと認識設定からキャッシュキーを作成"""
+        return f"{digest}-{backend_name}-{language}"
+
+    def get(self, key):
+        """キャッシュから文字起こし結果を取得（ない場合はNone）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                with self._lock:
+                    self._store(key, value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value):
+        """文字起こし結果をキャッシュに保存"""
+        with self._lock:
+            self._store(key, value)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, value)
+            except OSError as e:
+                logger.warning("文字起こしキャッシュをディスクに保存できませんでした: %s", e)
+
+    def _store(self, key, value):
+        """メモリ層に保存し、サイズ上限を超えた分を古い順に削除（ロック取得済みで呼ぶ）"""
+        size = len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._size -= previous[1]
+        self._entries[key] = (value, size)
+        self._size += size
+        while self._size > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._size -= evicted
+            self.evictions += 1
+
+    def stats(self):
+        """ヒット/ミスなどの統計を返す"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "disk_enabled": self.disk is not None
+            }
@@ -0,0 +1,402 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+外部サービス呼び出しの保護
+Dify APIや音声認識などの外部サービスの呼び出しに、全体の期限（デッドライン）、
+ジッター付きバックオフでの再試行、遅い呼び出しへのヘッジ（最近のp95を過ぎたら2本目を送る）、
+サーキットブレーカー（連続して失敗したら一定時間すぐに失敗させる）を適用します。
+
+呼び出す関数はDeadlineを1つ受け取ります。期限を自分で守れない関数（タイムアウトを指定できない
+クライアントなど）は isolate=True でワーカースレッドで実行し、期限を過ぎたら待たずに失敗させます。
+"""
+
+import time
+import random
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+logger = logging.getLogger("upstream_guard")
+
+# サーキットブレーカーの状態
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(Exception):
+    """サーキットブレーカーが開いているため呼び出さなかった場合の例外"""
+
+
+class DeadlineExceeded(TimeoutError):
+    """呼び出しが期限までに終わらなかった場合の例外"""
+
+
+class Deadline:
+    """1回の呼び出しの期限（再試行やヘッジを含む全体）とキャンセルの状態"""
+
+    __slots__ = ("expires_at", "cancelled")
+
+    def __init__(self, timeout=None, expires_at=None):
+        """初期化メソッド"""
+        if expires_at is None and timeout:
+            expires_at = time.monotonic() + timeout
+        self.expires_at = expires_at
+        self.cancelled = False
+
+    def child(self):
+        """同じ期限で個別にキャンセルできるDeadlineを作成（ヘッジの各リクエスト用）"""
+        return Deadline(expires_at=self.expires_at)
+
+    def remaining(self):
+        """残り時間（秒、期限がない場合はNone）"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def timeout(self, default):
+        """defaultと残り時間の短い方（ソケットのタイムアウトなどに使う）"""
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        return min(default, remaining) if default is not None else remaining
+
+    def cancel(self):
+        """この呼び出しの結果が不要になったことを通知"""
+        self.cancelled = True
+
+    def check(self):
+        """期限切れまたはキャンセル済みの場合はDeadlineExceededを送出"""
+        if self.cancelled:
+            raise DeadlineExceeded("呼び出しはキャンセルされました")
+        if self.expires_at is not None and time.monotonic() >= self.expires_at:
+            raise DeadlineExceeded("呼び出しが期限を過ぎました")
+
+
+class CircuitBreaker:
+    """連続した失敗の回数で開閉するサーキットブレーカー"""
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        """初期化メソッド"""
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._probe_started = 0.0
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self):
+        """現在の状態（開いてから一定時間が経つと半開になる）"""
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        """現在の状態（ロック取得済みで呼ぶ）"""
+        now = time.monotonic()
+        if self._state == OPEN and now - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._probing = False
+        elif self._state == HALF_OPEN and self._probing and now - self._probe_started >= self.reset_timeout:
+            # 結果が記録されないまま時間が経った試しの呼び出しは見限り、次の1件を通す
+            self._probing = False
+        return self._state
+
+    def allow(self):
+        """呼び出してよいか（半開の間は試しの1件だけ通す）"""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self._probing:
+                self._probing = True
+                self._probe_started = time.monotonic()
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        """成功を記録して閉じる"""
+        with self._lock:
+            if self._state != CLOSED:
+                logger.info("%sのサーキットブレーカーを閉じました", self.name)
+            self._state = CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def release(self):
+        """成否の出ないまま終わった呼び出し（切断・キャンセル）の試しの枠を返す"""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probing = False
+
+    def record_failure(self):
+        """失敗を記録し、閾値に達したら（半開の場合はすぐに）開く"""
+        with self._lock:
+            self._failures += 1
+            state = self._current_state()
+            if state == HALF_OPEN or (state == CLOSED and self._failures >= self.failure_threshold):
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+                self.opened += 1
+                logger.warning("%sのサーキットブレーカーを開きました（%.0f秒間すぐに失敗させます）", self.name, self.reset_timeout)
+
+    def stats(self):
+        """状態と回数を返す"""
+        with self._lock:
+            return {
+                "state": self._current_state(),
+                "consecutive_failures": self._failures,
+                "opened": self.opened,
+                "rejected": self.rejected
+            }
+
+
+class UpstreamGuard:
+    """外部サービスの呼び出しに期限・再試行・ヘッジ・サーキットブレーカーを適用するクラス"""
+
+    def __init__(self, name, timeout=None, retries=0, backoff=0.2, max_backoff=2.0, hedge=False,
+                 hedge_min_delay=0.05, hedge_min_samples=20, failure_threshold=5, reset_timeout=30.0,
+                 isolate=False, max_workers=8, max_samples=200):
+        """初期化メソッド"""
+        self.name = name
+        self.timeout = timeout or None
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.isolate = isolate
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self._lock = threading.Lock()
+        self._latency = deque(maxlen=max_samples)
+        self._counts = {"calls": 0, "successes": 0, "failures": 0, "retries": 0, "timeouts": 0,
+                        "hedges": 0, "hedge_wins": 0}
+        self._executor = None
+        if isolate or hedge:
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-upstream")
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._counts[key] += amount
+
+    def deadline(self, enforce=True, timeout=None):
+        """新しい呼び出しのDeadlineを作成（timeoutでガードの期限を上書き）"""
+        return Deadline((timeout or self.timeout) if enforce else None)
+
+    def hedge_delay(self):
+        """ヘッジを送るまでの待ち時間（最近の成功した呼び出しのp95、サンプルが少ない間はNone）"""
+        with self._lock:
+            if len(self._latency) < self.hedge_min_samples:
+                return None
+            ordered = sorted(self._latency)
+        return max(self.hedge_min_delay, ordered[int(0.95 * (len(ordered) - 1))])
+
+    def backoff_delay(self, attempt, deadline):
+        """再試行までの待ち時間（フルジッター、残り時間を超えない）"""
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+        return deadline.timeout(delay)
+
+    def admit(self):
+        """サーキットブレーカーを確認（開いている場合はCircuitOpenError）"""
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.name}のサーキットブレーカーが開いています")
+
+    def record_result(self, latency=None, error=None, retryable=None):
+        """呼び出しの結果を記録（再試行すべきでないエラーはサービスの障害として数えない）"""
+        if error is None:
+            self.breaker.record_success()
+            with self._lock:
+                self._counts["successes"] += 1
+                if latency is not None:
+                    self._latency.append(latency)
+            return
+        self._count("failures")
+        if isinstance(error, DeadlineExceeded):
+            self._count("timeouts")
+        if isinstance(error, DeadlineExceeded) or retryable is None or retryable(error):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def release(self):
+        """結果を記録せずに終わった呼び出し（クライアントの切断・キャンセル）をサーキットブレーカーに通知"""
+        self.breaker.release()
+
+    def _submit(self, func, deadline):
+        """ワーカースレッドで実行（リクエストIDなどのコンテキストを引き継ぐ）"""
+        context = contextvars.copy_context()
+        return self._executor.submit(context.run, func, deadline)
+
+    def _attempt(self, func, deadline, hedge):
+        """1回分の呼び出し（必要に応じてワーカースレッドで実行し、ヘッジを送る）"""
+        delay = self.hedge_delay() if hedge and self.hedge else None
+        if delay is None and not self.isolate:
+            return func(deadline)
+
+        primary = deadline.child()
+        attempts = {self._submit(func, primary): primary}
+        remaining = deadline.remaining()
+        if delay is not None:
+            done, _ = wait(attempts, timeout=delay if remaining is None else min(delay, remaining))
+            if not done and (deadline.remaining() is None or deadline.remaining() > 0):
+                # 最初の呼び出しがp95を過ぎても終わらないため、2本目を送る
+                self._count("hedges")
+                secondary = deadline.child()
+                attempts[self._submit(func, secondary)] = secondary
+                logger.debug("%sにヘッジリクエストを送信しました（%.3f秒経過）", self.name, delay)
+
+        error = None
+        pending = set(attempts)
+        while pending:
+            done, pending = wait(pending, timeout=deadline.remaining(), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    for other, other_deadline in attempts.items():
+                        if other is not future:
+                            other_deadline.cancel()
+                    if attempts[future] is not primary:
+                        self._count("hedge_wins")
+                    return future.result()
+                error = future.exception()
+        if error is not None and not pending:
+            raise error
+        for attempt_deadline in attempts.values():
+            attempt_deadline.cancel()
+        raise DeadlineExceeded(f"{self.name}の呼び出しが期限を過ぎました")
+
+    def _as_deadline_error(self, error, deadline):
+        """期限に合わせて縮めたタイムアウトで失敗した場合は期限切れの例外に置き換える"""
+        if isinstance(error, DeadlineExceeded) or deadline.remaining() != 0:
+            return error
+        return DeadlineExceeded(f"{self.name}の呼び出しが期限を過ぎました")
+
+    def call(self, func, retryable=None, hedge=True, enforce_deadline=True, retries=None, timeout=None):
+        """func(deadline)を呼び出して結果を返す
+
+        retryableは例外を受け取り、再試行してよい（=サービスの障害として数える）場合にTrueを返す関数。
+        Noneの場合はすべての例外を再試行する。hedge=Falseでこの呼び出しのヘッジを無効にする
+        （会話の状態を変えるなど、同じリクエストを重複して送れない場合）。
+        retries・timeoutでこの呼び出しの再試行の回数・期限を上書きする（Noneの場合はガードの設定）。
+        """
+        self._count("calls")
+        deadline = self.deadline(enforce_deadline, timeout)
+        retries = self.retries if retries is None else max(0, retries)
+        attempt = 0
+        while True:
+            self.admit()
+            start = time.perf_counter()
+            try:
+                result = self._attempt(func, deadline, hedge)
+            except Exception as e:
+                error = self._as_deadline_error(e, deadline)
+                self.record_result(error=error, retryable=retryable)
+                if error is not e:
+                    raise error from e
+                if isinstance(e, DeadlineExceeded) or attempt >= retries:
+                    raise
+                if retryable is not None and not retryable(e):
+                    raise
+                delay = self.backoff_delay(attempt, deadline)
+                attempt += 1
+                self._count("retries")
+                logger.warning("%sの呼び出しに失敗しました（%s回目）: %s。%.2f秒後に再試行します", self.name, attempt, e, delay)
+                time.sleep(delay)
+                continue
+            except BaseException:
+                # 呼び出し元のキャンセルなど、成否が分からないまま終わった場合
+                self.release()
+                raise
+            self.record_result(latency=time.perf_counter() - start)
+            return result
+
+    async def _attempt_async(self, func, deadline, hedge):
+        """1回分の呼び出し（asyncio版、期限を過ぎたタスクはキャンセルする）"""
+        delay = self.hedge_delay() if hedge and self.hedge else None
+        primary = asyncio.ensure_future(func(deadline))
+        attempts = [primary]
+        try:
+            if delay is not None:
+                remaining = deadline.remaining()
+                done, _ = await asyncio.wait(attempts, timeout=delay if remaining is None else min(delay, remaining))
+                if not done and (deadline.remaining() is None or deadline.remaining() > 0):
+                    self._count("hedges")
+                    attempts.append(asyncio.ensure_future(func(deadline)))
+                    logger.debug("%sにヘッジリクエストを送信しました（%.3f秒経過）", self.name, delay)
+
+            error = None
+            pending = set(attempts)
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=deadline.remaining(), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self._count("hedge_wins")
+                        return task.result()
+                    error = task.exception()
+            if error is not None and not pending:
+                raise error
+            raise DeadlineExceeded(f"{self.name}の呼び出しが期限を過ぎました")
+        finally:
+            for task in attempts:
+                if not task.done():
+                    task.cancel()
+
+    async def call_async(self, func, retryable=None, hedge=True, enforce_deadline=True, retries=None, timeout=None):
+        """await func(deadline)を呼び出して結果を返す（asyncio版、引数はcallと同じ）"""
+        self._count("calls")
+        deadline = self.deadline(enforce_deadline, timeout)
+        retries = self.retries if retries is None else max(0, retries)
+        attempt = 0
+        while True:
+            self.admit()
+            start = time.perf_counter()
+            try:
+                result = await self._attempt_async(func, deadline, hedge)
+            except Exception as e:
+                error = self._as_deadline_error(e, deadline)
+                self.record_result(error=error, retryable=retryable)
+                if error is not e:
+                    raise error from e
+                if isinstance(e, DeadlineExceeded) or attempt >= retries:
+                    raise
+                if retryable is not None and not retryable(e):
+                    raise
+                delay = self.backoff_delay(attempt, deadline)
+                attempt += 1
+                self._count("retries")
+                logger.warning("%sの呼び出しに失敗しました（%s回目）: %s。%.2f秒後に再試行します", self.name, attempt, e, delay)
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # タスクのキャンセルなど、成否が分からないまま終わった場合
+                self.release()
+                raise
+            self.record_result(latency=time.perf_counter() - start)
+            return result
+
+    def stats(self):
+        """呼び出しの回数とサーキットブレーカーの状態を返す"""
+        with self._lock:
+            summary = dict(self._counts)
+        summary["hedge_delay"] = self.hedge_delay()
+        summary["breaker"] = self.breaker.stats()
+        return summary
+
+    def close(self):
+        """ワーカースレッドを停止（実行中の呼び出しは待たない）"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
@@ -0,0 +1,438 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+WebSocketによる音声会話セッション
+クライアントは話しながら16bitモノラルのPCMを少しずつ送ります。サーバーはフレームごとのエネルギーで
+発話の区間を検出し、発話中の短い間（ポーズ）ごとにそこまでの区間を先に認識しておきます（途中経過は
+partialとして返す）。発話の終わりを検出した時点では最後の区間だけを認識すればよいため、
+すぐにDify APIへの問い合わせを始め、回答（と任意で合成した音声）を同じソケットで逐次返します。
+
+接続ごとにセッションキーを持ち、同じ接続での発話は1つの会話として続けます。
+応答中にユーザーが話し始めた場合は応答を打ち切ります（バージイン）。
+
+クライアントからのメッセージ:
+    バイナリ                               PCM（16bitリトルエンディアン・モノラル）
+    {"type": "end"}                        発話の終わりを明示（プッシュトゥトーク）
+    {"type": "text", "text": "..."}        テキストで発話
+    {"type": "cancel"}                     応答を打ち切る
+    {"type": "config", "speak": true, "voice": "..."}  読み上げの設定を変更
+
+サーバーからのメッセージ（JSON）:
+    ready・speech_start・partial・utterance・message・audio・done・cancelled・error
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import threading
+
+from response_format import dumps_json, shape_result, parse_flag
+from log_setup import run_in_executor
+from stage_metrics import record_stage
+
+logger = logging.getLogger("voice_session")
+
+# 受け付けるサンプリングレートの範囲とデフォルト
+VOICE_SAMPLE_RATE = int(os.getenv("VOICE_SAMPLE_RATE", "16000"))
+VOICE_MIN_SAMPLE_RATE = 8000
+VOICE_MAX_SAMPLE_RATE = 48000
+
+# 発話の検出（dBFS）：固定の下限と、推定した雑音レベルからの差
+VOICE_THRESHOLD_DB = float(os.getenv("VOICE_THRESHOLD_DB", "-45"))
+VOICE_NOISE_MARGIN_DB = float(os.getenv("VOICE_NOISE_MARGIN_DB", "10"))
+
+# 発話の開始とみなす長さ・区間を先に認識するポーズ・発話の終わりとみなす無音の長さ（ミリ秒）
+VOICE_MIN_SPEECH_MS = int(os.getenv("VOICE_MIN_SPEECH_MS", "120"))
+VOICE_PAUSE_MS = int(os.getenv("VOICE_PAUSE_MS", "250"))
+VOICE_EOU_MS = int(os.getenv("VOICE_EOU_MS", "500"))
+
+# 1回の発話の最大の長さ（秒）と、発話の前に残しておく音声の長さ（ミリ秒）
+VOICE_MAX_UTTERANCE = float(os.getenv("VOICE_MAX_UTTERANCE", "15"))
+VOICE_PREROLL_MS = int(os.getenv("VOICE_PREROLL_MS", "300"))
+
+# 応答中にユーザーが話し始めたら応答を打ち切るか
+VOICE_BARGE_IN = os.getenv("VOICE_BARGE_IN", "True").lower() == "true"
+
+# エネルギーを計算するフレームの長さ（ミリ秒）
+FRAME_MS = 20
+
+# 雑音レベルの推定の追従の速さ（無音のフレームごと）
+NOISE_ADAPT_RATE = 0.05
+
+
+class EndpointDetector:
+    """PCMのフレームごとのエネルギーから、発話の開始・ポーズ・終わりを検出するクラス
+
+    イベントは(種類, ストリーム先頭からのバイト位置, 直前のポーズ以降に発話があったか)のタプルです。
+    """
+
+    def __init__(self, sample_rate, threshold_db=VOICE_THRESHOLD_DB, noise_margin_db=VOICE_NOISE_MARGIN_DB,
+                 min_speech_ms=VOICE_MIN_SPEECH_MS, pause_ms=VOICE_PAUSE_MS, eou_ms=VOICE_EOU_MS,
+                 max_utterance=VOICE_MAX_UTTERANCE):
+        """初期化メソッド"""
+        self.frame_bytes = sample_rate * FRAME_MS // 1000 * 2
+        self.threshold_db = threshold_db
+        self.noise_margin_db = noise_margin_db
+        self.min_speech_ms = min_speech_ms
+        self.pause_ms = pause_ms
+        self.eou_ms = eou_ms
+        self.max_utterance_bytes = int(max_utterance * sample_rate) * 2
+        self.noise_db = None
+        self.position = 0
+        self._pending = b""
+        self._reset()
+
+    def _reset(self):
+        """発話の状態を初期化"""
+        self.in_speech = False
+        self.started_at = None
+        self.speech_ms = 0
+        self.silence_ms = 0
+        self.paused = False
+        self.speech_since_pause = False
+
+    def _levels(self, data):
+        """フレームごとのRMSレベル（dBFS）"""
+        import numpy as np
+
+        samples = np.frombuffer(data, dtype="<i2").astype(np.float32)
+        frames = samples.reshape(-1, self.frame_bytes // 2)
+        rms = np.sqrt(np.mean(frames * frames, axis=1))
+        return 20 * np.log10(np.maximum(rms, 1.0) / 32768.0)
+
+    def feed(self, pcm):
+        """PCMを追加し、検出したイベントのリストを返す"""
+        data = self._pending + pcm
+        usable = len(data) - len(data) % self.frame_bytes
+        self._pending = data[usable:]
+        if not usable:
+            return []
+
+        events = []
+        for level in self._levels(data[:usable]).tolist():
+            self.position += self.frame_bytes
+            threshold = self.threshold_db
+            if self.noise_db is not None:
+                threshold = max(threshold, self.noise_db + self.noise_margin_db)
+
+            if level >= threshold:
+                self.speech_ms += FRAME_MS
+                self.silence_ms = 0
+                if self.in_speech:
+                    self.paused = False
+                    self.speech_since_pause = True
+                elif self.speech_ms >= self.min_speech_ms:
+                    self.in_speech = True
+                    self.started_at = self.position
+                    self.speech_since_pause = True
+                    events.append(("start", self.position, True))
+            else:
+                # 無音のフレームで雑音レベルを推定
+                self.noise_db = level if self.noise_db is None else (
+                    self.noise_db + (level - self.noise_db) * NOISE_ADAPT_RATE
+                )
+                if not self.in_speech:
+                    self.speech_ms = 0
+                    continue
+                self.silence_ms += FRAME_MS
+                if self.silence_ms >= self.eou_ms:
+                    events.append(("end", self.position, self.speech_since_pause))
+                    self._reset()
+                    continue
+                if not self.paused and self.silence_ms >= self.pause_ms:
+                    events.append(("pause", self.position, self.speech_since_pause))
+                    self.paused = True
+                    self.speech_since_pause = False
+
+            # 長すぎる発話はそこで区切る
+            if self.in_speech and self.position - self.started_at >= self.max_utterance_bytes:
+                events.append(("end", self.position, self.speech_since_pause))
+                self._reset()
+        return events
+
+    def force_end(self):
+        """発話の終わりを明示された場合（発話中でなければNone）"""
+        if not self.in_speech:
+            return None
+        event = ("end", self.position, self.speech_since_pause)
+        self._reset()
+        return event
+
+
+async def iterate_in_thread(frames, stop):
+    """同期ジェネレータをスレッドで回し、フレームを順に返す非同期ジェネレータ（stopで打ち切り）"""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    done = object()
+
+    def pump():
+        try:
+            for frame in frames:
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, frame)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            frames.close()
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+            except RuntimeError:
+                # イベントループが先に終了した場合
+                pass
+
+    run_in_executor(pump)
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # 上流の応答を待っているスレッドは次のフレームを受け取った時点で終わる
+        stop.set()
+
+
+def new_voice_session_key():
+    """接続ごとのセッションキー"""
+    return f"voice-{uuid.uuid4().hex}"
+
+
+class VoiceSession:
+    """1つのWebSocket接続の音声会話の状態（発話のバッファ・認識中の区間・応答中のタスク）"""
+
+    def __init__(self, integration, send_text, session_key=None, sample_rate=VOICE_SAMPLE_RATE,
+                 speak=False, voice=None, compact=True, barge_in=VOICE_BARGE_IN):
+        """初期化メソッド"""
+        self.integration = integration
+        self._send_text = send_text
+        self._send_lock = asyncio.Lock()
+        self._turn_lock = asyncio.Lock()
+        self.session_key = session_key or new_voice_session_key()
+        self.sample_rate = sample_rate
+        self.speak = speak
+        self.voice = voice
+        self.compact = compact
+        self.barge_in = barge_in
+        self.detector = EndpointDetector(sample_rate)
+        self.preroll_bytes = sample_rate * VOICE_PREROLL_MS // 1000 * 2
+        self.buffer = bytearray()
+        self.buffer_start = 0
+        self.committed = None
+        self.segments = []
+        self.turns = 0
+        self._tasks = set()
+        self._response = None
+        self._response_stop = None
+        self.closed = False
+
+    async def send(self, message):
+        """JSONメッセージを送信（複数のタスクから送るため直列化、切断後は送らない）"""
+        if self.closed:
+            return
+        async with self._send_lock:
+            try:
+                await self._send_text(dumps_json(message).decode("utf-8"))
+            except Exception as e:
+                logger.debug("音声セッションへの送信に失敗しました: %s", e)
+                self.closed = True
+
+    def _spawn(self, coroutine):
+        """セッションに属するタスクを開始（切断時にまとめてキャンセル）"""
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def start(self):
+        """接続の準備ができたことを通知"""
+        logger.info("音声セッションを開始しました（%sHz, 読み上げ: %s）", self.sample_rate, self.speak)
+        await self.send({
+            "type": "ready",
+            "session_key": self.session_key,
+            "sample_rate": self.sample_rate,
+            "speak": self.speak
+        })
+
+    async def feed_audio(self, pcm):
+        """受信したPCMを発話のバッファに追加し、検出したイベントを処理"""
+        self.buffer.extend(pcm)
+        for event in self.detector.feed(pcm):
+            await self._handle_event(event)
+
+        # 発話していない間は直前の一定時間だけ残す
+        if self.committed is None and len(self.buffer) > self.preroll_bytes:
+            drop = len(self.buffer) - self.preroll_bytes
+            del self.buffer[:drop]
+            self.buffer_start += drop
+
+    async def _handle_event(self, event):
+        """発話の開始・ポーズ・終わりの処理"""
+        kind, position, has_speech = event
+        if kind == "start":
+            self.committed = self.buffer_start
+            if self.barge_in and self._response is not None and not self._response.done():
+                await self.cancel_response("barge_in")
+            await self.send({"type": "speech_start"})
+            return
+
+        if self.committed is None:
+            return
+        # 直前のポーズ以降に発話がない区間（発話の後の無音）は認識しない
+        if has_speech:
+            segment = bytes(self.buffer[self.committed - self.buffer_start:position - self.buffer_start])
+            self.segments.append(self._spawn(self._recognize(segment, len(self.segments))))
+        self.committed = position
+        if kind == "pause":
+            return
+
+        # 発話の終わり：残りのバッファは次の発話に回す
+        segments, self.segments = self.segments, []
+        del self.buffer[:position - self.buffer_start]
+        self.buffer_start = position
+        self.committed = None
+        self._spawn(self._finish_utterance(segments, time.perf_counter()))
+
+    async def end_utterance(self):
+        """クライアントから発話の終わりを明示された場合の処理"""
+        event = self.detector.force_end()
+        if event is not None:
+            await self._handle_event(event)
+
+    async def _recognize(self, pcm, index):
+        """1区間を認識してテキストを返し、途中経過を区間の番号付きで送信（認識できない区間は空文字）"""
+        import speech_recognition as sr
+        from upstream_guard import CircuitOpenError, DeadlineExceeded
+
+        audio_data = sr.AudioData(pcm, self.sample_rate, 2)
+        try:
+            text = await run_in_executor(self.integration.recognize_speech, audio_data)
+        except sr.UnknownValueError:
+            return ""
+        except (sr.RequestError, DeadlineExceeded, CircuitOpenError) as e:
+            logger.error("音声認識に失敗しました: %s", e)
+            raise
+        await self.send({"type": "partial", "segment": index, "text": text})
+        return text
+
+    def _join(self, texts):
+        """区間ごとの認識結果をつなげる（日本語・中国語は区切りなし）"""
+        language = getattr(self.integration.asr_backend, "language", "") or ""
+        separator = "" if language.lower().startswith(("ja", "zh")) else " "
+        return separator.join(text for text in texts if text).strip()
+
+    async def _finish_utterance(self, segments, ended_at):
+        """全区間の認識を待って発話のテキストを確定し、応答を始める"""
+        try:
+            texts = await asyncio.gather(*segments)
+        except Exception:
+            await self.send({"type": "error", "status": "error", "message": "音声認識に失敗しました"})
+            return
+        text = self._join(texts)
+        recognized_at = time.perf_counter()
+        record_stage("voice.recognize_tail", recognized_at - ended_at)
+        if not text:
+            await self.send({"type": "utterance", "text": "", "status": "no_speech"})
+            return
+        await self.send({"type": "utterance", "text": text, "status": "success"})
+        await self.respond(text, ended_at, recognized_at)
+
+    async def respond(self, text, ended_at=None, recognized_at=None):
+        """Dify APIの回答（と読み上げの音声）をストリーミングで返す（会話の順序を保つため1ターンずつ）"""
+        async with self._turn_lock:
+            self.turns += 1
+            self._response_stop = threading.Event()
+            self._response = self._spawn(self._stream_response(
+                text, self._response_stop, ended_at or time.perf_counter(), recognized_at
+            ))
+            try:
+                await self._response
+            except asyncio.CancelledError:
+                if self.closed:
+                    raise
+            finally:
+                self._response = None
+
+    async def _stream_response(self, text, stop, ended_at, recognized_at):
+        """応答のフレームをクライアントに送る"""
+        frames = self.integration.stream_with_zonos(text, session_key=self.session_key)
+        if self.speak:
+            frames = self.integration.speak_frames(frames, self.voice)
+
+        latency = {}
+        if recognized_at is not None:
+            latency["recognition_ms"] = round((recognized_at - ended_at) * 1000, 1)
+        async for frame in iterate_in_thread(frames, stop):
+            event = frame.get("event", "message")
+            elapsed = time.perf_counter() - ended_at
+            if event == "message" and "first_token_ms" not in latency:
+                latency["first_token_ms"] = round(elapsed * 1000, 1)
+                record_stage("voice.first_token", elapsed)
+            elif event == "audio" and "first_audio_ms" not in latency:
+                latency["first_audio_ms"] = round(elapsed * 1000, 1)
+                record_stage("voice.first_audio", elapsed)
+
+            message = {key: value for key, value in frame.items() if key != "event"}
+            message["type"] = event
+            if event == "done":
+                latency["total_ms"] = round(elapsed * 1000, 1)
+                record_stage("voice.turn", elapsed)
+                message["result"] = shape_result(message.get("result"), compact=self.compact)
+                message["turn"] = self.turns
+                message["latency"] = latency
+            await self.send(message)
+
+    async def cancel_response(self, reason="cancel"):
+        """応答中であれば打ち切る"""
+        response = self._response
+        if response is None or response.done():
+            return
+        self._response_stop.set()
+        response.cancel()
+        logger.info("応答を打ち切りました（%s）", reason)
+        await self.send({"type": "cancelled", "reason": reason})
+
+    async def handle_control(self, text):
+        """クライアントからのJSONメッセージを処理"""
+        try:
+            message = json.loads(text)
+        except ValueError:
+            message = None
+        if not isinstance(message, dict):
+            await self.send({"type": "error", "status": "error", "message": "不正なメッセージです"})
+            return
+
+        kind = message.get("type")
+        if kind == "end":
+            await self.end_utterance()
+        elif kind == "text" and message.get("text"):
+            if self._response is not None and not self._response.done():
+                await self.cancel_response("new_input")
+            self._spawn(self.respond(str(message["text"])))
+        elif kind == "cancel":
+            await self.cancel_response()
+        elif kind == "config":
+            if "speak" in message:
+                self.speak = bool(parse_flag(message["speak"]))
+            if "voice" in message:
+                self.voice = message["voice"] or None
+        else:
+            await self.send({"type": "error", "status": "error", "message": f"不明なメッセージの種類です: {kind}"})
+
+    async def close(self):
+        """切断時に認識と応答を止める"""
+        self.closed = True
+        if self._response_stop is not None:
+            self._response_stop.set()
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks)
+        logger.info("音声セッションを終了しました（%sターン）", self.turns)
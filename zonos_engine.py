@@ -0,0 +1,490 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Zonosの実行エンジン（プロセスプールと動的バッチ処理）
+ZonosClientをワーカープロセスごとに1つずつ作成し、スレッドから同時に届いた
+generate_response・process_response・analyze_audio・synthesizeの呼び出しを、最大件数または最大待ち時間まで
+まとめてから空いているワーカーに渡します。torchを使う推論がGILを保持しても、
+リクエストを処理するスレッド同士が直列化されません。
+
+ZonosClientと同じ同期APIを提供するため、統合システムからはZonosClientの代わりにそのまま使えます。
+クライアントに *_batch メソッド（generate_batch・process_batch・analyze_batch・synthesize_batch）があれば
+バッチをまとめて渡し、なければ1件ずつ呼び出します。
+エンジン側の失敗（タイムアウト・ワーカーの異常終了）はZonosClientと同じ形式のエラー結果で返します。
+期限を過ぎても結果を返さないワーカーは強制終了し、新しいワーカーに入れ替えます。
+結果はワーカーごとのパイプで受け取るため、強制終了したワーカーが書き込み中だったとしても
+壊れるのはそのワーカーのパイプだけで、他のワーカーの結果の受け渡しは止まりません。
+"""
+
+import os
+import sys
+import time
+import queue
+import pickle
+import signal
+import logging
+import importlib
+import threading
+import multiprocessing
+from datetime import datetime
+from multiprocessing.connection import wait as wait_connections
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from stage_metrics import record_stage
+
+logger = logging.getLogger("zonos_engine")
+
+# ワーカープロセス数（0でプロセスプールを使わず、ZonosClientを直接呼び出す）
+ZONOS_WORKERS = int(os.getenv("ZONOS_WORKERS", "0"))
+
+# バッチの最大件数と、最初の呼び出しから待つ最大時間（秒）
+ZONOS_MAX_BATCH = int(os.getenv("ZONOS_MAX_BATCH", "8"))
+ZONOS_BATCH_WAIT = float(os.getenv("ZONOS_BATCH_WAIT", "0.005"))
+
+# 1回の呼び出しの期限（秒）
+ZONOS_TIMEOUT = float(os.getenv("ZONOS_TIMEOUT", "30"))
+
+# ワーカープロセスの起動方法（スレッドを持つ親プロセスからのforkを避けるためspawnがデフォルト）
+ZONOS_START_METHOD = os.getenv("ZONOS_START_METHOD", "spawn")
+
+# 異常終了・応答のないワーカーを確認する間隔（秒）
+WORKER_CHECK_INTERVAL = 0.5
+
+# 呼び出しとバッチ処理用メソッド・その引数の対応
+BATCH_METHODS = {
+    "generate_response": ("generate_batch", ("input_text", "context", "session_id")),
+    "process_response": ("process_batch", ("response_data", "session_id")),
+    "analyze_audio": ("analyze_batch", ("audio_text",)),
+    "synthesize": ("synthesize_batch", ("text", "voice"))
+}
+
+
+class ZonosEngineError(RuntimeError):
+    """エンジン側の失敗（タイムアウト・ワーカーの異常終了・停止後の呼び出し）"""
+
+
+def _portable_error(error):
+    """親プロセスに送れる例外にする（pickleできない例外はZonosEngineErrorに変換）"""
+    try:
+        pickle.dumps(error)
+        return error
+    except Exception:
+        return ZonosEngineError(f"{type(error).__name__}: {error}")
+
+
+def _call_one(client, method, kwargs):
+    """1件の呼び出し（省略された引数はクライアントのデフォルトに任せる）"""
+    first, *rest = BATCH_METHODS[method][1]
+    options = {name: kwargs[name] for name in rest if kwargs.get(name) is not None}
+    return getattr(client, method)(kwargs[first], **options)
+
+
+def _run_batch(client, calls):
+    """バッチをメソッドごとに実行し、呼び出しごとの(成否, 結果または例外)を入力と同じ順序で返す"""
+    outcomes = [None] * len(calls)
+    groups = {}
+    for index, (method, kwargs) in enumerate(calls):
+        groups.setdefault(method, []).append(index)
+
+    for method, indices in groups.items():
+        batch_name, params = BATCH_METHODS[method]
+        run_batch = getattr(client, batch_name, None)
+        if run_batch is not None and len(indices) > 1:
+            try:
+                results = run_batch(*[[calls[i][1].get(name) for i in indices] for name in params])
+            except Exception as e:
+                error = _portable_error(e)
+                for i in indices:
+                    outcomes[i] = (False, error)
+            else:
+                for i, result in zip(indices, results):
+                    outcomes[i] = (True, result)
+            continue
+
+        for i in indices:
+            try:
+                outcomes[i] = (True, _call_one(client, method, calls[i][1]))
+            except Exception as e:
+                outcomes[i] = (False, _portable_error(e))
+    return outcomes
+
+
+def _worker_main(worker_id, module_name, config, session_id, tasks, results):
+    # resultsはこのワーカー専用のパイプ（送信側）
+    """ワーカープロセスの処理（ZonosClientを作成し、バッチを受け取って実行結果を返す）"""
+    # 終了は親プロセスが指示する
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # 親プロセスのログ出力スレッドは引き継がれないため、標準エラー出力に直接書く
+    from log_setup import TEXT_FORMAT, LOG_LEVEL, RequestIdFilter
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    handler.addFilter(RequestIdFilter())
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL.upper())
+
+    client_class = importlib.import_module(module_name).ZonosClient
+    client = client_class(config) if config else client_class()
+    # 全ワーカーで同じデフォルトのセッションIDを使う
+    client.session_id = session_id
+    results.send(("ready", os.getpid()))
+
+    while True:
+        batch = tasks.get()
+        if batch is None:
+            break
+        start = time.perf_counter()
+        outcomes = _run_batch(client, batch)
+        results.send(("done", (outcomes, time.perf_counter() - start)))
+
+
+class _Request:
+    """1件の呼び出し"""
+
+    __slots__ = ("method", "kwargs", "future", "enqueued", "dispatched")
+
+    def __init__(self, method, kwargs):
+        """初期化メソッド"""
+        self.method = method
+        self.kwargs = kwargs
+        self.future = Future()
+        self.enqueued = time.monotonic()
+        self.dispatched = None
+
+
+class _Worker:
+    """ワーカープロセスと結果を受け取るパイプ、実行中のバッチ"""
+
+    __slots__ = ("process", "tasks", "results", "ready", "broken", "batch", "dispatched")
+
+    def __init__(self, process, tasks, results):
+        """初期化メソッド"""
+        self.process = process
+        self.tasks = tasks
+        self.results = results
+        self.ready = False
+        self.broken = False
+        self.batch = None
+        self.dispatched = None
+
+
+class ZonosEngine:
+    """ZonosClientのプロセスプールに呼び出しをまとめて振り分けるクラス（ZonosClientと同じ同期API）"""
+
+    def __init__(self, module_name="zonos_mock", workers=ZONOS_WORKERS, max_batch=ZONOS_MAX_BATCH,
+                 max_wait=ZONOS_BATCH_WAIT, timeout=ZONOS_TIMEOUT, config=None, start_method=ZONOS_START_METHOD):
+        """初期化メソッド"""
+        self.module_name = module_name
+        self.size = max(1, workers)
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.config = config
+        self.session_id = datetime.now().strftime("%Y%m%d%H%M%S")
+        self._context = multiprocessing.get_context(start_method)
+        # 停止時に結果を待っているコレクターを起こすためのパイプ
+        self._wake_reader, self._wake_writer = self._context.Pipe(duplex=False)
+        self._requests = queue.Queue()
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._stopping = threading.Event()
+        self._workers = {}
+        self._next_worker_id = 0
+        self.requests = 0
+        self.batches = 0
+        self.max_batch_seen = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.restarts = 0
+
+        with self._lock:
+            for _ in range(self.size):
+                self._spawn()
+        self._dispatcher = threading.Thread(target=self._dispatch, name="zonos-dispatcher", daemon=True)
+        self._collector = threading.Thread(target=self._collect, name="zonos-collector", daemon=True)
+        self._dispatcher.start()
+        self._collector.start()
+        logger.info("Zonosの実行エンジンを起動しました（ワーカー: %s, 最大バッチ: %s）", self.size, self.max_batch)
+
+    def _spawn(self):
+        """ワーカープロセスを1つ起動（ロック取得済みで呼ぶ）"""
+        worker_id = self._next_worker_id
+        self._next_worker_id += 1
+        tasks = self._context.Queue()
+        reader, writer = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=_worker_main,
+            args=(worker_id, self.module_name, self.config, self.session_id, tasks, writer),
+            name=f"zonos-worker-{worker_id}",
+            daemon=True
+        )
+        process.start()
+        # 送信側はワーカーだけが持つ（ワーカーが終了するとこちらの受信がEOFになる）
+        writer.close()
+        self._workers[worker_id] = _Worker(process, tasks, reader)
+
+    def wait_ready(self, timeout=60):
+        """全ワーカーのZonosClientの初期化が終わるまで待つ（期限内に終わればTrue）"""
+        deadline = time.monotonic() + timeout
+        with self._ready:
+            while sum(worker.ready for worker in self._workers.values()) < self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._ready.wait(remaining)
+        return True
+
+    def _next_batch(self):
+        """最初の呼び出しから最大待ち時間まで、最大件数までの呼び出しをまとめる（キャンセル済みは除く）"""
+        batch = []
+        deadline = None
+        while len(batch) < self.max_batch:
+            if deadline is None:
+                timeout = 0.5
+            else:
+                # ワーカーが空くまで待っていた呼び出しがあれば、すでに溜まっている分だけで送る
+                timeout = deadline - time.monotonic()
+            try:
+                request = self._requests.get(timeout=timeout) if timeout > 0 else self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                break
+            if not request.future.set_running_or_notify_cancel():
+                continue
+            if deadline is None:
+                deadline = request.enqueued + self.max_wait
+            batch.append(request)
+        return batch
+
+    def _dispatch(self):
+        """空いたワーカーにまとめた呼び出しを送る"""
+        while not self._stopping.is_set():
+            try:
+                worker_id = self._idle.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            with self._lock:
+                worker = self._workers.get(worker_id)
+            if worker is None:
+                continue
+
+            batch = self._next_batch()
+            if not batch:
+                self._idle.put(worker_id)
+                continue
+
+            now = time.monotonic()
+            with self._lock:
+                if self._workers.get(worker_id) is not worker:
+                    # 待っている間にワーカーが終了した場合は呼び出しを戻す
+                    for request in batch:
+                        self._requests.put(request)
+                    continue
+                worker.batch = batch
+                worker.dispatched = now
+                self.batches += 1
+                self.requests += len(batch)
+                self.max_batch_seen = max(self.max_batch_seen, len(batch))
+            for request in batch:
+                request.dispatched = now
+            worker.tasks.put([(request.method, request.kwargs) for request in batch])
+
+    def _collect(self):
+        """ワーカーからの結果を呼び出し元に返し、異常終了・応答のないワーカーを入れ替える"""
+        checked = time.monotonic()
+        while True:
+            # 結果が届き続けている間も一定間隔でワーカーを確認する
+            if time.monotonic() - checked >= WORKER_CHECK_INTERVAL and not self._stopping.is_set():
+                self._replace_dead_workers()
+                checked = time.monotonic()
+            with self._lock:
+                connections = {
+                    worker.results: (worker_id, worker)
+                    for worker_id, worker in self._workers.items() if not worker.broken
+                }
+            ready = wait_connections(list(connections) + [self._wake_reader], timeout=WORKER_CHECK_INTERVAL)
+            if self._wake_reader in ready:
+                return
+            for connection in ready:
+                worker_id, worker = connections[connection]
+                try:
+                    kind, payload = connection.recv()
+                except (EOFError, OSError):
+                    # ワーカーが終了した（次の確認で入れ替える）
+                    worker.broken = True
+                    continue
+                self._handle_result(worker_id, worker, kind, payload)
+
+    def _handle_result(self, worker_id, worker, kind, payload):
+        """ワーカーからの1件のメッセージを処理"""
+        with self._lock:
+            if self._workers.get(worker_id) is not worker:
+                # 入れ替え済みのワーカーからの結果（呼び出しは失敗させてある）
+                return
+            if kind == "ready":
+                worker.ready = True
+                self._ready.notify_all()
+                logger.debug("Zonosワーカー%sの準備ができました（PID: %s）", worker_id, payload)
+                batch = None
+            else:
+                batch, worker.batch, worker.dispatched = worker.batch, None, None
+        self._idle.put(worker_id)
+
+        if kind == "done" and batch:
+            outcomes, elapsed = payload
+            record_stage("zonos_batch", elapsed)
+            for request, (ok, value) in zip(batch, outcomes):
+                if ok:
+                    request.future.set_result(value)
+                else:
+                    request.future.set_exception(value)
+
+    def _replace_dead_workers(self):
+        """異常終了したワーカーと期限を過ぎても結果を返さないワーカーの呼び出しを失敗させ、新しいワーカーを起動"""
+        now = time.monotonic()
+        with self._lock:
+            for worker_id, worker in list(self._workers.items()):
+                if worker.broken or not worker.process.is_alive():
+                    logger.error(
+                        "Zonosワーカー%sが異常終了しました（終了コード: %s）、新しいワーカーを起動します",
+                        worker_id, worker.process.exitcode
+                    )
+                    if worker.process.is_alive():
+                        # パイプが閉じられたが終了しきっていないプロセス
+                        worker.process.terminate()
+                    error = ZonosEngineError("Zonosワーカーが処理中に終了しました")
+                elif worker.dispatched is not None and now - worker.dispatched >= self.timeout:
+                    # 実行中の呼び出しの期限が過ぎているため、応答を待たずにワーカーごと入れ替える
+                    logger.error(
+                        "Zonosワーカー%sが%s秒以内に結果を返さないため、強制終了して入れ替えます",
+                        worker_id, self.timeout
+                    )
+                    worker.process.terminate()
+                    error = ZonosEngineError("Zonosワーカーの処理がタイムアウトしました")
+                else:
+                    continue
+                del self._workers[worker_id]
+                for request in worker.batch or ():
+                    if not request.future.done():
+                        request.future.set_exception(error)
+                self.restarts += 1
+                self._spawn()
+
+    def _submit(self, method, kwargs):
+        """呼び出しを予約"""
+        if self._stopping.is_set():
+            raise ZonosEngineError("Zonosの実行エンジンは停止しています")
+        request = _Request(method, kwargs)
+        self._requests.put(request)
+        return request
+
+    def _result(self, request, session_id=None):
+        """呼び出しの結果を待つ（失敗した場合はZonosClientと同じ形式のエラー結果）"""
+        remaining = self.timeout - (time.monotonic() - request.enqueued)
+        try:
+            result = request.future.result(timeout=max(0.0, remaining))
+        except FutureTimeoutError:
+            # ワーカーに送る前であれば取り消す（送った後のバッチはワーカーごと入れ替える）
+            request.future.cancel()
+            with self._lock:
+                self.timeouts += 1
+            logger.error("Zonosの処理が%s秒以内に終わりませんでした（%s）", self.timeout, request.method)
+            return self._error_result("Zonosの処理がタイムアウトしました", session_id)
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            logger.error("Zonosの処理中にエラーが発生しました（%s）: %s", request.method, e)
+            return self._error_result(f"Zonosの処理中にエラーが発生しました: {e}", session_id)
+        if request.dispatched is not None:
+            record_stage("zonos_queue", request.dispatched - request.enqueued)
+        return result
+
+    def _error_result(self, message, session_id=None):
+        """ZonosClientのエラー結果と同じ形式の辞書"""
+        return {"status": "error", "message": message, "session_id": session_id or self.session_id}
+
+    def _call(self, method, session_id=None, **kwargs):
+        """1件の呼び出しを予約して結果を待つ"""
+        try:
+            request = self._submit(method, dict(kwargs, session_id=session_id))
+        except ZonosEngineError as e:
+            return self._error_result(str(e), session_id)
+        return self._result(request, session_id)
+
+    def generate_response(self, input_text, context=None, session_id=None):
+        """入力テキストに基づいてレスポンスを生成"""
+        return self._call("generate_response", session_id, input_text=input_text, context=context)
+
+    def process_response(self, response_data, session_id=None):
+        """レスポンスを処理"""
+        return self._call("process_response", session_id, response_data=response_data)
+
+    def analyze_audio(self, audio_text):
+        """音声テキストを分析"""
+        return self._call("analyze_audio", audio_text=audio_text)
+
+    def synthesize(self, text, voice=None):
+        """テキストを音声に合成"""
+        return self._call("synthesize", text=text, voice=voice)
+
+    def analyze_batch(self, audio_texts):
+        """複数の音声テキストを分析（ディスパッチャーが他の呼び出しとまとめてワーカーに渡す）"""
+        try:
+            requests = [self._submit("analyze_audio", {"audio_text": text}) for text in audio_texts]
+        except ZonosEngineError as e:
+            return [self._error_result(str(e)) for _ in audio_texts]
+        return [self._result(request) for request in requests]
+
+    def stats(self):
+        """ワーカー数とバッチ処理の統計を返す"""
+        with self._lock:
+            return {
+                "workers": len(self._workers),
+                "ready": sum(worker.ready for worker in self._workers.values()),
+                "busy": sum(worker.batch is not None for worker in self._workers.values()),
+                "queue_depth": self._requests.qsize(),
+                "requests": self.requests,
+                "batches": self.batches,
+                "avg_batch_size": self.requests / self.batches if self.batches else 0.0,
+                "max_batch_size": self.max_batch_seen,
+                "failed": self.failed,
+                "timeouts": self.timeouts,
+                "restarts": self.restarts
+            }
+
+    def close(self, timeout=5):
+        """ワーカーに終了を指示し、終わらないプロセスは強制終了"""
+        if self._stopping.is_set():
+            return
+        self._stopping.set()
+        self._requests.put(None)
+        self._dispatcher.join(timeout)
+
+        # 送られなかった呼び出しは失敗させる
+        while True:
+            try:
+                request = self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None and request.future.set_running_or_notify_cancel():
+                request.future.set_exception(ZonosEngineError("Zonosの実行エンジンは停止しています"))
+
+        with self._lock:
+            workers = list(self._workers.values())
+        for worker in workers:
+            worker.tasks.put(None)
+        deadline = time.monotonic() + timeout
+        for worker in workers:
+            worker.process.join(max(0.0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join(1)
+        self._wake_writer.send(None)
+        self._collector.join(timeout)
+        logger.info("Zonosの実行エンジンを停止しました")
@@ -4,19 +4,41 @@
 """
 Zonosフレームワークのモック
 実際のZonosフレームワークが利用可能になるまでの間、このモックを使用します。
+ZONOS_MOCK_LATENCYを指定すると、推論の所要時間（呼び出しごとの固定分と1件あたりの分）を模擬します。
+ZONOS_MOCK_CPU=Trueの場合はsleepではなくCPUを使って待ち、GILを保持する推論を再現します。
+音声合成（synthesize）は文字ごとの短いトーンを並べたPCMを返し、合成時間は音声の長さ×ZONOS_MOCK_SYNTH_RTFです。
 """
 
+import os
 import json
+import math
+import time
 import logging
+from array import array
 from datetime import datetime
 
-# ロガーの設定
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+from log_setup import Preview
+from intent_matcher import IntentMatcher, INTENT_RULES_PATH
+from text_analyzer import TextAnalyzer, SENTIMENT_LEXICON_PATH
+
+# ロガーの設定（出力先は呼び出し側のlog_setupで設定）
 logger = logging.getLogger('zonos_mock')
 
+# 模擬する推論の所要時間（秒、バッチごとの固定分と1件あたりの分）
+ZONOS_MOCK_LATENCY = float(os.getenv("ZONOS_MOCK_LATENCY", "0"))
+ZONOS_MOCK_ITEM_LATENCY = float(os.getenv("ZONOS_MOCK_ITEM_LATENCY", "0"))
+# TrueにするとCPUを使って待つ（GILを保持する）
+ZONOS_MOCK_CPU = os.getenv("ZONOS_MOCK_CPU", "False").lower() == "true"
+
+# 模擬する音声合成のサンプリングレートと、音声の長さに対する合成時間の比
+ZONOS_MOCK_SAMPLE_RATE = int(os.getenv("ZONOS_MOCK_SAMPLE_RATE", "24000"))
+ZONOS_MOCK_SYNTH_RTF = float(os.getenv("ZONOS_MOCK_SYNTH_RTF", "0"))
+
+# 模擬音声の1文字の長さと句読点の無音の長さ（秒）
+MOCK_CHAR_SECONDS = 0.08
+MOCK_PAUSE_SECONDS = 0.15
+MOCK_PAUSE_CHARS = "、。，．,.!?！？\n "
+
 class ZonosClient:
     """Zonosクライアントのモッククラス"""
     
@@ -24,25 +46,60 @@ class ZonosClient:
         """初期化メソッド"""
         self.config = config or {}
         self.session_id = datetime.now().strftime("%Y%m%d%H%M%S")
-        logger.info(f"ZonosClientが初期化されました。セッションID: {self.session_id}")
+        self.intent_matcher = IntentMatcher(self.config.get("intents_path", INTENT_RULES_PATH))
+        self.text_analyzer = TextAnalyzer(self.config.get("lexicon_path", SENTIMENT_LEXICON_PATH))
+        self.latency = self.config.get("latency", ZONOS_MOCK_LATENCY)
+        self.item_latency = self.config.get("item_latency", ZONOS_MOCK_ITEM_LATENCY)
+        self.cpu_bound = self.config.get("cpu_bound", ZONOS_MOCK_CPU)
+        self.sample_rate = self.config.get("sample_rate", ZONOS_MOCK_SAMPLE_RATE)
+        self.synth_rtf = self.config.get("synth_rtf", ZONOS_MOCK_SYNTH_RTF)
+        logger.info("ZonosClientが初期化されました。セッションID: %s", self.session_id)
+    
+    def _simulate_inference(self, count, seconds=0.0):
+        """count件分の推論の所要時間（と追加の秒数）を模擬"""
+        seconds += self.latency + self.item_latency * count
+        if seconds <= 0:
+            return
+        if not self.cpu_bound:
+            time.sleep(seconds)
+            return
+        # スレッドのCPU時間で計るため、GILを取り合うスレッドが同時に進むことはない
+        deadline = time.thread_time() + seconds
+        while time.thread_time() < deadline:
+            pass
+    
+    def process_response(self, response_data, session_id=None):
+        """レスポンスを処理するメソッド（session_idを省略した場合はクライアントのセッションID）"""
+        return self.process_batch([response_data], [session_id])[0]
+    
+    def process_batch(self, responses, session_ids=None):
+        """複数のレスポンスをまとめて処理するメソッド（結果は入力と同じ順序）"""
+        session_ids = session_ids or [None] * len(responses)
+        valid = sum(1 for response_data in responses if response_data)
+        if valid:
+            self._simulate_inference(valid)
+        return [
+            self._process_one(response_data, session_id or self.session_id)
+            for response_data, session_id in zip(responses, session_ids)
+        ]
     
-    def process_response(self, response_data):
-        """レスポンスを処理するメソッド"""
+    def _process_one(self, response_data, session_id):
+        """1件のレスポンスを処理"""
         if not response_data:
             logger.warning("空のレスポンスデータが渡されました")
             return {
                 "status": "error",
                 "message": "空のレスポンスデータ",
-                "session_id": self.session_id
+                "session_id": session_id
             }
         
-        logger.info(f"レスポンスデータを処理しています: {json.dumps(response_data, ensure_ascii=False)[:100]}...")
+        logger.info("レスポンスデータを処理しています: %s", Preview(response_data))
         
         # 実際の処理をシミュレート
         processed_data = {
             "status": "success",
             "message": "Zonosによる処理が完了しました",
-            "session_id": self.session_id,
+            "session_id": session_id,
             "timestamp": datetime.now().isoformat(),
             "processed_content": self._extract_content(response_data),
             "metadata": {
@@ -70,70 +127,93 @@ class ZonosClient:
     
     def analyze_audio(self, audio_text):
         """音声テキストを分析するメソッド"""
-        if not audio_text:
-            logger.warning("空の音声テキストが渡されました")
-            return {
-                "status": "error",
-                "message": "空の音声テキスト",
-                "session_id": self.session_id
-            }
+        return self.analyze_batch([audio_text])[0]
+    
+    def analyze_batch(self, audio_texts):
+        """複数の音声テキストをまとめて分析するメソッド（結果は入力と同じ順序）"""
+        results = [None] * len(audio_texts)
+        indices = []
+        for i, audio_text in enumerate(audio_texts):
+            if not audio_text:
+                logger.warning("空の音声テキストが渡されました")
+                results[i] = {
+                    "status": "error",
+                    "message": "空の音声テキスト",
+                    "session_id": self.session_id
+                }
+            else:
+                indices.append(i)
         
-        logger.info(f"音声テキストを分析しています: {audio_text[:100]}...")
+        if not indices:
+            return results
         
-        # 感情分析のシミュレーション
-        sentiment = "positive" if "ありがとう" in audio_text or "嬉しい" in audio_text else "neutral"
+        logger.info("音声テキストを分析しています: %d件", len(indices))
+        self._simulate_inference(len(indices))
         
-        analysis_result = {
-            "status": "success",
-            "message": "音声テキストの分析が完了しました",
-            "session_id": self.session_id,
-            "timestamp": datetime.now().isoformat(),
-            "analysis": {
-                "text": audio_text,
-                "sentiment": sentiment,
-                "word_count": len(audio_text.split()),
-                "char_count": len(audio_text)
-            },
-            "metadata": {
-                "source": "zonos_mock",
-                "version": "0.1.0"
+        # 感情辞書と文字種の統計で一括分析
+        analyses = self.text_analyzer.analyze_batch([audio_texts[i] for i in indices])
+        timestamp = datetime.now().isoformat()
+        for i, analysis in zip(indices, analyses):
+            results[i] = {
+                "status": "success",
+                "message": "音声テキストの分析が完了しました",
+                "session_id": self.session_id,
+                "timestamp": timestamp,
+                "analysis": analysis,
+                "metadata": {
+                    "source": "zonos_mock",
+                    "version": "0.1.0"
+                }
             }
-        }
         
         logger.info("音声テキストの分析が完了しました")
-        return analysis_result
+        return results
     
-    def generate_response(self, input_text, context=None):
-        """入力テキストに基づいてレスポンスを生成するメソッド"""
+    def generate_response(self, input_text, context=None, session_id=None):
+        """入力テキストに基づいてレスポンスを生成するメソッド（session_idを省略した場合はクライアントのセッションID）"""
+        return self.generate_batch([input_text], [context], [session_id])[0]
+    
+    def generate_batch(self, input_texts, contexts=None, session_ids=None):
+        """複数の入力テキストのレスポンスをまとめて生成するメソッド（結果は入力と同じ順序）"""
+        contexts = contexts or [None] * len(input_texts)
+        session_ids = session_ids or [None] * len(input_texts)
+        valid = sum(1 for input_text in input_texts if input_text)
+        if valid:
+            self._simulate_inference(valid)
+        return [
+            self._generate_one(input_text, context, session_id or self.session_id)
+            for input_text, context, session_id in zip(input_texts, contexts, session_ids)
+        ]
+    
+    def _generate_one(self, input_text, context, session_id):
+        """1件の入力テキストのレスポンスを生成"""
         if not input_text:
             logger.warning("空の入力テキストが渡されました")
             return {
                 "status": "error",
                 "message": "空の入力テキスト",
-                "session_id": self.session_id
+                "session_id": session_id
             }
         
-        logger.info(f"レスポンスを生成しています: {input_text[:100]}...")
+        logger.info("レスポンスを生成しています: %.100s...", input_text)
         context = context or {}
         
-        # 簡単なルールベースのレスポンス生成
-        if "こんにちは" in input_text or "hello" in input_text.lower():
-            response_text = "こんにちは！Zonosアシスタントです。どのようにお手伝いできますか？"
-        elif "ありがとう" in input_text or "thank" in input_text.lower():
-            response_text = "どういたしまして！他にお手伝いできることがあればお知らせください。"
-        elif "さようなら" in input_text or "bye" in input_text.lower():
-            response_text = "さようなら！またのご利用をお待ちしております。"
+        # ルールファイルのインテントに一致すればその応答を使用
+        intent = self.intent_matcher.match(input_text)
+        if intent is not None:
+            response_text = intent.response
         else:
             response_text = f"「{input_text[:20]}...」についてのお問い合わせを承りました。詳細を教えていただけますか？"
         
         response_data = {
             "status": "success",
             "message": "レスポンスの生成が完了しました",
-            "session_id": self.session_id,
+            "session_id": session_id,
             "timestamp": datetime.now().isoformat(),
             "response": {
                 "text": response_text,
                 "input": input_text,
+                "intent": intent.name if intent is not None else None,
                 "context": context
             },
             "metadata": {
@@ -145,8 +225,68 @@ class ZonosClient:
         logger.info("レスポンスの生成が完了しました")
         return response_data
 
+    def synthesize(self, text, voice=None):
+        """テキストを音声に合成するメソッド（16bitモノラルのPCM）"""
+        return self.synthesize_batch([text], [voice])[0]
+    
+    def synthesize_batch(self, texts, voices=None):
+        """複数のテキストをまとめて音声に合成するメソッド（結果は入力と同じ順序）"""
+        voices = voices or [None] * len(texts)
+        results = [None] * len(texts)
+        pcm = {}
+        for i, text in enumerate(texts):
+            if not text:
+                logger.warning("空の合成テキストが渡されました")
+                results[i] = {"status": "error", "message": "空の合成テキスト", "session_id": self.session_id}
+            else:
+                pcm[i] = self._tone_sequence(text, voices[i])
+        
+        if not pcm:
+            return results
+        
+        audio_seconds = sum(len(data) for data in pcm.values()) / 2 / self.sample_rate
+        self._simulate_inference(len(pcm), audio_seconds * self.synth_rtf)
+        timestamp = datetime.now().isoformat()
+        for i, data in pcm.items():
+            results[i] = {
+                "status": "success",
+                "message": "音声合成が完了しました",
+                "session_id": self.session_id,
+                "timestamp": timestamp,
+                "audio": data,
+                "sample_rate": self.sample_rate,
+                "sample_width": 2,
+                "channels": 1,
+                "metadata": {
+                    "source": "zonos_mock",
+                    "version": "0.1.0",
+                    "voice": voices[i]
+                }
+            }
+        logger.info("音声合成が完了しました: %d件（%.1f秒）", len(pcm), audio_seconds)
+        return results
+    
+    def _tone_sequence(self, text, voice=None):
+        """文字ごとに高さの異なる短いトーンを並べたPCM（句読点は無音）"""
+        base = 180 if voice is None else 120 + sum(map(ord, str(voice))) % 120
+        char_samples = int(self.sample_rate * MOCK_CHAR_SECONDS)
+        fade = char_samples // 8
+        samples = array("h")
+        for char in text:
+            if char in MOCK_PAUSE_CHARS:
+                samples.extend([0] * int(self.sample_rate * MOCK_PAUSE_SECONDS))
+                continue
+            step = 2 * math.pi * (base + ord(char) % 24 * 15) / self.sample_rate
+            for n in range(char_samples):
+                envelope = min(1.0, n / fade, (char_samples - n) / fade)
+                samples.append(int(6000 * envelope * math.sin(step * n)))
+        return samples.tobytes()
+
 # モジュールとして実行された場合のテスト
 if __name__ == "__main__":
+    from log_setup import setup_logging
+    setup_logging()
+    
     # ZonosClientのインスタンスを作成
     client = ZonosClient()
     